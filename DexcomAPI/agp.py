@@ -0,0 +1,184 @@
+# agp.py
+'''
+    Ambulatory Glucose Profile: the standard 14-90 day clinical report.
+
+    Readings are grouped by local time of day (15-minute buckets by
+    default) across every day of the period, and each bucket's 5th, 25th,
+    50th, 75th and 95th percentiles form the profile's bands. Next to it go
+    the GMI, the mean, SD and CV, sensor wear, and time in the consensus
+    ranges (very low <54, low 54-69, target 70-180, high 181-250, very high
+    >250 mg/dL).
+
+    Percentiles come from a table of value counts per bucket rather than
+    sorting each bucket: readings are whole mg/dL values within the sensor's
+    range, so one np.bincount builds the table in O(n), and every percentile
+    of every bucket is a vectorized search of its cumulative counts. The
+    results are exactly np.percentile's. Tables for different periods or
+    users add up, so a profile can be merged from per-period tables.
+'''
+
+import time
+from datetime import datetime
+
+import numpy as np
+
+MAX_MGDL = 511 # Dexcom reports 40-400; values are clipped to 0..MAX_MGDL
+DAY_SECONDS = 24 * 60 * 60
+BUCKET_MINUTES = 15
+PERCENTILES = (5, 25, 50, 75, 95)
+READINGS_PER_DAY = DAY_SECONDS // 300
+
+# (name, lowest mg/dL, highest mg/dL) of the consensus time-in-range bands
+BANDS = (
+    ("very_low", 0, 53),
+    ("low", 54, 69),
+    ("target", 70, 180),
+    ("high", 181, 250),
+    ("very_high", 251, MAX_MGDL),
+)
+
+def gmi(mean_mgdl):
+    """Glucose Management Indicator (%), the A1C estimate used in AGP reports."""
+    return 3.31 + 0.02392 * mean_mgdl
+
+def time_of_day(timestamps, tz=None):
+    """
+    Seconds since local midnight for epoch-second timestamps, in `tz` (a
+    tzinfo) or the system's local time. The UTC offset is looked up once per
+    hour present, so daylight saving changes are handled without converting
+    every reading.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    hours, index = np.unique(timestamps // 3600, return_inverse=True)
+    if tz is None:
+        offsets = [datetime.fromtimestamp(int(hour) * 3600).astimezone().utcoffset() for hour in hours]
+    else:
+        offsets = [datetime.fromtimestamp(int(hour) * 3600, tz).utcoffset() for hour in hours]
+    offsets = np.array([offset.total_seconds() for offset in offsets], dtype=np.int64)
+    return (timestamps + offsets[index.reshape(timestamps.shape)]) % DAY_SECONDS
+
+class ProfileCounts:
+    """Count of readings per (time-of-day bucket, mg/dL value). Combine tables with +."""
+
+    def __init__(self, bucket_minutes=BUCKET_MINUTES, counts=None):
+        if DAY_SECONDS % (bucket_minutes * 60):
+            raise ValueError(f"bucket_minutes must divide a day: {bucket_minutes}")
+        self.bucket_minutes = bucket_minutes
+        self.buckets = DAY_SECONDS // (bucket_minutes * 60)
+        self.counts = counts if counts is not None else np.zeros((self.buckets, MAX_MGDL + 1), dtype=np.int64)
+
+    @classmethod
+    def from_arrays(cls, values, timestamps, bucket_minutes=BUCKET_MINUTES, tz=None):
+        profile = cls(bucket_minutes)
+        profile.add(values, time_of_day(timestamps, tz))
+        return profile
+
+    def add(self, values, seconds_of_day):
+        """Count mg/dL values at the given seconds since local midnight."""
+        values = np.clip(np.asarray(values, dtype=np.int64), 0, MAX_MGDL)
+        buckets = np.asarray(seconds_of_day, dtype=np.int64) // (self.bucket_minutes * 60)
+        flat = np.bincount(buckets * (MAX_MGDL + 1) + values, minlength=self.counts.size)
+        self.counts += flat.reshape(self.counts.shape)
+
+    def __add__(self, other):
+        if other.bucket_minutes != self.bucket_minutes:
+            raise ValueError("Can't merge profiles with different bucket sizes")
+        return ProfileCounts(self.bucket_minutes, self.counts + other.counts)
+
+    @property
+    def count(self):
+        return int(self.counts.sum())
+
+    def bucket_counts(self):
+        return self.counts.sum(axis=1)
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """
+        (len(percentiles), buckets) array of each bucket's percentiles, with
+        np.percentile's linear interpolation; NaN for empty buckets.
+        """
+        sizes = self.bucket_counts()
+        cumulative = np.cumsum(self.counts, axis=1)
+        result = np.full((len(percentiles), self.buckets), np.nan)
+        filled = sizes > 0
+        cumulative, sizes = cumulative[filled], sizes[filled]
+
+        def order_statistic(ranks):
+            # Value of the rank-th smallest reading (0-based) in each bucket
+            return (cumulative <= ranks[:, None]).sum(axis=1)
+
+        for row, percentile in enumerate(percentiles):
+            position = (sizes - 1) * (percentile / 100)
+            lower = np.floor(position).astype(np.int64)
+            upper = np.minimum(lower + 1, sizes - 1)
+            below, above = order_statistic(lower), order_statistic(upper)
+            result[row, filled] = below + (position - lower) * (above - below)
+        return result
+
+    def totals(self):
+        """(count, mean, sample SD) over all buckets, from the counts."""
+        per_value = self.counts.sum(axis=0)
+        count = int(per_value.sum())
+        if not count:
+            return 0, None, None
+        values = np.arange(MAX_MGDL + 1)
+        mean = float(per_value @ values) / count
+        variance = float(per_value @ (values - mean) ** 2) / (count - 1) if count > 1 else 0.0
+        return count, mean, variance ** 0.5
+
+    def band_percentages(self):
+        """{band name: % of readings} for the consensus ranges."""
+        per_value = self.counts.sum(axis=0)
+        count = int(per_value.sum())
+        return {name: round(int(per_value[low:high + 1].sum()) / count * 100, 2) if count else None
+                for name, low, high in BANDS}
+
+def agp_report(values, timestamps, start, end, bucket_minutes=BUCKET_MINUTES, percentiles=PERCENTILES, tz=None):
+    """
+    The AGP for readings (mg/dL values and epoch-second timestamps, any
+    order) with start <= timestamp < end. Percentile lists have one entry
+    per bucket, None where a bucket has no readings.
+    """
+    values = np.asarray(values)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    mask = (timestamps >= start) & (timestamps < end)
+    profile = ProfileCounts.from_arrays(values[mask], timestamps[mask], bucket_minutes, tz)
+    return profile_report(profile, start, end, percentiles)
+
+def profile_report(profile, start, end, percentiles=PERCENTILES):
+    """agp_report for an already built (or merged) ProfileCounts."""
+    count, mean, stdev = profile.totals()
+    days = (end - start) / DAY_SECONDS
+    table = profile.percentiles(percentiles)
+    report = {
+        "start": int(start),
+        "end": int(end),
+        "days": round(days, 2),
+        "count": count,
+        "active_percentage": round(min(count / (days * READINGS_PER_DAY) * 100, 100), 2) if days > 0 else None,
+        "mean_mgdl": round(mean, 1) if count else None,
+        "stdev_mgdl": round(stdev, 1) if count else None,
+        "coef_variation_percentage": round(stdev / mean * 100, 1) if count and mean else None,
+        "gmi_percentage": round(gmi(mean), 1) if count else None,
+        "time_in_bands_percentage": profile.band_percentages(),
+        "bucket_minutes": profile.bucket_minutes,
+        "minutes_of_day": list(range(0, 24 * 60, profile.bucket_minutes)),
+        "bucket_counts": profile.bucket_counts().tolist(),
+    }
+    for row, percentile in enumerate(percentiles):
+        report[f"p{percentile}"] = [None if np.isnan(value) else round(float(value), 1) for value in table[row]]
+    return report
+
+def store_report(store, days=14, now=None, bucket_minutes=BUCKET_MINUTES, tz=None):
+    """The AGP for the past `days` days of a ReadingStore user's readings."""
+    end = int(time.time() if now is None else now) + 1
+    start = end - days * DAY_SECONDS
+    rows = np.array(store.get_value_rows(start, end), dtype=np.int64).reshape(-1, 2)
+    return agp_report(rows[:, 1], rows[:, 0], start, end, bucket_minutes, tz=tz)
+
+def readings_report(readings, days=14, now=None, bucket_minutes=BUCKET_MINUTES, tz=None):
+    """The AGP for pydexcom-style readings, e.g. the 24 hours a Dexcom client serves."""
+    end = int(time.time() if now is None else now) + 1
+    values = np.fromiter((reading.value for reading in readings), dtype=np.int64)
+    timestamps = np.fromiter((int(reading.datetime.timestamp()) for reading in readings), dtype=np.int64)
+    return agp_report(values, timestamps, end - days * DAY_SECONDS, end, bucket_minutes, tz=tz)
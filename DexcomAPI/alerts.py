@@ -0,0 +1,201 @@
+# alerts.py
+'''
+    Glucose alerting with hysteresis, snoozing and deduplication.
+
+    Each user has a set of alert conditions (urgent low, low, high, predicted
+    low, falling/rising fast). A condition notifies once when it starts,
+    then only again after its repeat interval while it lasts, and it doesn't
+    clear until the reading is back past the threshold by a margin, so a
+    reading hovering around 200 doesn't alert every five minutes. A more
+    serious alert suppresses the ones it implies (an urgent low already says
+    "low"), and snoozed conditions are tracked but not sent. State is kept
+    per user and can be saved to a JSON file between cron runs.
+'''
+
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+
+URGENT_LOW_MGDL = 55
+HIGH_MGDL = 200
+
+# pydexcom trend indexes
+DOUBLE_UP, SINGLE_UP, SINGLE_DOWN, DOUBLE_DOWN = 1, 2, 6, 7
+
+# Conditions in priority order, and what each one makes redundant
+KINDS = ("urgent_low", "low", "predicted_low", "falling_fast", "high", "rising_fast")
+SUPPRESSES = {
+    "urgent_low": ("low", "predicted_low", "falling_fast"),
+    "low": ("predicted_low",),
+    "high": ("rising_fast",),
+}
+
+@dataclass(frozen=True)
+class AlertRules:
+    urgent_low_mgdl: float = URGENT_LOW_MGDL
+    low_mgdl: float = 70
+    high_mgdl: float = HIGH_MGDL
+    hysteresis_mgdl: float = 10 # How far back past a threshold before its alert clears
+    predict_minutes: int = 30 # Horizon used for predicted_low
+    fall_rate: float = -3.0 # mg/dL per minute; Dexcom's double-down arrow
+    rise_rate: float = 3.0
+    rate_hysteresis: float = 1.0
+    # Seconds before an alert that is still active is sent again
+    repeat_seconds: dict = field(default_factory=lambda: {
+        "urgent_low": 15 * 60,
+        "low": 30 * 60,
+        "predicted_low": 30 * 60,
+        "falling_fast": 30 * 60,
+        "high": 2 * 60 * 60,
+        "rising_fast": 60 * 60,
+    })
+
+@dataclass
+class Alert:
+    kind: str
+    user_id: str
+    value: int
+    timestamp: int
+    message: str
+    repeat: bool = False # True when re-sent for a condition that was already active
+    sent_at: float = None # The evaluate() time recorded as this alert's last_sent
+
+@dataclass
+class AlertState:
+    active: dict = field(default_factory=dict) # kind -> epoch seconds it started
+    last_sent: dict = field(default_factory=dict) # kind -> epoch seconds
+    snoozed_until: dict = field(default_factory=dict) # kind -> epoch seconds
+    last_timestamp: int = None # Latest reading evaluated, so one reading never alerts twice
+
+def _conditions(rules, value, trend, rate, predicted):
+    """{kind: (starts, clears)} for one reading. A condition that neither starts nor clears keeps its state."""
+    hysteresis = rules.hysteresis_mgdl
+    falling = trend == DOUBLE_DOWN or (rate is not None and rate <= rules.fall_rate)
+    rising = trend == DOUBLE_UP or (rate is not None and rate >= rules.rise_rate)
+    return {
+        "urgent_low": (value < rules.urgent_low_mgdl, value >= rules.urgent_low_mgdl + hysteresis),
+        "low": (value < rules.low_mgdl, value >= rules.low_mgdl + hysteresis),
+        "predicted_low": (predicted is not None and predicted < rules.low_mgdl,
+                          predicted is None or predicted >= rules.low_mgdl + hysteresis),
+        "falling_fast": (falling, trend not in (SINGLE_DOWN, DOUBLE_DOWN)
+                         and (rate is None or rate > rules.fall_rate + rules.rate_hysteresis)),
+        "high": (value > rules.high_mgdl, value <= rules.high_mgdl - hysteresis),
+        "rising_fast": (rising, trend not in (SINGLE_UP, DOUBLE_UP)
+                        and (rate is None or rate < rules.rise_rate - rules.rate_hysteresis)),
+    }
+
+def alert_text(kind, reading, rate=None, predicted=None, rules=None):
+    rules = rules or AlertRules()
+    text = {
+        "urgent_low": "URGENT LOW",
+        "low": "LOW",
+        "predicted_low": f"Going low: {predicted:.0f} mg/dL predicted in {rules.predict_minutes} min" if predicted is not None else "Going low",
+        "falling_fast": "Falling fast",
+        "high": "HIGH",
+        "rising_fast": "Rising fast",
+    }[kind]
+    detail = f"{reading.value} {reading.trend_arrow} {reading.trend_description}"
+    if rate is not None and kind in ("falling_fast", "rising_fast"):
+        detail += f" ({rate:+.1f} mg/dL/min)"
+    return f"{text}: {detail}"
+
+class AlertEngine:
+    def __init__(self, rules=None, state_path=None):
+        """
+        rules: default AlertRules; evaluate() can take per-user rules instead
+        state_path: JSON file to load per-user state from and save it to
+        """
+        self.rules = rules or AlertRules()
+        self.state_path = state_path
+        self.states = {}
+        self._lock = threading.Lock() # Guards states and everything in them
+        self._save_lock = threading.Lock()
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as state_file:
+                self.states = {user_id: AlertState(**state) for user_id, state in json.load(state_file).items()}
+
+    def state(self, user_id):
+        with self._lock:
+            return self.states.setdefault(user_id, AlertState())
+
+    def save(self):
+        """Write a snapshot of every user's state; call it after sending, so a failed send isn't recorded as sent."""
+        if not self.state_path:
+            return
+        with self._lock:
+            data = {user_id: asdict(state) for user_id, state in self.states.items()}
+        with self._save_lock:
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, "w") as state_file:
+                json.dump(data, state_file)
+            os.replace(tmp_path, self.state_path)
+
+    def snooze(self, user_id, seconds, kinds=KINDS, now=None):
+        """Hold back the given alerts for `seconds`; their state is still tracked."""
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self.states.setdefault(user_id, AlertState())
+            for kind in kinds:
+                state.snoozed_until[kind] = now + seconds
+
+    def evaluate(self, user_id, reading, rate=None, predictions=None, rules=None, now=None):
+        """
+        Update `user_id`'s alert state for a new reading and return the
+        alerts to send now, most serious first.
+
+        rate: rate of change in mg/dL per minute (e.g. RollingSlope.rate)
+        predictions: {minutes ahead: predicted mg/dL} from a forecaster
+        """
+        rules = rules or self.rules
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self.states.setdefault(user_id, AlertState())
+            timestamp = int(reading.datetime.timestamp())
+            if state.last_timestamp is not None and timestamp <= state.last_timestamp:
+                return []
+            state.last_timestamp = timestamp
+
+            predicted = (predictions or {}).get(rules.predict_minutes)
+            due = []
+            for kind, (starts, clears) in _conditions(rules, reading.value, reading.trend, rate, predicted).items():
+                if kind in state.active:
+                    if clears:
+                        del state.active[kind]
+                        state.last_sent.pop(kind, None)
+                    elif starts and now - state.last_sent.get(kind, 0) >= rules.repeat_seconds[kind]:
+                        # Repeat only while still past the threshold, not while recovering inside the margin
+                        due.append((kind, True))
+                elif starts:
+                    state.active[kind] = now
+                    due.append((kind, False))
+
+            suppressed = {hidden for kind in state.active for hidden in SUPPRESSES.get(kind, ())}
+            alerts = []
+            for kind, repeat in due:
+                if kind in suppressed or state.snoozed_until.get(kind, 0) > now:
+                    continue
+                state.last_sent[kind] = now
+                alerts.append(Alert(kind, user_id, reading.value, timestamp,
+                                    alert_text(kind, reading, rate, predicted, rules), repeat, now))
+        return alerts
+
+    def mark_failed(self, alerts):
+        """
+        Undo what evaluate() recorded for alerts that could not be delivered,
+        so the next reading sends them again instead of waiting out repeat_seconds.
+        """
+        with self._lock:
+            for alert in alerts:
+                state = self.states.get(alert.user_id)
+                # Leave it if a later evaluate() has sent the alert again since
+                if state is None or state.last_sent.get(alert.kind) != alert.sent_at:
+                    continue
+                del state.last_sent[alert.kind]
+                if not alert.repeat:
+                    state.active.pop(alert.kind, None)
+
+def notification_body(alerts):
+    """One message for everything that fired on a reading, rather than one send per alert."""
+    return "\n".join(alert.message for alert in alerts)
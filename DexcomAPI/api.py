@@ -0,0 +1,207 @@
+# api.py
+'''
+    JSON API for dashboards that poll: /api/metrics and /api/readings?since=
+
+    Responses carry an ETag built from the latest reading's timestamp, so a
+    poll that arrives before the next reading gets a bodyless 304.
+    /api/stream pushes the same data to browsers as server-sent events, and
+    /api/graph.png (or .svg) serves the cached glucose graph, and /api/agp
+    (or /api/agp.png) the Ambulatory Glucose Profile of up to 90 days.
+'''
+
+import math
+import threading
+import time
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+try:
+    from DexcomAPI import agp, graph_service, stat_functions as stats
+    from DexcomAPI.instrumentation import span
+    from DexcomAPI.live import LiveFeed
+    from DexcomAPI.ranges import RangeSettings
+except ImportError:
+    import agp
+    import graph_service
+    import stat_functions as stats
+    from instrumentation import span
+    from live import LiveFeed
+    from ranges import RangeSettings
+
+PRECOMPUTED_ENTRIES = 16 # Enough for every range in use at the latest reading, so they don't evict each other
+
+def latest_timestamp(source):
+    """Epoch seconds of the newest reading in `source` (a ReadingStore or Dexcom-like client)."""
+    if hasattr(source, "get_latest_timestamp"):
+        return source.get_latest_timestamp()
+    reading = source.get_latest_glucose_reading()
+    return int(reading.datetime.timestamp()) if reading else None
+
+def reading_to_dict(reading):
+    return {
+        "timestamp": int(reading.datetime.timestamp()),
+        "mgdl": reading.value,
+        "mmol": round(reading.value / stats.MGDL_PER_MMOL, 1),
+        "trend": reading.trend_direction,
+        "trend_description": reading.trend_description,
+        "trend_arrow": reading.trend_arrow,
+    }
+
+def readings_since(source, since):
+    """Readings strictly newer than `since` (epoch seconds), newest first."""
+    if hasattr(source, "get_readings"):
+        return source.get_readings(start=since + 1)
+    minutes = min(1440, max(1, math.ceil((time.time() - since) / 60)))
+    readings = source.get_glucose_readings(minutes=minutes, max_count=288)
+    return [reading for reading in readings if reading.datetime.timestamp() > since]
+
+def agp_report(source, days):
+    """The AGP over `days` days from a ReadingStore, or over what a Dexcom-like client serves."""
+    if hasattr(source, "get_value_rows"):
+        return agp.store_report(source, days)
+    return agp.readings_report(source.get_glucose_readings(minutes=1440, max_count=288), days)
+
+def create_api_blueprint(get_source, user_id="default", ranges=None):
+    """
+    get_source: called per request, returns the ReadingStore or Dexcom-like
+    client to read from (syncing it first if needed)
+    user_id: whose readings these are, for keying cached graphs and their target range
+    ranges: ranges.RangeSettings holding the user's target range
+    """
+    ranges = ranges or RangeSettings()
+    api = Blueprint("api", __name__, url_prefix="/api")
+    precomputed = {} # (user, ETag) -> metrics payload, the most recent PRECOMPUTED_ENTRIES
+    precomputed_lock = threading.Lock()
+    # (latest timestamp, days) -> AGP report; an LRU, so profiles of older readings age out
+    profiles = graph_service.GraphCache(max_entries=8)
+
+    def live_payload(source, latest):
+        readings = source.get_glucose_readings(minutes=1440, max_count=288)
+        window = stats.GlucoseWindow(readings, ranges.get(user_id))
+        return {
+            "latest_timestamp": latest,
+            "reading": reading_to_dict(readings[0]) if readings else None,
+            "metrics": window.as_dict(),
+        }
+
+    feed = LiveFeed(get_source, latest_timestamp, live_payload)
+    api.live_feed = feed
+
+    def conditional(etag, build):
+        """Return 304 if the client already has `etag`, otherwise build the JSON response."""
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify(build())
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    @api.route("/metrics")
+    def metrics():
+        source = get_source()
+        latest = latest_timestamp(source)
+        if latest is None:
+            return jsonify({"error": "No glucose readings available"}), 503
+        glucose_range = ranges.get(user_id)
+        etag = f"{latest}-{glucose_range.low_mgdl}-{glucose_range.high_mgdl}"
+
+        # Metrics only change when a reading arrives (or the range changes), so compute them once per ETag.
+        # The payload is held locally: another request may evict it from `precomputed` before this one responds
+        key = (user_id, etag)
+        with precomputed_lock:
+            payload = precomputed.get(key)
+        if payload is None and not request.if_none_match.contains(etag):
+            with span("metrics"):
+                glucose_data = stats.get_glucose_metrics(source, glucose_range)
+            if not glucose_data:
+                return jsonify({"error": "Failed to retrieve glucose metrics"}), 503
+            payload = {"latest_timestamp": latest, **glucose_data}
+            with precomputed_lock:
+                precomputed[key] = payload
+                while len(precomputed) > PRECOMPUTED_ENTRIES:
+                    del precomputed[next(iter(precomputed))] # Oldest first: dicts keep insertion order
+
+        return conditional(etag, lambda: payload)
+
+    @api.route("/readings")
+    def readings():
+        since = request.args.get("since", type=int)
+        source = get_source()
+        latest = latest_timestamp(source)
+        if latest is None:
+            return jsonify({"latest_timestamp": None, "readings": []})
+        if since is None:
+            since = latest - 24 * 60 * 60
+
+        def build():
+            return {
+                "latest_timestamp": latest,
+                "readings": [reading_to_dict(reading) for reading in readings_since(source, since)],
+            }
+
+        return conditional(f"{latest}-{since}", build)
+
+    @api.route("/graph.<fmt>")
+    def graph(fmt):
+        if fmt not in graph_service.MIMETYPES:
+            return jsonify({"error": f"Unsupported graph format: {fmt}"}), 404
+        units = "mmol" if request.args.get("units") == "mmol" else "mgdl"
+        minutes = min(1440, max(5, request.args.get("minutes", 1440, type=int)))
+        source = get_source()
+        glucose_range = ranges.get(user_id)
+        with span("graph"):
+            image, latest = graph_service.get_glucose_graph(
+                source, user_id, units, fmt, minutes, glucose_range.low_mgdl, glucose_range.high_mgdl)
+
+        etag = f"{latest}-{units}-{minutes}-{glucose_range.low_mgdl}-{glucose_range.high_mgdl}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(image, mimetype=graph_service.MIMETYPES[fmt])
+        response.set_etag(etag)
+        # The image can only change when a new reading arrives or the range changes. The range is the
+        # user's and in the ETag, so only the browser may keep it: a shared cache must not serve it to others
+        response.headers["Cache-Control"] = "private, max-age=60"
+        return response
+
+    @api.route("/agp", defaults={"fmt": "json"})
+    @api.route("/agp.<fmt>")
+    def ambulatory_glucose_profile(fmt):
+        if fmt != "json" and fmt not in graph_service.MIMETYPES:
+            return jsonify({"error": f"Unsupported AGP format: {fmt}"}), 404
+        days = min(90, max(1, request.args.get("days", 14, type=int)))
+        units = "mmol" if request.args.get("units") == "mmol" else "mgdl"
+        source = get_source()
+        latest = latest_timestamp(source)
+        if latest is None:
+            return jsonify({"error": "No glucose readings available"}), 503
+
+        glucose_range = ranges.get(user_id)
+        low, high = glucose_range.low_mgdl, glucose_range.high_mgdl
+        etag = f"agp-{latest}-{days}" if fmt == "json" else f"agp-{latest}-{days}-{units}-{low}-{high}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            # A profile only changes when a reading arrives, so compute it once per window and reading
+            with span("agp"):
+                report = profiles.get_or_render((latest, days), lambda: agp_report(source, days))
+            if fmt == "json":
+                response = jsonify(report)
+            else:
+                with span("graph"):
+                    image = graph_service.graph_cache.get_or_render(
+                        (user_id, "agp", units, fmt, days, low, high, latest),
+                        lambda: graph_service.render_agp_graph(report, units, fmt, low, high))
+                response = Response(image, mimetype=graph_service.MIMETYPES[fmt])
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    @api.route("/stream")
+    def stream():
+        return Response(stream_with_context(feed.events()), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no", # Don't let nginx buffer the stream
+        })
+
+    return api
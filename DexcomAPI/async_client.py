@@ -0,0 +1,225 @@
+# async_client.py
+'''
+    asyncio Dexcom client for refreshing many accounts at once.
+
+    Speaks the same Dexcom Share endpoints as pydexcom, and the v2 `egvs`
+    endpoint used by app.py, over one pooled aiohttp session. Readings come
+    back as pydexcom GlucoseReading objects so the stats code can use them
+    unchanged.
+'''
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+import aiohttp
+from pydexcom import GlucoseReading
+from defs import DexcomConnectionError
+from database import reading_from_row, reading_timestamp, store_new_readings, sync_request, sync_request_since
+
+SHARE_BASE_URLS = {
+    "us": "https://share2.dexcom.com/ShareWebServices/Services/",
+    "ous": "https://shareous1.dexcom.com/ShareWebServices/Services/",
+}
+SHARE_APPLICATION_ID = "d89443d2-327c-4a6f-89e5-496bbb0317db"
+AUTHENTICATE_ENDPOINT = "General/AuthenticatePublisherAccount"
+LOGIN_ID_ENDPOINT = "General/LoginPublisherAccountById"
+GLUCOSE_READINGS_ENDPOINT = "Publisher/ReadPublisherLatestGlucoseValues"
+SESSION_ERROR_CODES = ("SessionIdNotFound", "SessionNotValid")
+
+EGVS_URL = "https://api.dexcom.com/v2/users/self/egvs"
+
+DEFAULT_CONCURRENCY = 20
+DEFAULT_TIMEOUT = 10 # seconds, per request
+DEFAULT_LIMIT_PER_HOST = 20
+
+class AsyncDexcom:
+    """
+    Dexcom Share account for use with an aiohttp session.
+
+    Holds only the account and session IDs, so one instance can be reused
+    across polling cycles (and event loops) without logging in again.
+    """
+
+    def __init__(self, username, password, region="us", user_id=None, base_url=None):
+        """base_url: a Share-compatible server to use instead of the region's, e.g. synthetic.ShareServer"""
+        self.username = username
+        self.password = password
+        self.user_id = user_id or username
+        self.base_url = base_url or SHARE_BASE_URLS[region]
+        self.account_id = None
+        self.session_id = None
+
+    async def _post(self, http, endpoint, params=None, json=None):
+        async with http.post(f"{self.base_url}{endpoint}", params=params, json=json or {}) as response:
+            body = await response.json(content_type=None)
+            if response.status != 200:
+                code = body.get("Code") if isinstance(body, dict) else None
+                raise DexcomConnectionError(f"{code or response.status}: {body}")
+            return body
+
+    async def login(self, http):
+        if self.account_id is None:
+            self.account_id = await self._post(http, AUTHENTICATE_ENDPOINT, json={
+                "accountName": self.username,
+                "password": self.password,
+                "applicationId": SHARE_APPLICATION_ID,
+            })
+        self.session_id = await self._post(http, LOGIN_ID_ENDPOINT, json={
+            "accountId": self.account_id,
+            "password": self.password,
+            "applicationId": SHARE_APPLICATION_ID,
+        })
+
+    async def get_glucose_readings(self, http, minutes=1440, max_count=288):
+        """Readings from the past `minutes`, newest first, logging in again once if the session expired."""
+        if self.session_id is None:
+            await self.login(http)
+        params = {"sessionId": self.session_id, "minutes": minutes, "maxCount": max_count}
+        try:
+            readings = await self._post(http, GLUCOSE_READINGS_ENDPOINT, params=params)
+        except DexcomConnectionError as e:
+            if not str(e).startswith(SESSION_ERROR_CODES):
+                raise
+            await self.login(http)
+            params["sessionId"] = self.session_id
+            readings = await self._post(http, GLUCOSE_READINGS_ENDPOINT, params=params)
+        return [GlucoseReading(reading) for reading in readings]
+
+    async def get_current_glucose_reading(self, http):
+        readings = await self.get_glucose_readings(http, minutes=10, max_count=1)
+        return readings[0] if readings else None
+
+def open_session(timeout=DEFAULT_TIMEOUT, limit_per_host=DEFAULT_LIMIT_PER_HOST):
+    """A pooled aiohttp session; connections to each Dexcom host are reused across accounts."""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit_per_host=limit_per_host),
+        timeout=aiohttp.ClientTimeout(total=timeout),
+        headers={"Accept-Encoding": "application/json"},
+    )
+
+async def _gather_limited(coroutines, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(limited(c) for c in coroutines), return_exceptions=True)
+
+async def fetch_many(clients, minutes=1440, max_count=288, concurrency=DEFAULT_CONCURRENCY,
+                     timeout=DEFAULT_TIMEOUT, limit_per_host=DEFAULT_LIMIT_PER_HOST):
+    """
+    Fetch a window of readings for every AsyncDexcom in `clients` concurrently.
+
+    Returns {user_id: readings}, with the exception in place of the readings
+    for any account that failed.
+    """
+    async with open_session(timeout, limit_per_host) as http:
+        results = await _gather_limited(
+            [client.get_glucose_readings(http, minutes, max_count) for client in clients], concurrency)
+    return {client.user_id: result for client, result in zip(clients, results)}
+
+async def fetch_current_many(clients, concurrency=DEFAULT_CONCURRENCY,
+                             timeout=DEFAULT_TIMEOUT, limit_per_host=DEFAULT_LIMIT_PER_HOST):
+    """Like fetch_many, but only each account's current reading (or None)."""
+    async with open_session(timeout, limit_per_host) as http:
+        results = await _gather_limited(
+            [client.get_current_glucose_reading(http) for client in clients], concurrency)
+    return {client.user_id: result for client, result in zip(clients, results)}
+
+async def sync_many(clients_and_stores, concurrency=DEFAULT_CONCURRENCY,
+                    timeout=DEFAULT_TIMEOUT, limit_per_host=DEFAULT_LIMIT_PER_HOST):
+    """
+    Async version of database.sync_readings for many (AsyncDexcom, ReadingStore) pairs.
+
+    Only accounts with a reading due are requested. Returns {user_id: new
+    reading count}, with the exception in place of the count on failure.
+    Store reads and writes run in worker threads, so a slow disk holds up
+    only the account it is writing, never the event loop and every other
+    account's fetch.
+    """
+    clients_and_stores = list(clients_and_stores)
+    requests = await asyncio.to_thread(lambda: [sync_request(store) for _, store in clients_and_stores])
+    due = []
+    counts = {}
+    for (client, store), request in zip(clients_and_stores, requests):
+        if request is None:
+            counts[client.user_id] = 0
+        else:
+            due.append((client, store, request))
+
+    async def sync_one(http, client, store, request):
+        latest, minutes, max_count = request
+        readings = await client.get_glucose_readings(http, minutes, max_count)
+        return await asyncio.to_thread(store_new_readings, store, readings, latest)
+
+    async with open_session(timeout, limit_per_host) as http:
+        results = await _gather_limited(
+            [sync_one(http, client, store, request) for client, store, request in due], concurrency)
+
+    for (client, _, _), result in zip(due, results):
+        if isinstance(result, Exception):
+            logging.error(f"Syncing {client.user_id} failed: {result}")
+        counts[client.user_id] = result
+    return counts
+
+async def sync_many_bulk(clients, writer, concurrency=DEFAULT_CONCURRENCY,
+                         timeout=DEFAULT_TIMEOUT, limit_per_host=DEFAULT_LIMIT_PER_HOST):
+    """
+    sync_many for a fleet sharing one `readings` table through a
+    database.BulkReadingWriter: one query for every user's latest timestamp,
+    concurrent fetches, then multi-row inserts in a single flush.
+
+    Returns {user_id: new reading count}, with the exception in place of the count on failure.
+    """
+    clients = list(clients)
+    # Database calls run in a worker thread, off the event loop
+    latest = await asyncio.to_thread(writer.latest_timestamps, [client.user_id for client in clients])
+    due = []
+    counts = {}
+    for client in clients:
+        request = sync_request_since(latest[client.user_id])
+        if request is None:
+            counts[client.user_id] = 0
+        else:
+            due.append((client, request))
+
+    async with open_session(timeout, limit_per_host) as http:
+        results = await _gather_limited(
+            [client.get_glucose_readings(http, minutes, max_count) for client, (_, minutes, max_count) in due], concurrency)
+
+    for (client, (user_latest, _, _)), result in zip(due, results):
+        if isinstance(result, Exception):
+            logging.error(f"Syncing {client.user_id} failed: {result}")
+            counts[client.user_id] = result
+            continue
+        if user_latest is not None:
+            result = [reading for reading in result if reading_timestamp(reading) > user_latest]
+        counts[client.user_id] = await asyncio.to_thread(writer.add, client.user_id, result) # May flush
+    await asyncio.to_thread(writer.flush)
+    return counts
+
+def egv_to_reading(record):
+    """Convert a v2 `egvs` record to a GlucoseReading."""
+    system_time = datetime.fromisoformat(record["systemTime"]).replace(tzinfo=timezone.utc)
+    trend = record.get("trend") or "none"
+    return reading_from_row(int(system_time.timestamp()), record["value"], trend[:1].upper() + trend[1:])
+
+async def get_egvs(http, access_token, start_date, end_date, url=EGVS_URL):
+    """Readings between two ISO dates from the OAuth v2 `egvs` endpoint, newest first."""
+    headers = {"Authorization": f"Bearer {access_token}"}
+    params = {"startDate": start_date, "endDate": end_date}
+    async with http.get(url, headers=headers, params=params) as response:
+        if response.status != 200:
+            raise DexcomConnectionError(f"{response.status}: {await response.text()}")
+        body = await response.json()
+    readings = [egv_to_reading(record) for record in body.get("egvs", [])]
+    return sorted(readings, key=lambda reading: reading.datetime, reverse=True)
+
+async def fetch_egvs_many(access_tokens, start_date, end_date, concurrency=DEFAULT_CONCURRENCY,
+                          timeout=DEFAULT_TIMEOUT, limit_per_host=DEFAULT_LIMIT_PER_HOST, url=EGVS_URL):
+    """Fetch `egvs` for every {user_id: access_token} concurrently."""
+    async with open_session(timeout, limit_per_host) as http:
+        results = await _gather_limited(
+            [get_egvs(http, token, start_date, end_date, url) for token in access_tokens.values()], concurrency)
+    return dict(zip(access_tokens, results))
@@ -2,48 +2,60 @@
 ''' 
     a reduced, simplified  main.py file that will
     run every five minutes with low amounts of data usage
+    (for many users in one long-running process, see scheduler.py).
+    It imports nothing that only graphs or reports need, since starting
+    Python is most of what a run every five minutes costs.
 '''
 
-import smtplib
-from pydexcom import Dexcom
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from defs import get_dexcom_connection, get_sender_email_credentials, get_receiver_email, get_sql_database_connection
-from stat_functions import concise_message_mdgl 
+from defs import config, get_dexcom_connection, get_sender_email_credentials, get_receiver_email
+from database import ReadingStore, sync_readings
+from alerts import AlertEngine, notification_body
+from notifications import SMTPTransport
+from rolling_slope import RollingSlope
 
 def send_notification(email_username, email_password, receiver_email, body):
-    message = MIMEMultipart()
-    # message["From"] = email_username
-    message["To"] = receiver_email
-    # message["Subject"] = subject
-    message.attach(MIMEText(body, 'plain'))
-
     try:
-        domain = email_username.split('@')[-1]
-        smtp_server = f"smtp.{domain}"
-        smtp_port = 587
-        with smtplib.SMTP(smtp_server, smtp_port) as server:
-            server.starttls()
-            server.login(email_username, email_password)
-            server.sendmail(email_username, receiver_email, message.as_string())
+        transport = SMTPTransport(email_username, email_password)
+        try:
+            transport.send(receiver_email, body)
+        finally:
+            transport.close()
         print("Message sent successfully")
+        return True
     except Exception as e:
         print(f"error: {e}")
+        return False
+
+def main():
+    dexcom = get_dexcom_connection()
+    email_username, email_password = get_sender_email_credentials()
+    receiver_email = get_receiver_email()
+
+    # Only asks Dexcom for readings newer than the last stored one
+    store = ReadingStore(config.reading_store_path, user_id=config.dexcom_username)
+    sync_readings(dexcom, store)
+
+    glucose_data = store.get_current_glucose_reading()
+    if glucose_data is None:
+        raise SystemExit("No glucose reading in the last 10 minutes.")
 
-dexcom = get_dexcom_connection()
-email_username, email_password = get_sender_email_credentials()
-receiver_email = get_receiver_email()
+    # Rate of change and a 30 minute prediction from the last few readings
+    slope = RollingSlope()
+    slope.add_readings(store.get_glucose_readings(minutes=30, max_count=slope.points))
 
-glucose_data = dexcom.get_current_glucose_reading()
-glucose_value = glucose_data.value
-glucose_trend = glucose_data.trend_description
+    # Alert state is kept between runs so a sustained high or low isn't re-sent every 5 minutes
+    engine = AlertEngine(state_path=config.alert_state_path)
+    alerts = engine.evaluate(config.dexcom_username, glucose_data, rate=slope.rate, predictions=slope.predict_many())
 
-if glucose_value < 55 or glucose_value > 200:
-    message = f"{glucose_value} + {glucose_trend}"
-    print(message)
+    if alerts:
+        message = notification_body(alerts)
+        print(message)
 
-    # Send SMS notification
-    receiver = get_receiver_email()
-    send_notification(receiver, message)
+        # Send SMS notification; if it fails, don't save, so the next run evaluates this reading again
+        if not send_notification(email_username, email_password, receiver_email, message):
+            return
 
+    engine.save()
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#benchmark_metrics.py
+'''
+    Compare the vectorized metrics module with the statistics-module
+    implementation it replaced, on 1 day, 90 days and 1 year of synthetic
+    5-minute readings, then the per-new-reading cost of recomputing a
+    rolling window versus updating rolling_stats. Run with: python benchmark_metrics.py
+'''
+
+import statistics
+import timeit
+import numpy as np
+from metrics import compute_metrics
+from rolling_stats import DAY_SECONDS, RollingStats
+
+READINGS_PER_DAY = 288
+PERIODS = {"1 day": 1, "90 days": 90, "1 year": 365}
+
+def synthetic_values(days, seed=0):
+    """A random walk of mg/dL values clipped to the sensor's 40-400 range."""
+    rng = np.random.default_rng(seed)
+    steps = rng.integers(-8, 9, size=days * READINGS_PER_DAY)
+    return np.clip(120 + np.cumsum(steps), 40, 400).astype(np.int16)
+
+def statistics_metrics(glucose_values, low=70, high=180):
+    """The per-metric statistics/list-comprehension computation stat_functions used before."""
+    average = round(statistics.mean(glucose_values), 4)
+    stdev = round(statistics.stdev(glucose_values), 4)
+    in_range_glucose = [g for g in glucose_values if low <= g <= high]
+    return {
+        "average_mgdl": average,
+        "median_mgdl": round(statistics.median(glucose_values), 4),
+        "stdev_mgdl": stdev,
+        "min_mgdl": min(glucose_values),
+        "max_mgdl": max(glucose_values),
+        "time_in_range_percentage": round((len(in_range_glucose) / len(glucose_values)) * 100, 4),
+        "mgdl_above_high": sum(reading - high for reading in glucose_values if reading > high),
+        "mgdl_below_low": sum(low - reading for reading in glucose_values if reading < low),
+        "coef_variation_percentage": round((stdev / average) * 100, 4),
+    }
+
+def best_time(func, repeat=5):
+    """Best-of-`repeat` seconds per call."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def main():
+    print(f"{'period':<10}{'readings':>10}{'statistics':>14}{'numpy':>12}{'speedup':>10}")
+    for label, days in PERIODS.items():
+        values = synthetic_values(days)
+        value_list = values.tolist()
+
+        expected = statistics_metrics(value_list)
+        actual = compute_metrics(values)
+        for key, value in expected.items():
+            assert abs(actual[key] - value) < 1e-3, f"{key}: {actual[key]} != {value}"
+
+        statistics_time = best_time(lambda: statistics_metrics(value_list))
+        numpy_time = best_time(lambda: compute_metrics(values))
+        print(f"{label:<10}{values.size:>10}{statistics_time * 1e3:>12.3f}ms{numpy_time * 1e3:>10.3f}ms"
+              f"{statistics_time / numpy_time:>9.1f}x")
+
+def rolling_benchmark(days=14):
+    """Per-reading cost of keeping a `days` window current: recompute vs incremental update."""
+    values = synthetic_values(days + 1).tolist()
+    window = days * READINGS_PER_DAY
+    stats = RollingStats(days * DAY_SECONDS)
+    for index, value in enumerate(values[:window]):
+        stats.add(index * 300, value)
+
+    new_readings = list(enumerate(values[window:], start=window))
+    recompute_time = best_time(lambda: compute_metrics(np.asarray(values[-window:], dtype=np.int16)))
+
+    def incremental():
+        for index, value in new_readings:
+            stats.add(index * 300, value)
+            stats.metrics()
+    incremental_time = timeit.timeit(incremental, number=1) / len(new_readings)
+    print(f"\nper new reading, {days}-day window: recompute {recompute_time * 1e6:.1f}us, "
+          f"rolling_stats {incremental_time * 1e6:.1f}us")
+
+if __name__ == "__main__":
+    main()
+    rolling_benchmark()
@@ -0,0 +1,352 @@
+#benchmark_suite.py
+'''
+    End-to-end benchmarks, run offline against synthetic Dexcom data.
+
+    Times the Flask `/` (offlineApp.py) and `/show-dexcom-data` (app.py)
+    routes, each stat_functions metric, graph rendering, ReadingStore and
+    BulkReadingWriter inserts, the slope.py and arima.py forecasts, and the
+    alert/notification path, and the cold-start imports of each dexval.py
+    command. Every benchmark reports p50/p95/mean milliseconds and how many
+    calls it made to Dexcom per operation.
+
+    Run with: python benchmark_suite.py [--output results.json] [--compare baseline.json]
+    --compare exits non-zero if any p50 got slower than --threshold allows,
+    and so does any dexval command over its import budget.
+'''
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from cryptography.fernet import Fernet
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="dexval-bench-")
+
+# Never reach Dexcom, and keep every file the apps write out of the working tree
+os.environ["dexcom_replay"] = "synthetic"
+os.environ["DEXCOM_USERNAME"] = "benchmark"
+os.environ["reading_store_path"] = os.path.join(WORK_DIR, "glucose_readings.db")
+os.environ["credential_cache_path"] = os.path.join(WORK_DIR, "credentials")
+os.environ["credential_cache_key"] = Fernet.generate_key().decode()
+os.environ["alert_state_path"] = os.path.join(WORK_DIR, "alert_state.json")
+sys.path.insert(0, ROOT)
+
+from DexcomAPI import agp, alerts, database, forecast, graph_service, stat_functions as stats, synthetic # noqa: E402
+from DexcomAPI.notifications import NotificationDispatcher, StubTransport # noqa: E402
+from DexcomAPI.rolling_slope import RollingSlope # noqa: E402
+
+METRIC_FUNCTIONS = (
+    "get_current_value_mdgl", "get_current_value_mmol", "get_current_trend_arrow",
+    "get_glucose_state_mdgl", "get_glucose_state_mmol",
+    "get_average_glucose_mgdl", "get_median_glucose_mgdl", "get_stdev_glucose_mgdl",
+    "get_min_glucose_mgdl", "get_max_glucose_mgdl", "get_glucose_range_mgdl",
+    "get_coef_variation_percentage", "get_glycemic_variability_index", "get_estimated_a1c",
+    "get_time_in_range_percentage", "get_glucose_metrics", "verbose_message_mgdl", "concise_message_mdgl",
+)
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def measure(name, func, runs=50, upstream=None, per_call=1, setup=None):
+    """
+    Time `runs` calls of `func` after one warmup call. `upstream` is a
+    zero-argument callable returning the upstream call count so far, and
+    `per_call` how many operations one call performs (for throughput).
+    """
+    if setup:
+        setup()
+    func()
+    before = upstream() if upstream else 0
+    samples = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    result = {
+        "name": name,
+        "runs": runs,
+        "p50_ms": round(percentile(samples, 0.5), 4),
+        "p95_ms": round(percentile(samples, 0.95), 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+    }
+    if upstream:
+        result["upstream_calls_per_run"] = round((upstream() - before) / runs, 3)
+    if per_call > 1:
+        result["ops_per_second"] = round(per_call / (result["mean_ms"] / 1000), 1)
+    print(f"{name:<48}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}"
+          f"{result.get('upstream_calls_per_run', ''):>10}")
+    return result
+
+class UpstreamHTTP:
+    """Stands in for the `requests` module at app.py's Dexcom v2 API call, counting requests."""
+
+    class Response:
+        status_code = 200
+        text = "{}"
+
+        def json(self):
+            return {"egvs": []}
+
+    def __init__(self):
+        self.calls = 0
+        self.exceptions = __import__("requests").exceptions
+
+    def get(self, *args, **kwargs):
+        self.calls += 1
+        return self.Response()
+
+    post = get
+
+def bench_routes(runs, latency_seconds):
+    import app as online_app
+    import offlineApp
+
+    results = []
+    source = offlineApp.dexcom.dexcom # the synthetic client under the instrumentation proxy
+    source.latency_seconds = latency_seconds
+    client = offlineApp.app.test_client()
+    results.append(measure("GET / (offlineApp)", lambda: client.get("/"), runs, lambda: source.stats.calls))
+    results.append(measure("GET /api/metrics (offlineApp)", lambda: client.get("/api/metrics"), runs,
+                           lambda: source.stats.calls))
+
+    # app.py wraps its source in a ReadingCache; count calls on the synthetic client underneath
+    upstream = online_app.dexcom.dexcom.dexcom
+    upstream.latency_seconds = latency_seconds
+    egvs = UpstreamHTTP()
+    online_app.requests = egvs
+    from DexcomAPI import defs
+    defs.get_credential_cache().set("oauth:benchmark", {"access_token": "benchmark"}, ttl=24 * 60 * 60)
+    client = online_app.app.test_client()
+    with client.session_transaction() as session:
+        session["dexcom_token_id"] = "benchmark"
+    results.append(measure("GET /show-dexcom-data (app)", lambda: client.get("/show-dexcom-data"), runs,
+                           lambda: upstream.stats.calls + egvs.calls))
+    return results
+
+def bench_metrics(runs, dexcom):
+    results = []
+    for name in METRIC_FUNCTIONS:
+        func = getattr(stats, name)
+        results.append(measure(f"stat_functions.{name}", lambda: func(dexcom), runs, lambda: dexcom.stats.calls))
+    window = stats.GlucoseWindow.fetch(dexcom)
+    results.append(measure("GlucoseWindow.fetch (all metrics)", lambda: stats.GlucoseWindow.fetch(dexcom), runs,
+                           lambda: dexcom.stats.calls))
+    results.append(measure("GlucoseWindow.as_dict", window.as_dict, runs))
+    return results
+
+def bench_graphs(runs, dexcom, store):
+    readings = dexcom.get_glucose_readings()
+    cache = graph_service.GraphCache()
+    results = [
+        measure("render_glucose_graph png", lambda: graph_service.render_glucose_graph(readings, fmt="png"), runs // 5 or 1),
+        measure("render_glucose_graph svg", lambda: graph_service.render_glucose_graph(readings, fmt="svg"), runs // 5 or 1),
+        measure("get_glucose_graph (cached)", lambda: graph_service.get_glucose_graph(dexcom, "bench", cache=cache), runs,
+                lambda: dexcom.stats.calls),
+    ]
+    report = agp.store_report(store, 90)
+    results.append(measure("agp.store_report 90 days", lambda: agp.store_report(store, 90), runs // 5 or 1))
+    results.append(measure("render_agp_graph png", lambda: graph_service.render_agp_graph(report), runs // 5 or 1))
+    return results
+
+def bench_database(runs):
+    path = os.path.join(WORK_DIR, "inserts.db")
+    readings = synthetic.generate_readings(days=1, seed=7)
+    counter = iter(range(10 ** 9))
+
+    def fresh_store():
+        return database.ReadingStore(path, user_id=f"user-{next(counter)}")
+
+    holder = {}
+    results = [
+        measure("ReadingStore.insert_readings 1 reading", lambda: holder["store"].insert_readings(readings[:1]), runs,
+                setup=lambda: holder.update(store=fresh_store())),
+        measure("ReadingStore.insert_readings 288 readings", lambda: holder["store"].insert_readings(readings), runs // 5 or 1,
+                per_call=len(readings), setup=lambda: holder.update(store=fresh_store())),
+    ]
+
+    import sqlite3
+    fleet = synthetic.generate_fleet(users=100, days=1, seed=3)
+    fleet = {user_id: synthetic.series_to_readings(*series) for user_id, series in fleet.items()}
+    rows = sum(len(user_readings) for user_readings in fleet.values())
+
+    def bulk():
+        with database.BulkReadingWriter(lambda: sqlite3.connect(path), dialect="sqlite") as writer:
+            for user_id, user_readings in fleet.items():
+                writer.add(f"{user_id}-{next(counter)}", user_readings)
+    results.append(measure(f"BulkReadingWriter {rows} rows / 100 users", bulk, runs // 10 or 1, per_call=rows))
+    return results
+
+def bench_forecasts(runs, store):
+    readings = store.get_readings(max_count=5)
+    slope = RollingSlope(points=5)
+    slope.add_readings(readings)
+
+    def slope_forecast():
+        fit = RollingSlope(points=5)
+        fit.add_readings(store.get_glucose_readings(minutes=1440, max_count=5))
+        return fit.predict_many(horizons=(5, 10, 15, 20))
+
+    models = forecast.ForecastModels(os.path.join(WORK_DIR, "forecast_models"), model="ar")
+    horizons = tuple(range(5, 50, 5))
+    return [
+        measure("slope.py: read 5 + RollingSlope predict", slope_forecast, runs),
+        measure("RollingSlope.add + predict_many", lambda: (slope.add(slope.latest + 300, 120), slope.predict_many()), runs),
+        measure("arima.py: ForecastModels.forecast (fitted)", lambda: models.forecast("bench", store, horizons), runs),
+        measure("ARForecaster fit 14 days", lambda: forecast.make_forecaster("ar").fit_readings(
+            store.get_readings(start=time.time() - 14 * 24 * 60 * 60)), runs // 10 or 1),
+    ]
+
+def bench_alerts(runs, dexcom):
+    readings = list(reversed(dexcom.get_glucose_readings()))
+    engine = alerts.AlertEngine()
+    position = iter(range(10 ** 9))
+
+    def evaluate():
+        index = next(position)
+        engine.evaluate("bench", readings[index % len(readings)], rate=-1.0, predictions={30: 90},
+                        now=1_000_000 + index * 300)
+        if index % len(readings) == len(readings) - 1:
+            engine.states.clear()
+
+    transport = StubTransport()
+    dispatcher = NotificationDispatcher({"email": lambda: transport}, batch_seconds=0).start()
+    results = [
+        measure("AlertEngine.evaluate", evaluate, runs * 10),
+        measure("NotificationDispatcher.send (queue)", lambda: dispatcher.send("bench@example.com", "LOW: 60"), runs * 10),
+    ]
+    dispatcher.stop()
+    return results
+
+def import_profile(stderr):
+    """(import milliseconds, top-level packages imported) from `python -X importtime` output."""
+    total_us, packages = 0, set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split("|")
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative_us)
+        packages.add(name.strip().split(".")[0])
+    return total_us / 1000, packages
+
+def bench_startup(runs):
+    """
+    Cold-start import time of each dexval.py command, against its budget in
+    dexval.IMPORT_BUDGETS. Commands run with --dry-run: they import what
+    they need and exit, so nothing reaches Dexcom, SMTP or the alert state.
+    """
+    from DexcomAPI import dexval
+
+    results = []
+    for command, (allowed, budget_ms) in dexval.IMPORT_BUDGETS.items():
+        samples, packages = [], set()
+        for _ in range(max(3, runs // 10)):
+            process = subprocess.run([sys.executable, "-X", "importtime", "dexval.py", "--dry-run", command],
+                                     cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+            if process.returncode != 0:
+                raise RuntimeError(f"dexval --dry-run {command} exited with {process.returncode}:\n"
+                                   + process.stderr[-2000:])
+            milliseconds, imported = import_profile(process.stderr)
+            samples.append(milliseconds)
+            packages |= imported
+        heavy = sorted(package for package in dexval.HEAVY_MODULES if package in packages and package not in allowed)
+        result = {
+            "name": f"dexval {command}: imports",
+            "runs": len(samples),
+            "p50_ms": round(percentile(samples, 0.5), 4),
+            "p95_ms": round(percentile(samples, 0.95), 4),
+            "mean_ms": round(statistics.fmean(samples), 4),
+            "budget_ms": budget_ms,
+            "heavy_imports": heavy,
+        }
+        result["over_budget"] = result["p50_ms"] > budget_ms or bool(heavy)
+        flag = f"  OVER BUDGET ({budget_ms} ms{', loads ' + ', '.join(heavy) if heavy else ''})" if result["over_budget"] else ""
+        print(f"{result['name']:<48}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}{'':>10}{flag}")
+        results.append(result)
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def compare(results, baseline_path, threshold):
+    """Print p50 changes against a saved run; return the names that regressed beyond `threshold`."""
+    with open(baseline_path) as baseline_file:
+        baseline = {result["name"]: result for result in json.load(baseline_file)["results"]}
+    regressions = []
+    print(f"\n{'benchmark':<48}{'before':>10}{'after':>10}{'change':>10}")
+    for result in results:
+        before = baseline.get(result["name"])
+        if not before or not before["p50_ms"]:
+            continue
+        change = result["p50_ms"] / before["p50_ms"] - 1
+        flag = " REGRESSION" if change > threshold else ""
+        print(f"{result['name']:<48}{before['p50_ms']:>10.3f}{result['p50_ms']:>10.3f}{change:>+10.1%}{flag}")
+        if flag:
+            regressions.append(result["name"])
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=0, help="simulated Dexcom round-trip time")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="a previous --output file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p50 slowdown before failing (0.2 = 20%%)")
+    parser.add_argument("--only", nargs="*", help="groups to run: routes metrics graphs database forecasts alerts startup")
+    args = parser.parse_args()
+
+    dexcom = synthetic.SyntheticDexcom.generate(days=1, seed=1, latency_seconds=args.latency_ms / 1000)
+    store = database.ReadingStore(os.path.join(WORK_DIR, "history.db"), user_id="bench")
+    store.insert_readings(synthetic.generate_readings(days=90, seed=1))
+
+    groups = {
+        "routes": lambda: bench_routes(args.runs, args.latency_ms / 1000),
+        "metrics": lambda: bench_metrics(args.runs, dexcom),
+        "graphs": lambda: bench_graphs(args.runs, dexcom, store),
+        "database": lambda: bench_database(args.runs),
+        "forecasts": lambda: bench_forecasts(args.runs, store),
+        "alerts": lambda: bench_alerts(args.runs, dexcom),
+        "startup": lambda: bench_startup(args.runs),
+    }
+    print(f"{'benchmark':<48}{'p50 ms':>10}{'p95 ms':>10}{'upstream':>10}")
+    results = []
+    for name, run in groups.items():
+        if args.only and name not in args.only:
+            continue
+        results.extend(run())
+
+    output = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "runs": args.runs,
+        "latency_ms": args.latency_ms,
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(output, output_file, indent=2)
+    print(f"\nSaved {len(results)} results to {args.output}")
+
+    over_budget = [result["name"] for result in results if result.get("over_budget")]
+    if over_budget:
+        print(f"\nOver the import budget: {', '.join(over_budget)}")
+    if args.compare and compare(results, args.compare, args.threshold) or over_budget:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# credentials.py
+'''
+    Encrypted on-disk cache for Dexcom Share sessions and OAuth tokens.
+
+    Logging in to Dexcom is slow and rate limited, so session IDs and access
+    tokens are kept until they expire and shared between every process that
+    points at the same cache file. The file is encrypted with Fernet and
+    guarded by an exclusive lock while it is read or written.
+'''
+
+import fcntl
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+import requests
+from cryptography.fernet import Fernet, InvalidToken
+from pydexcom import Dexcom
+
+# Generated keys live outside the repo, so they can't be committed next to the cache they unlock
+KEY_DIR = os.path.join(os.getenv("XDG_CONFIG_HOME") or os.path.expanduser("~/.config"), "dexval")
+
+SHARE_SESSION_TTL = 8 * 60 * 60 # Re-login proactively after 8 hours
+REFRESH_MARGIN = 120 # Refresh OAuth tokens this many seconds before they expire
+
+class CredentialCache:
+    def __init__(self, path, key=None):
+        """
+        path: the encrypted cache file; `path + ".lock"` is used for locking
+        key: a Fernet key; if omitted one is generated and saved in KEY_DIR
+        """
+        self.path = path
+        if not key:
+            key_path = self.key_path(path)
+            if os.path.exists(path + ".key") and not os.path.exists(key_path):
+                # Older versions kept the key beside the cache, inside the checkout
+                os.makedirs(os.path.dirname(key_path), mode=0o700, exist_ok=True)
+                shutil.move(path + ".key", key_path)
+            key = self._load_or_create_key(key_path)
+        self._fernet = Fernet(key)
+
+    @staticmethod
+    def key_path(path):
+        """Where the generated key for the cache at `path` is kept: KEY_DIR, one key per cache file."""
+        name = os.path.abspath(path).strip(os.sep).replace(os.sep, "_")
+        return os.path.join(KEY_DIR, f"{name}.key")
+
+    @staticmethod
+    def _load_or_create_key(key_path):
+        os.makedirs(os.path.dirname(key_path), mode=0o700, exist_ok=True)
+        if os.path.exists(key_path):
+            with open(key_path, "rb") as key_file:
+                return key_file.read()
+        key = Fernet.generate_key()
+        try:
+            fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            # Another process created it first
+            time.sleep(0.1)
+            with open(key_path, "rb") as key_file:
+                return key_file.read()
+        with os.fdopen(fd, "wb") as key_file:
+            key_file.write(key)
+        return key
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as cache_file:
+                return json.loads(self._fernet.decrypt(cache_file.read()))
+        except (FileNotFoundError, InvalidToken, ValueError):
+            return {}
+
+    def _write(self, entries):
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as cache_file:
+            cache_file.write(self._fernet.encrypt(json.dumps(entries).encode()))
+        os.replace(temp_path, self.path)
+
+    def get(self, name, margin=0, include_expired=False):
+        """Return the entry for `name`, or None if missing or expiring within `margin` seconds."""
+        with self._locked():
+            entry = self._read().get(name)
+        if entry is None or include_expired:
+            return entry
+        if entry.get("expires_at", float("inf")) - margin <= time.time():
+            return None
+        return entry
+
+    def set(self, name, entry, ttl=None):
+        """Store `entry` (a JSON-serializable dict) under `name`, expiring after `ttl` seconds."""
+        entry = dict(entry)
+        if ttl is not None:
+            entry["expires_at"] = time.time() + ttl
+        with self._locked():
+            entries = self._read()
+            entries[name] = entry
+            self._write(entries)
+
+    def delete(self, name):
+        with self._locked():
+            entries = self._read()
+            if entries.pop(name, None) is not None:
+                self._write(entries)
+
+class CachedDexcom(Dexcom):
+    """
+    pydexcom Dexcom client that starts from a cached Share session instead of logging in.
+
+    If the cached session has been revoked, pydexcom's own SessionError retry
+    logs in for real and the new session replaces the cached one.
+    """
+
+    def __init__(self, cache, *, username, password, **kwargs):
+        self._credential_cache = cache
+        self._cache_name = f"share:{username}"
+        self._tried_cache = False
+        super().__init__(username=username, password=password, **kwargs)
+
+    def _login(self, parent_login):
+        if not self._tried_cache:
+            self._tried_cache = True
+            entry = self._credential_cache.get(self._cache_name)
+            if entry:
+                self._account_id = entry["account_id"]
+                self._session_id = entry["session_id"]
+                return
+
+        parent_login(self)
+        self._credential_cache.set(self._cache_name, {
+            "account_id": self._account_id,
+            "session_id": self._session_id,
+        }, ttl=SHARE_SESSION_TTL)
+
+    def _session(self):
+        # pydexcom 0.4 names its login method _session
+        self._login(Dexcom._session)
+
+    def _get_session(self):
+        # pydexcom 0.5+ renamed it to _get_session
+        self._login(Dexcom._get_session)
+
+def request_token(cache, name, token_url, payload, refresh_token=None):
+    """
+    POST `payload` to the token endpoint and cache the resulting token under `name`.
+
+    `refresh_token` is kept if the response does not include a new one.
+    """
+    response = requests.post(token_url, data=payload)
+    response.raise_for_status()
+    token = response.json()
+    entry = {
+        "access_token": token["access_token"],
+        "refresh_token": token.get("refresh_token") or refresh_token,
+    }
+    cache.set(name, entry, ttl=token.get("expires_in", 3600))
+    return entry
+
+def get_oauth_token(cache, name, token_url, client_id, client_secret):
+    """
+    Return a cached OAuth access token, refreshing it shortly before it expires.
+
+    Returns None if there is no token cached under `name` and it cannot be
+    refreshed (the user has to sign in again).
+    """
+    entry = cache.get(name, margin=REFRESH_MARGIN)
+    if entry:
+        return entry["access_token"]
+
+    stale = cache.get(name, include_expired=True)
+    if not stale or not stale.get("refresh_token"):
+        return None
+
+    try:
+        entry = request_token(cache, name, token_url, {
+            "grant_type": "refresh_token",
+            "refresh_token": stale["refresh_token"],
+            "client_id": client_id,
+            "client_secret": client_secret,
+        }, refresh_token=stale["refresh_token"])
+    except requests.exceptions.RequestException:
+        cache.delete(name)
+        return None
+    return entry["access_token"]
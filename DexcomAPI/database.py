@@ -2,6 +2,23 @@
 # make sure you are in the correct Database
 
 import datetime
+import logging
+import math
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pydexcom import GlucoseReading
+
+try:
+    from DexcomAPI import rollups, schema
+except ImportError:
+    import rollups
+    import schema
+
+READING_INTERVAL_SECONDS = 300 # Dexcom CGMs report one reading every 5 minutes
+MAX_MINUTES = 1440 # Dexcom Share only serves the past 24 hours
+MAX_COUNT = 288
 
 def get_latest_timestamp(cursor, db_name):
     query = f"SELECT MAX(timestamp) FROM {db_name}"
@@ -9,6 +26,24 @@ def get_latest_timestamp(cursor, db_name):
     result = cursor.fetchone()
     return result[0] if result[0] is not None else None
 
+def reading_timestamp(reading):
+    """Return the reading's own recorded time as integer epoch seconds."""
+    return int(reading.datetime.timestamp())
+
+# Stored for rows with no trend (e.g. migrated from the legacy per-person tables); pydexcom rejects None
+UNKNOWN_TREND = "NotComputable"
+
+def reading_from_row(timestamp, mgdl_reading, trend):
+    """Rebuild a pydexcom GlucoseReading from a stored row."""
+    timestamp_ms = int(timestamp) * 1000
+    return GlucoseReading({
+        "WT": f"Date({timestamp_ms})",
+        "ST": f"Date({timestamp_ms})",
+        "DT": f"Date({timestamp_ms}+0000)",
+        "Value": mgdl_reading,
+        "Trend": trend or UNKNOWN_TREND,
+    })
+
 def insert_glucose_readings(dexcom, db, db_name):
     cursor = db.cursor()
 
@@ -18,13 +53,9 @@ def insert_glucose_readings(dexcom, db, db_name):
 
     insert_data = []
 
-    now = datetime.datetime.now()
-    base_minute = now.minute - (now.minute % 5)
-    base_timestamp = now.replace(minute = base_minute, second = 0, microsecond = 0)
-
-    for index in reversed(range(len(glucose_readings))):
-        reading = glucose_readings[index]
-        timestamp = base_timestamp - datetime.timedelta(minutes = index * 5)
+    for reading in reversed(glucose_readings):
+        # Use the time Dexcom recorded the reading, as naive local time for the DATETIME column
+        timestamp = datetime.datetime.fromtimestamp(reading_timestamp(reading))
 
         # Ensure timestamps will not overlap and duplicate data in table
         if latest_timestamp is None or timestamp > latest_timestamp:
@@ -35,4 +66,324 @@ def insert_glucose_readings(dexcom, db, db_name):
         cursor.executemany(f"INSERT INTO {db_name} (timestamp, mgdl_reading) VALUES (%s, %s)", insert_data)
         db.commit()
 
-    cursor.close()
\ No newline at end of file
+    cursor.close()
+
+class ReadingStore:
+    """
+    Local time-series store of glucose readings, keyed by (user_id, reading time).
+    The table layout and migrations live in schema.py.
+
+    Uses SQLite by default. It answers `get_glucose_readings` and
+    `get_current_glucose_reading` like a Dexcom client, so the stats, graph and
+    forecast code can read from it in place of a live connection.
+    """
+
+    placeholder = "?"
+    dialect = "sqlite"
+    insert_sql = "INSERT OR IGNORE INTO readings (user_id, timestamp, mgdl_reading, trend) VALUES (?, ?, ?, ?)"
+    _migrated = set() # Databases already migrated by this process
+
+    def __init__(self, path="glucose_readings.db", user_id="default"):
+        self.path = path
+        self.user_id = user_id
+        self._create_table()
+
+    def _connect(self):
+        return sqlite3.connect(self.path)
+
+    def _migration_key(self):
+        # Checking a SQLite file's schema version is one cheap PRAGMA, so always check
+        return None
+
+    def _create_table(self):
+        # Create or upgrade the schema, once per database per process where the check is costly
+        key = self._migration_key()
+        if key is not None and key in ReadingStore._migrated:
+            return
+        with closing(self._connect()) as db:
+            schema.migrate(db, self.dialect)
+        if key is not None:
+            ReadingStore._migrated.add(key)
+
+    def _query(self, sql, params=()):
+        sql = sql.replace("?", self.placeholder)
+        with closing(self._connect()) as db:
+            with closing(db.cursor()) as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+
+    def insert_readings(self, readings):
+        """
+        Store readings, ignoring any already stored for the same timestamp, and
+        refresh the rollups of the hours they fall in. Returns the number offered.
+        """
+        rows = [(self.user_id, reading_timestamp(r), r.value, r.trend_direction) for r in readings]
+        if not rows:
+            return 0
+        timestamps = [row[1] for row in rows]
+        with closing(self._connect()) as db:
+            with closing(db.cursor()) as cursor:
+                cursor.executemany(self.insert_sql, rows)
+                rollups.refresh(cursor, self.placeholder, [self.user_id], min(timestamps), max(timestamps))
+            db.commit()
+        return len(rows)
+
+    def get_period_totals(self, start, end, low=rollups.ROLLUP_LOW_MGDL, high=rollups.ROLLUP_HIGH_MGDL):
+        """rollups.Totals of the readings with start <= timestamp < end, composed from the rollups."""
+        with closing(self._connect()) as db:
+            with closing(db.cursor()) as cursor:
+                return rollups.period_totals(cursor, self.placeholder, self.user_id, start, end, low, high)
+
+    def get_rollups(self, start, end, period="daily"):
+        """[(bucket start, rollups.Totals)] per UTC day ("daily") or hour ("hourly") in [start, end), oldest first."""
+        if period not in ("daily", "hourly"):
+            raise ValueError(f"Unknown rollup period: {period}")
+        with closing(self._connect()) as db:
+            with closing(db.cursor()) as cursor:
+                return rollups.bucket_rows(cursor, self.placeholder, self.user_id, start, end, f"rollups_{period}")
+
+    def get_latest_timestamp(self):
+        """Epoch seconds of the newest stored reading, or None if the store is empty."""
+        rows = self._query("SELECT MAX(timestamp) FROM readings WHERE user_id = ?", (self.user_id,))
+        return rows[0][0] if rows and rows[0][0] is not None else None
+
+    def get_readings(self, start=None, end=None, max_count=None):
+        """Readings with start <= timestamp <= end (epoch seconds), newest first."""
+        sql = "SELECT timestamp, mgdl_reading, trend FROM readings WHERE user_id = ?"
+        params = [self.user_id]
+        if start is not None:
+            sql += " AND timestamp >= ?"
+            params.append(int(start))
+        if end is not None:
+            sql += " AND timestamp <= ?"
+            params.append(int(end))
+        sql += " ORDER BY timestamp DESC"
+        if max_count is not None:
+            sql += f" LIMIT {int(max_count)}"
+        return [reading_from_row(*row) for row in self._query(sql, tuple(params))]
+
+    def get_value_rows(self, start=None, end=None):
+        """[(timestamp, mg/dL)] with start <= timestamp < end, oldest first, without building reading objects."""
+        sql = "SELECT timestamp, mgdl_reading FROM readings WHERE user_id = ?"
+        params = [self.user_id]
+        if start is not None:
+            sql += " AND timestamp >= ?"
+            params.append(int(start))
+        if end is not None:
+            sql += " AND timestamp < ?"
+            params.append(int(end))
+        return self._query(sql + " ORDER BY timestamp", tuple(params))
+
+    def get_glucose_range(self, user_id):
+        """(low_mgdl, high_mgdl, low_mmol, high_mmol) of `user_id`'s saved target range, or None."""
+        rows = self._query("SELECT low_mgdl, high_mgdl, low_mmol, high_mmol FROM glucose_ranges WHERE user_id = ?",
+                           (user_id,))
+        return rows[0] if rows else None
+
+    def set_glucose_range(self, user_id, low_mgdl, high_mgdl, low_mmol, high_mmol):
+        """Save `user_id`'s target range, replacing any saved before (REPLACE works in SQLite and MySQL)."""
+        sql = "REPLACE INTO glucose_ranges (user_id, low_mgdl, high_mgdl, low_mmol, high_mmol) VALUES (?, ?, ?, ?, ?)"
+        with closing(self._connect()) as db:
+            with closing(db.cursor()) as cursor:
+                cursor.execute(sql.replace("?", self.placeholder), (user_id, low_mgdl, high_mgdl, low_mmol, high_mmol))
+            db.commit()
+
+    def get_glucose_readings(self, minutes=MAX_MINUTES, max_count=MAX_COUNT):
+        """Mirror Dexcom.get_glucose_readings, but read from the store. History is not limited to 24h."""
+        return self.get_readings(start=time.time() - minutes * 60, max_count=max_count)
+
+    def get_latest_glucose_reading(self):
+        readings = self.get_readings(max_count=1)
+        return readings[0] if readings else None
+
+    def get_current_glucose_reading(self):
+        """Mirror Dexcom.get_current_glucose_reading: the latest reading if under 10 minutes old."""
+        readings = self.get_glucose_readings(minutes=10, max_count=1)
+        return readings[0] if readings else None
+
+class MySQLReadingStore(ReadingStore):
+    """
+    ReadingStore backed by MySQL. Pass `defs.get_sql_connection_pool().get_connection`
+    as `connect` so queries reuse pooled connections instead of opening one each.
+    """
+
+    placeholder = "%s"
+    dialect = "mysql"
+    insert_sql = "INSERT IGNORE INTO readings (user_id, timestamp, mgdl_reading, trend) VALUES (%s, %s, %s, %s)"
+
+    def __init__(self, connect, user_id="default"):
+        # `connect` is a zero-argument callable returning a new DB-API connection
+        self._connect = connect
+        super().__init__(path=None, user_id=user_id)
+
+    def _migration_key(self):
+        # The pool (or whatever object `connect` is bound to) stands for the database
+        return ("mysql", id(getattr(self._connect, "__self__", self._connect)))
+
+class BulkReadingWriter:
+    """
+    Buffered, multi-row writer of many users' readings into the `readings` table.
+
+    Rows are buffered and written with one multi-row INSERT IGNORE (or
+    upsert) per `batch_size` rows on a single connection, when the buffer is
+    full or `flush_seconds` after the first buffered row. Duplicates are
+    handled by the (user_id, timestamp) primary key instead of a SELECT
+    MAX(timestamp) per user. Use it as a context manager to flush on exit.
+    """
+
+    dialects = {
+        "mysql": {
+            "ignore": "INSERT IGNORE INTO readings (user_id, timestamp, mgdl_reading, trend) VALUES {rows}",
+            "upsert": ("INSERT INTO readings (user_id, timestamp, mgdl_reading, trend) VALUES {rows} "
+                       "ON DUPLICATE KEY UPDATE mgdl_reading = VALUES(mgdl_reading), trend = VALUES(trend)"),
+            "placeholder": "%s",
+        },
+        "sqlite": {
+            "ignore": "INSERT OR IGNORE INTO readings (user_id, timestamp, mgdl_reading, trend) VALUES {rows}",
+            "upsert": ("INSERT INTO readings (user_id, timestamp, mgdl_reading, trend) VALUES {rows} "
+                       "ON CONFLICT (user_id, timestamp) DO UPDATE SET "
+                       "mgdl_reading = excluded.mgdl_reading, trend = excluded.trend"),
+            "placeholder": "?",
+        },
+    }
+
+    def __init__(self, connect, dialect="mysql", batch_size=500, flush_seconds=5.0, upsert=False):
+        """
+        connect: zero-argument callable returning a DB-API connection, e.g. the
+            get_connection of defs.get_sql_connection_pool(); closing it returns it to the pool
+        upsert: overwrite value and trend for readings already stored, instead of keeping the old row
+        """
+        self._connect = connect
+        self.sql = self.dialects[dialect]
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.upsert = upsert
+        self.rows_written = 0
+        self.statements = 0
+        self._buffer = []
+        self._first_buffered = None
+        self._lock = threading.Lock()
+        self._stop = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+        self.flush()
+
+    def start(self):
+        """Flush in a background thread every `flush_seconds`, so a partial batch never waits on the next add()."""
+        self._stop = threading.Event()
+
+        def flush_periodically(stop):
+            while not stop.wait(self.flush_seconds):
+                try:
+                    self.flush()
+                except Exception as e:
+                    logging.error(f"Flushing buffered readings failed: {e}")
+
+        threading.Thread(target=flush_periodically, args=(self._stop,), daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def _insert_sql(self, count):
+        placeholder = self.sql["placeholder"]
+        row = f"({placeholder}, {placeholder}, {placeholder}, {placeholder})"
+        return self.sql["upsert" if self.upsert else "ignore"].format(rows=", ".join([row] * count))
+
+    def add(self, user_id, readings):
+        """Buffer `user_id`'s readings, flushing if the buffer is full or old enough."""
+        rows = [(user_id, reading_timestamp(r), r.value, r.trend_direction) for r in readings]
+        with self._lock:
+            if rows and not self._buffer:
+                self._first_buffered = time.monotonic()
+            self._buffer.extend(rows)
+            due = (len(self._buffer) >= self.batch_size
+                   or (self._buffer and time.monotonic() - self._first_buffered >= self.flush_seconds))
+        if due:
+            self.flush()
+        return len(rows)
+
+    def flush(self):
+        """
+        Write everything buffered in multi-row statements, refresh the rollups
+        of the hours written to, and commit once. Returns the rows written.
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        user_ids = {row[0] for row in rows}
+        timestamps = [row[1] for row in rows]
+        with closing(self._connect()) as db:
+            with closing(db.cursor()) as cursor:
+                for start in range(0, len(rows), self.batch_size):
+                    batch = rows[start:start + self.batch_size]
+                    cursor.execute(self._insert_sql(len(batch)), [value for row in batch for value in row])
+                    self.statements += 1
+                rollups.refresh(cursor, self.sql["placeholder"], sorted(user_ids), min(timestamps), max(timestamps))
+            db.commit()
+        self.rows_written += len(rows)
+        return len(rows)
+
+    def latest_timestamps(self, user_ids):
+        """{user_id: newest stored timestamp or None} for many users in one query."""
+        user_ids = list(user_ids)
+        latest = dict.fromkeys(user_ids)
+        if not user_ids:
+            return latest
+        placeholders = ", ".join([self.sql["placeholder"]] * len(user_ids))
+        with closing(self._connect()) as db:
+            with closing(db.cursor()) as cursor:
+                cursor.execute(f"SELECT user_id, MAX(timestamp) FROM readings WHERE user_id IN ({placeholders}) "
+                               "GROUP BY user_id", user_ids)
+                latest.update(cursor.fetchall())
+        return latest
+
+def sync_request(store, now=None):
+    """
+    Work out what to ask Dexcom for to bring `store` up to date.
+
+    Returns (latest, minutes, max_count), where latest is the newest stored
+    timestamp or None, or returns None when no new reading is due yet.
+    """
+    return sync_request_since(store.get_latest_timestamp(), now)
+
+def sync_request_since(latest, now=None):
+    """sync_request for an already known latest stored timestamp (or None)."""
+    now = time.time() if now is None else now
+    if latest is None:
+        minutes = MAX_MINUTES
+    else:
+        elapsed = now - latest
+        if elapsed < READING_INTERVAL_SECONDS:
+            return None
+        minutes = min(MAX_MINUTES, math.ceil(elapsed / 60))
+
+    max_count = min(MAX_COUNT, minutes * 60 // READING_INTERVAL_SECONDS + 1)
+    return latest, minutes, max_count
+
+def store_new_readings(store, readings, latest):
+    """Insert the readings newer than `latest` into `store`. Returns how many there were."""
+    if latest is not None:
+        readings = [reading for reading in readings if reading_timestamp(reading) > latest]
+    return store.insert_readings(readings)
+
+def sync_readings(dexcom, store, now=None):
+    """
+    Pull only the readings newer than the latest one in `store` and save them.
+
+    Returns the number of readings fetched. No request is made to Dexcom when
+    the newest stored reading is less than one reading interval old.
+    """
+    request = sync_request(store, now)
+    if request is None:
+        return 0
+    latest, minutes, max_count = request
+    readings = dexcom.get_glucose_readings(minutes=minutes, max_count=max_count)
+    return store_new_readings(store, readings, latest)
@@ -1,11 +1,15 @@
 import os
-import mysql.connector
 from dotenv import load_dotenv
-from pydexcom import Dexcom
-from twilio.rest import Client
 import requests
 from dataclasses import dataclass
 
+try:
+    from DexcomAPI.credentials import CachedDexcom, CredentialCache, get_oauth_token, request_token
+    from DexcomAPI.ranges import GlucoseRange
+except ImportError:
+    from credentials import CachedDexcom, CredentialCache, get_oauth_token, request_token
+    from ranges import GlucoseRange
+
 load_dotenv()
 
 # Custom Exceptions
@@ -28,11 +32,22 @@ class Config:
     dexcom_client_id: str = os.getenv("DEXCOM_CLIENT_ID")
     dexcom_client_secret: str = os.getenv("DEXCOM_CLIENT_SECRET")
     dexcom_token_url: str = os.getenv("DEXCOM_TOKEN_URL")
+    dexcom_replay: str = os.getenv("dexcom_replay") # "synthetic" or a recording to replay instead of Dexcom
     
     sql_host: str = os.getenv("sql_host")
     sql_user: str = os.getenv("sql_user")
     sql_password: str = os.getenv("sql_password")
     sql_database: str = os.getenv("sql_database")
+
+    reading_store_path: str = os.getenv("reading_store_path", "glucose_readings.db")
+    users_file: str = os.getenv("users_file", "users.json")
+    alert_state_path: str = os.getenv("alert_state_path", ".alert_state.json")
+
+    low_mgdl: str = os.getenv("low_mgdl", "70") # Target range for users who haven't set their own
+    high_mgdl: str = os.getenv("high_mgdl", "180")
+
+    credential_cache_path: str = os.getenv("credential_cache_path", ".dexval_credentials")
+    credential_cache_key: str = os.getenv("credential_cache_key")
     
     email_username: str = os.getenv("email_username")
     email_password: str = os.getenv("email_password")
@@ -51,39 +66,74 @@ class Config:
 
 config = Config()
 
+_credential_cache = None
+
+def get_credential_cache():
+    """Return the shared encrypted cache of Dexcom sessions and OAuth tokens"""
+    global _credential_cache
+    if _credential_cache is None:
+        _credential_cache = CredentialCache(config.credential_cache_path, config.credential_cache_key)
+    return _credential_cache
+
 # Dexcom Connection Functions
-def get_dexcom_connection():
-    """Establish and return a connection to Dexcom using environment variables"""
-    if not config.dexcom_username or not config.dexcom_password:
+def get_dexcom_connection(username=None, password=None):
+    """Establish and return a connection to Dexcom, reusing a cached Share session when possible"""
+    username = username or config.dexcom_username
+    password = password or config.dexcom_password
+    if not username or not password:
         raise DexcomConnectionError("Dexcom username and password must be set as environment variables.")
     
     try:
-        # token = get_access_token()  # Assuming this function gets the token for you
-        # return Dexcom(token)
-        return Dexcom(username=config.dexcom_username, password=config.dexcom_password)
+        return CachedDexcom(get_credential_cache(), username=username, password=password)
     except Exception as e:
         raise DexcomConnectionError(f"Failed to connect to Dexcom: {e}")
 
+def get_dexcom_source(username=None, password=None):
+    """
+    The live Dexcom connection, or an offline stand-in replaying readings when
+    dexcom_replay is set ("synthetic" for generated data, else a recording's path).
+    Without dexcom_replay, missing credentials raise DexcomConnectionError as in
+    get_dexcom_connection, so fake data is only ever served on request
+    """
+    replay = config.dexcom_replay
+    if not replay:
+        return get_dexcom_connection(username, password)
+
+    try:
+        from DexcomAPI import synthetic
+    except ImportError:
+        import synthetic
+
+    if replay and replay != "synthetic":
+        return synthetic.SyntheticDexcom.replay(replay)
+    return synthetic.SyntheticDexcom.generate(days=14)
+
 def get_access_token():
-    """Get OAuth access token for Dexcom API"""
+    """Get OAuth access token for Dexcom API, reusing the cached token until it expires"""
     if not config.dexcom_client_id or not config.dexcom_client_secret:
         raise DexcomConnectionError("Client ID and client secret must be set as environment variables.")
     
+    cache = get_credential_cache()
+    access_token = get_oauth_token(cache, "oauth:client_credentials", config.dexcom_token_url,
+                                   config.dexcom_client_id, config.dexcom_client_secret)
+    if access_token:
+        return access_token
+
     payload = {
         "client_id": config.dexcom_client_id,
         "client_secret": config.dexcom_client_secret,
         "grant_type": "client_credentials"
     }
     try:
-        response = requests.post(config.dexcom_token_url, data=payload)
-        response.raise_for_status()
-        return response.json()["access_token"]
+        return request_token(cache, "oauth:client_credentials", config.dexcom_token_url, payload)["access_token"]
     except requests.exceptions.RequestException as e:
         raise DexcomConnectionError(f"Failed to obtain access token: {e}")
 
 # Database Connection Function
 def get_sql_database_connection():
     """Connect to the SQL database using environment variables and return the connection"""
+    import mysql.connector
+
     try:
         connection = mysql.connector.connect(
             host=config.sql_host,
@@ -97,6 +147,28 @@ def get_sql_database_connection():
     except mysql.connector.Error as e:
         raise DatabaseConnectionError(f"Error connecting to MySQL database: {e}")
 
+_sql_connection_pool = None
+
+def get_sql_connection_pool(pool_size=8):
+    """Return the shared MySQL connection pool; close() on a pooled connection returns it to the pool"""
+    global _sql_connection_pool
+    if _sql_connection_pool is None:
+        import mysql.connector
+        from mysql.connector import pooling
+
+        try:
+            _sql_connection_pool = pooling.MySQLConnectionPool(
+                pool_name="dexval",
+                pool_size=pool_size,
+                host=config.sql_host,
+                user=config.sql_user,
+                password=config.sql_password,
+                database=config.sql_database
+            )
+        except mysql.connector.Error as e:
+            raise DatabaseConnectionError(f"Error creating MySQL connection pool: {e}")
+    return _sql_connection_pool
+
 # Email Functions
 def get_sender_email_credentials():
     """Retrieve sender's email credentials from environment variables"""
@@ -119,6 +191,7 @@ def get_twilio_client():
         raise TwilioClientError("Twilio account SID, auth token, from, and to numbers must be set as environment variables.")
     
     try:
+        from twilio.rest import Client
         return Client(config.twilio_account_sid, config.twilio_auth_token)
     except Exception as e:
         raise TwilioClientError(f"Failed to create Twilio client: {e}")
@@ -144,36 +217,6 @@ def get_secret_key():
     APP_SECRET_KEY = os.urandom(24).hex()
     return APP_SECRET_KEY
 
-def get_low_mgdl():
-    """Return the low glucose threshold in mg/dL"""
-    return 70
-
-def get_high_mgdl():
-    """Return the high glucose threshold in mg/dL"""
-    return 180
-
-def get_low_mmol():
-    """Return the low glucose threshold in mmol/L"""
-    return round(get_low_mgdl() / 18.01559, 4)
-
-def get_high_mmol():
-    """Return the high glucose threshold in mmol/L"""
-    return round(get_high_mgdl() / 18.01559, 4)
-
-def set_range(units, low, high):
-    """
-    Set the low and high glucose thresholds.
-
-    Parameters:
-    units (str): The units of the glucose thresholds ("mgdl" or "mmol").
-    low (int): The low glucose threshold.
-    high (int): The high glucose threshold.
-    """
-    global get_low_mgdl, get_high_mgdl
-    if units == "mgdl":
-        get_low_mgdl = lambda: low
-        get_high_mgdl = lambda: high
-    elif units == "mmol":
-        get_low_mgdl = lambda: round(low * 18.01559, 4)
-        get_high_mgdl = lambda: round(high * 18.01559, 4)
-    return
+def get_default_range():
+    """The GlucoseRange for users who haven't set their own, from low_mgdl/high_mgdl"""
+    return GlucoseRange.from_units("mgdl", config.low_mgdl, config.high_mgdl)
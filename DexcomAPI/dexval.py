@@ -0,0 +1,199 @@
+# dexval.py
+'''
+    One command line for the Dexcom scripts:
+
+        python dexval.py current [--mmol]
+        python dexval.py report [--mmol]
+        python dexval.py graph [--units mmol] [--output dexcom_glucose_graph.png]
+        python dexval.py forecast [--model slope|ar|rnn]
+        python dexval.py sync
+        python dexval.py alert
+
+    Cron starts a command every few minutes, and starting Python and
+    importing is most of what such a run costs. So each command imports
+    only what it uses, inside its function: `current` needs pydexcom alone,
+    and only `graph` loads matplotlib. IMPORT_BUDGETS says which heavy
+    packages each command may load and how many milliseconds its imports
+    may take; `benchmark_suite.py --only startup` checks them, running each
+    command with --dry-run so that it only imports.
+
+    Commands read live Dexcom and need DEXCOM_USERNAME/DEXCOM_PASSWORD.
+    With dexcom_replay set they read synthetic or recorded readings
+    instead, and keep them in a store of their own (REPLAY_STORE_PATH) so
+    they never mix with real readings.
+'''
+
+import argparse
+import datetime
+import logging
+import importlib
+import os
+import sys
+import tempfile
+
+HORIZONS = tuple(range(5, 50, 5))
+
+# Packages too slow to import for a command that doesn't use them
+HEAVY_MODULES = ("matplotlib", "pandas", "sklearn", "statsmodels", "tensorflow", "mysql", "twilio")
+
+# command -> (heavy packages it may import, import time budget in ms)
+IMPORT_BUDGETS = {
+    "current": ((), 400),
+    "sync": ((), 450),
+    "alert": ((), 500),
+    "report": ((), 600),
+    "forecast": ((), 600),
+    "graph": (("matplotlib",), 1500),
+}
+
+# command -> the modules it imports when it runs; --dry-run imports these and stops
+COMMAND_MODULES = {
+    "current": ("defs",),
+    "sync": ("defs", "database"),
+    "alert": ("auto",),
+    "report": ("defs", "database", "stat_functions"),
+    "forecast": ("defs", "database", "rolling_slope", "forecast"),
+    "graph": ("defs", "database", "graph_service"),
+}
+
+REPLAY_STORE_PATH = os.path.join(tempfile.gettempdir(), "dexval_replay.db")
+
+def open_store():
+    """(Dexcom source, ReadingStore) for the configured account, or for dexcom_replay's readings."""
+    from defs import config, get_dexcom_source
+    from database import ReadingStore
+
+    # Raises DexcomConnectionError without credentials, unless dexcom_replay is set
+    dexcom = get_dexcom_source()
+    if config.dexcom_replay:
+        return dexcom, ReadingStore(REPLAY_STORE_PATH, user_id="replay")
+    return dexcom, ReadingStore(config.reading_store_path, user_id=config.dexcom_username)
+
+def synced_store():
+    """The local ReadingStore, after fetching whatever Dexcom has that it doesn't."""
+    from database import sync_readings
+
+    dexcom, store = open_store()
+    sync_readings(dexcom, store)
+    return store
+
+def current(args):
+    from defs import get_dexcom_source
+
+    reading = get_dexcom_source().get_current_glucose_reading()
+    if reading is None:
+        print("No glucose reading in the last 10 minutes.")
+        return 1
+    value = f"{reading.mmol_l} mmol/L" if args.mmol else f"{reading.value} mg/dL"
+    print(f"{value} {reading.trend_arrow} ({reading.trend_description}) at {reading.datetime:%I:%M%p}")
+    return 0
+
+def report(args):
+    import stat_functions as stats
+    from defs import get_default_range
+
+    store = synced_store()
+    glucose_range = get_default_range()
+    print(stats.verbose_message_mmol(store, glucose_range) if args.mmol else stats.verbose_message_mgdl(store, glucose_range))
+    return 0
+
+def graph(args):
+    import graph_service
+    from defs import get_default_range
+
+    readings = synced_store().get_glucose_readings(minutes=1440, max_count=288)
+    glucose_range = get_default_range()
+    fmt = "svg" if args.output.endswith(".svg") else "png"
+    with open(args.output, "wb") as graph_file:
+        graph_file.write(graph_service.render_glucose_graph(readings, args.units, fmt,
+                                                            glucose_range.low_mgdl, glucose_range.high_mgdl))
+    print(f"Saved the past day's graph to {args.output}")
+    return 0
+
+def forecast(args):
+    store = synced_store()
+    latest = store.get_latest_glucose_reading()
+    if latest is None:
+        print("No stored readings to forecast from.")
+        return 1
+
+    if args.model == "slope":
+        from rolling_slope import RollingSlope
+
+        slope = RollingSlope(points=5)
+        slope.add_readings(store.get_glucose_readings(minutes=30, max_count=slope.points))
+        predictions = slope.predict_many(horizons=HORIZONS)
+    else:
+        from forecast import ForecastModels
+
+        models = ForecastModels(args.model_dir, model=args.model)
+        try:
+            predictions = models.forecast(store.user_id, store, HORIZONS)
+        except ValueError as e:
+            print(f"dexval: can't fit the {args.model} model yet: {e}. Try --model slope.", file=sys.stderr)
+            return 1
+
+    print(f"{latest.datetime:%I:%M%p} - {latest.trend_description}: {latest.value}")
+    for minutes, value in predictions.items():
+        print(f"{latest.datetime + datetime.timedelta(minutes=minutes):%I:%M%p} - Predicted: {value:.2f}")
+    return 0
+
+def sync(args):
+    from database import sync_readings
+
+    dexcom, store = open_store()
+    fetched = sync_readings(dexcom, store)
+    print(f"Fetched {fetched} reading(s) into {store.path}")
+    return 0
+
+def alert(args):
+    import auto
+
+    auto.main()
+    return 0
+
+COMMANDS = {
+    "current": (current, "print the current reading"),
+    "report": (report, "print the past day's statistics"),
+    "graph": (graph, "save a graph of the past day"),
+    "forecast": (forecast, "predict the next 45 minutes"),
+    "sync": (sync, "store new readings locally"),
+    "alert": (alert, "send a notification if glucose is or will be out of range (auto.py)"),
+}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="dexval", description="Dexcom readings, statistics and alerts")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="import what the command needs and exit, without running it")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, (_, help_text) in COMMANDS.items():
+        command = commands.add_parser(name, help=help_text)
+        if name in ("current", "report"):
+            command.add_argument("--mmol", action="store_true", help="mmol/L instead of mg/dL")
+        elif name == "graph":
+            command.add_argument("--units", choices=("mgdl", "mmol"), default="mgdl")
+            command.add_argument("--output", default="dexcom_glucose_graph.png", help=".png or .svg")
+        elif name == "forecast":
+            command.add_argument("--model", choices=("slope", "ar", "rnn"), default="ar")
+            command.add_argument("--model-dir", default=os.getenv("forecast_model_dir", "forecast_models"))
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Before stat_functions can set DEBUG for the whole process
+    logging.basicConfig(level=logging.WARNING)
+    if args.dry_run:
+        for module in COMMAND_MODULES[args.command]:
+            importlib.import_module(module)
+        return 0
+
+    from defs import DexcomConnectionError
+
+    try:
+        return COMMANDS[args.command][0](args)
+    except DexcomConnectionError as e:
+        print(f"dexval: {e} Set dexcom_replay to use synthetic or recorded readings instead.", file=sys.stderr)
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,604 @@
+# forecast.py
+'''
+    Glucose forecasting models that are fitted once and queried many times.
+
+    Every model implements the Forecaster interface: fit() on a stored
+    history of readings, predict() from the most recent readings, and
+    save()/load_forecaster() to persist the fitted parameters as JSON.
+    Predictions are in mg/dL for horizons in minutes (15/30/45 by default).
+
+    - "linear": least-squares line through the last few readings (slope.py)
+    - "trend": per-horizon regression on Dexcom's trend arrow and recent slope
+    - "ar": ARIMA(p, 1, 0), an autoregression on reading-to-reading changes
+    - "rnn": an echo state network, a small recurrent model whose readout is
+      fitted by ridge regression (NumPy only; replaces the TensorFlow lstm.py)
+
+    Arrays passed to fit/predict are oldest first; predict_readings() takes
+    readings newest first, the way pydexcom and ReadingStore return them.
+
+    For fleets, predict_many() scores N users' recent readings (an N x T
+    array) with each user's own fitted model in a few batched matrix
+    products, optionally split across worker processes.
+'''
+
+import json
+import os
+import re
+import time
+import numpy as np
+
+READING_INTERVAL_SECONDS = 300
+STEP_MINUTES = READING_INTERVAL_SECONDS // 60
+HORIZONS = (15, 30, 45)
+TREND_COUNT = 10 # pydexcom trend indexes: 0 none, 1 double up ... 7 double down, 8 not computable, 9 rate out of range
+
+def readings_to_series(readings):
+    """Convert readings (newest first) to (values, timestamps, trends) arrays, oldest first."""
+    readings = list(reversed(readings))
+    count = len(readings)
+    values = np.fromiter((reading.value for reading in readings), dtype=np.float64, count=count)
+    timestamps = np.fromiter((int(reading.datetime.timestamp()) for reading in readings), dtype=np.int64, count=count)
+    trends = np.fromiter((reading.trend for reading in readings), dtype=np.int64, count=count)
+    return values, timestamps, trends
+
+def contiguous_segments(timestamps, min_length=1):
+    """
+    (start, end) slices of runs with no missing readings, so training samples
+    never straddle a sensor gap. Readings up to 1.5 intervals apart count as adjacent.
+    """
+    if len(timestamps) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(timestamps) > READING_INTERVAL_SECONDS * 1.5) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(timestamps)]))
+    return [(start, end) for start, end in zip(starts.tolist(), ends.tolist()) if end - start >= min_length]
+
+def horizon_steps(horizons):
+    steps = [int(round(minutes / STEP_MINUTES)) for minutes in horizons]
+    if min(steps) < 1:
+        raise ValueError(f"Forecast horizons must be at least {STEP_MINUTES} minutes")
+    return steps
+
+def lagged_windows(values, timestamps, length, ahead=0):
+    """
+    Every run of `length` consecutive readings followed by `ahead` more, from
+    contiguous segments only. Returns a (samples, length + ahead) array.
+    """
+    size = length + ahead
+    windows = [np.lib.stride_tricks.sliding_window_view(values[start:end], size)
+               for start, end in contiguous_segments(timestamps, size)]
+    return np.concatenate(windows) if windows else np.empty((0, size))
+
+class Forecaster:
+    """
+    Base class. Every model predicts linearly in some features of the recent
+    readings: prediction = latest value + features(recent) @ weights(steps),
+    which is what lets predict_batch and predict_many score many users with
+    a few matrix products. Subclasses set `name` and `history` and implement
+    features() and weights().
+    """
+
+    name = None
+    history = 1 # How many recent readings predict() needs
+    fitted_weights = True # False when weights depend only on settings, not on fit()
+
+    def fit(self, values, timestamps=None, trends=None):
+        """Fit on a history of readings (oldest first). Returns self."""
+        return self
+
+    def fit_readings(self, readings):
+        values, timestamps, trends = readings_to_series(readings)
+        return self.fit(values, timestamps, trends)
+
+    @property
+    def batch_key(self):
+        """Models with equal keys compute identical features, so they can be scored together."""
+        return (self.name, self.history)
+
+    def features(self, values, trends):
+        """(N, features) for recent values (N, history) and current trend indexes (N,) or None."""
+        raise NotImplementedError
+
+    def weights(self, steps):
+        """(features, len(steps)) weights giving the change from the latest value at each step."""
+        raise NotImplementedError
+
+    def predict(self, values, trends=None, horizons=HORIZONS):
+        """Predicted mg/dL at each horizon (minutes), from the recent values (oldest first)."""
+        values = np.asarray(values, dtype=np.float64)
+        if values.size < self.history:
+            raise ValueError(f"{self.name} forecaster needs at least {self.history} readings")
+        trends = None if trends is None or len(trends) == 0 else np.asarray(trends)[-1:]
+        return self.predict_batch(values[np.newaxis, :], trends, horizons)[0]
+
+    def predict_batch(self, values, trends=None, horizons=HORIZONS):
+        """
+        (N, horizons) predictions with this one model for N rows of recent
+        values (oldest first, NaN where a reading is missing). `trends` is the
+        current trend index per row, or a matching (N, T) array. Rows missing
+        any of the last `history` readings come back as NaN.
+        """
+        recent, trends = _recent_columns(values, trends, self.history)
+        predictions = recent[:, -1:] + self.features(recent, trends) @ self.weights(horizon_steps(horizons))
+        return np.maximum(predictions, 0)
+
+    def predict_readings(self, readings, horizons=HORIZONS):
+        """{horizon minutes: predicted mg/dL} from readings newest first."""
+        recent = readings[:self.history]
+        values, _, trends = readings_to_series(recent)
+        predictions = self.predict(values, trends, horizons)
+        return dict(zip(horizons, predictions.tolist()))
+
+    def get_params(self):
+        """JSON-serializable parameters, including anything learned by fit()."""
+        return {}
+
+    def set_params(self, params):
+        for key, value in params.items():
+            setattr(self, key, np.asarray(value) if isinstance(value, list) else value)
+        return self
+
+    def save(self, path):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as model_file:
+            json.dump({"model": self.name, "params": self.get_params()}, model_file)
+        os.replace(tmp_path, path)
+
+def _recent_columns(values, trends, history):
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    if values.shape[1] < history:
+        raise ValueError(f"Forecasting needs at least {history} readings per row")
+    if trends is not None:
+        trends = np.asarray(trends)
+        trends = trends[:, -1] if trends.ndim == 2 else trends
+        trends = np.nan_to_num(trends, nan=4).astype(np.int64)
+    return values[:, -history:], trends
+
+def _as_lists(params):
+    return {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in params.items()}
+
+class LinearForecaster(Forecaster):
+    """Extends the least-squares line through the last `points` readings, as slope.py does."""
+
+    name = "linear"
+    fitted_weights = False
+
+    def __init__(self, points=5):
+        self.points = points
+
+    @property
+    def history(self):
+        return self.points
+
+    @property
+    def batch_key(self):
+        return (self.name, self.points)
+
+    def features(self, values, trends):
+        return values
+
+    def weights(self, steps):
+        # Least squares on evenly spaced points is a fixed linear combination of
+        # the values: mean + slope * x, with slope = sum(x * y) / sum(x * x)
+        x = np.arange(self.points, dtype=np.float64)
+        x -= x.mean()
+        ahead = x[-1] + np.asarray(steps, dtype=np.float64)
+        weights = np.full((self.points, len(steps)), 1 / self.points)
+        if self.points > 1:
+            weights += np.outer(x / (x @ x), ahead)
+        weights[-1] -= 1 # Predictions are changes from the latest value
+        return weights
+
+    def get_params(self):
+        return {"points": self.points}
+
+class TrendForecaster(Forecaster):
+    """
+    For each horizon, the change from the current reading is regressed on the
+    current trend arrow (one-hot) and the slope over the last `points` readings.
+    Replaces arima.py's LinearRegression on timestamps and trend descriptions.
+    """
+
+    name = "trend"
+
+    def __init__(self, points=3, ridge=1.0):
+        self.points = points
+        self.ridge = ridge
+        self.coefficients = None # (features, horizon steps)
+        self.steps = None
+
+    @property
+    def history(self):
+        return self.points
+
+    @property
+    def batch_key(self):
+        return (self.name, self.points)
+
+    def features(self, recent, trends):
+        """Rows of [one-hot trend..., slope per step] for windows of `points` readings (samples, points)."""
+        if trends is None:
+            trends = np.full(recent.shape[0], 4) # Flat
+        features = np.zeros((recent.shape[0], TREND_COUNT + 1))
+        features[np.arange(recent.shape[0]), np.clip(trends, 0, TREND_COUNT - 1)] = 1
+        features[:, TREND_COUNT] = (recent[:, -1] - recent[:, 0]) / max(self.points - 1, 1)
+        return features
+
+    def fit(self, values, timestamps=None, trends=None, max_minutes=max(HORIZONS)):
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.arange(values.size) * READING_INTERVAL_SECONDS if timestamps is None else np.asarray(timestamps)
+        trends = np.full(values.size, 4) if trends is None else np.asarray(trends)
+        self.steps = list(range(1, horizon_steps([max_minutes])[0] + 1))
+        ahead = self.steps[-1]
+
+        windows = lagged_windows(values, timestamps, self.points, ahead)
+        trend_windows = lagged_windows(trends.astype(np.float64), timestamps, self.points, ahead)
+        if len(windows) < TREND_COUNT + 1:
+            raise ValueError("Not enough contiguous readings to fit the trend forecaster")
+        recent = windows[:, :self.points]
+        features = self.features(recent, trend_windows[:, self.points - 1].astype(np.int64))
+        changes = windows[:, self.points:] - recent[:, -1:]
+
+        gram = features.T @ features + self.ridge * np.eye(features.shape[1])
+        self.coefficients = np.linalg.solve(gram, features.T @ changes)
+        return self
+
+    def weights(self, steps):
+        if self.coefficients is None:
+            raise ValueError("trend forecaster must be fitted before predicting")
+        if max(steps) > len(self.steps):
+            raise ValueError(f"trend forecaster was fitted for up to {len(self.steps) * STEP_MINUTES} minutes")
+        return self.coefficients[:, np.asarray(steps) - 1]
+
+    def get_params(self):
+        return _as_lists({"points": self.points, "ridge": self.ridge, "coefficients": self.coefficients, "steps": self.steps})
+
+class ARForecaster(Forecaster):
+    """
+    ARIMA(order, 1, 0): each reading-to-reading change is a linear function of
+    the previous `order` changes, fitted by conditional least squares and
+    iterated forward for multi-step forecasts.
+    """
+
+    name = "ar"
+
+    def __init__(self, order=6, ridge=1.0):
+        self.order = order
+        self.ridge = ridge
+        self.intercept = 0.0
+        self.coefficients = None # Oldest lag first
+        self._path = None
+
+    @property
+    def history(self):
+        return self.order + 1
+
+    def fit(self, values, timestamps=None, trends=None):
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.arange(values.size) * READING_INTERVAL_SECONDS if timestamps is None else np.asarray(timestamps)
+        windows = np.diff(lagged_windows(values, timestamps, self.order + 2), axis=1)
+        if len(windows) < self.order + 1:
+            raise ValueError("Not enough contiguous readings to fit the AR forecaster")
+
+        design = np.column_stack((np.ones(len(windows)), windows[:, :-1]))
+        gram = design.T @ design + self.ridge * np.diag([0.0] + [1.0] * self.order)
+        solution = np.linalg.solve(gram, design.T @ windows[:, -1])
+        self.intercept = float(solution[0])
+        self.coefficients = solution[1:]
+        self._path = None
+        return self
+
+    def set_params(self, params):
+        self._path = None
+        return super().set_params(params)
+
+    def path_matrix(self, max_steps):
+        """
+        (order + 1, max_steps) matrix G such that [last `order` changes, 1] @ G
+        is the forecast change from the current reading at each step, so a
+        forecast is one dot product instead of iterating the recursion.
+        """
+        if self.coefficients is None:
+            raise ValueError("ar forecaster must be fitted before predicting")
+        if self._path is None or self._path.shape[1] < max_steps:
+            transition = np.zeros((self.order + 1, self.order + 1))
+            transition[:self.order, :self.order - 1] = np.eye(self.order)[:, 1:] # Shift lags left
+            transition[:self.order, self.order - 1] = self.coefficients # Newest lag is the next change
+            transition[self.order, self.order - 1] = self.intercept
+            transition[self.order, self.order] = 1
+            # Column vector picking the newest lag out of the (lags, 1) state
+            pick = np.zeros(self.order + 1)
+            pick[self.order - 1] = 1
+            columns, total, operator = [], np.zeros(self.order + 1), np.eye(self.order + 1)
+            for _ in range(max_steps):
+                operator = operator @ transition
+                total = total + operator @ pick
+                columns.append(total)
+            self._path = np.column_stack(columns)
+        return self._path[:, :max_steps]
+
+    @property
+    def batch_key(self):
+        return (self.name, self.order)
+
+    def features(self, values, trends):
+        return np.column_stack((np.diff(values, axis=1), np.ones(values.shape[0])))
+
+    def weights(self, steps):
+        return self.path_matrix(max(steps))[:, np.asarray(steps) - 1]
+
+    def get_params(self):
+        return _as_lists({"order": self.order, "ridge": self.ridge, "intercept": self.intercept, "coefficients": self.coefficients})
+
+class EchoStateForecaster(Forecaster):
+    """
+    Echo state network: a fixed random recurrent layer driven by the scaled
+    readings, with a linear readout from its state to the change at each
+    horizon fitted by ridge regression. Only the readout is trained, so
+    fitting is one linear solve.
+    """
+
+    name = "rnn"
+
+    def __init__(self, units=50, history=24, spectral_radius=0.9, input_scale=0.5, ridge=1e-2, seed=0):
+        self.units = units
+        self.history = history # Readings run through the network before each prediction
+        self.spectral_radius = spectral_radius
+        self.input_scale = input_scale
+        self.ridge = ridge
+        self.seed = seed
+        self.steps = None
+        self.readout = None
+        self._init_reservoir()
+
+    def _init_reservoir(self):
+        rng = np.random.default_rng(self.seed)
+        self.input_weights = rng.uniform(-self.input_scale, self.input_scale, size=(self.units, 2))
+        weights = rng.uniform(-0.5, 0.5, size=(self.units, self.units))
+        self.recurrent_weights = weights * (self.spectral_radius / np.max(np.abs(np.linalg.eigvals(weights))))
+
+    @staticmethod
+    def _inputs(values):
+        # Scaled level and reading-to-reading change; columns for each step
+        values = np.atleast_2d(values)
+        changes = np.diff(values, axis=-1, prepend=values[..., :1])
+        return (values - 140) / 60, changes / 10
+
+    def _states(self, windows):
+        """Final reservoir state after running each window (samples, history) through the network."""
+        levels, changes = self._inputs(windows)
+        state = np.zeros((windows.shape[0], self.units))
+        for step in range(windows.shape[1]):
+            drive = np.column_stack((levels[:, step], changes[:, step])) @ self.input_weights.T
+            state = np.tanh(drive + state @ self.recurrent_weights.T)
+        return np.column_stack((state, np.ones(windows.shape[0])))
+
+    def fit(self, values, timestamps=None, trends=None, max_minutes=max(HORIZONS)):
+        values = np.asarray(values, dtype=np.float64)
+        timestamps = np.arange(values.size) * READING_INTERVAL_SECONDS if timestamps is None else np.asarray(timestamps)
+        self.steps = list(range(1, horizon_steps([max_minutes])[0] + 1))
+        windows = lagged_windows(values, timestamps, self.history, self.steps[-1])
+        if len(windows) < self.units:
+            raise ValueError("Not enough contiguous readings to fit the rnn forecaster")
+
+        states = self._states(windows[:, :self.history])
+        changes = windows[:, self.history:] - windows[:, self.history - 1:self.history]
+        gram = states.T @ states + self.ridge * np.eye(states.shape[1])
+        self.readout = np.linalg.solve(gram, states.T @ changes)
+        return self
+
+    @property
+    def batch_key(self):
+        # Same reservoir settings and seed means the same fixed recurrent weights
+        return (self.name, self.units, self.history, self.spectral_radius, self.input_scale, self.seed)
+
+    def features(self, values, trends):
+        return self._states(values)
+
+    def weights(self, steps):
+        if self.readout is None:
+            raise ValueError("rnn forecaster must be fitted before predicting")
+        if max(steps) > len(self.steps):
+            raise ValueError(f"rnn forecaster was fitted for up to {len(self.steps) * STEP_MINUTES} minutes")
+        return self.readout[:, np.asarray(steps) - 1]
+
+    def get_params(self):
+        return _as_lists({
+            "units": self.units, "history": self.history, "spectral_radius": self.spectral_radius,
+            "input_scale": self.input_scale, "ridge": self.ridge, "seed": self.seed, "steps": self.steps,
+            "input_weights": self.input_weights, "recurrent_weights": self.recurrent_weights, "readout": self.readout,
+        })
+
+FORECASTERS = {cls.name: cls for cls in (LinearForecaster, TrendForecaster, ARForecaster, EchoStateForecaster)}
+
+def make_forecaster(name, **options):
+    if name not in FORECASTERS:
+        raise ValueError(f"Unknown forecaster: {name}")
+    return FORECASTERS[name](**options)
+
+def load_forecaster(path):
+    with open(path) as model_file:
+        saved = json.load(model_file)
+    forecaster = make_forecaster(saved["model"])
+    return forecaster.set_params(saved["params"])
+
+def recent_matrix(readings_by_user, length):
+    """
+    Stack each user's recent readings (lists newest first) into a (N, length)
+    values array, oldest first and NaN-padded on the left, plus each user's
+    current trend index (N,).
+    """
+    values = np.full((len(readings_by_user), length), np.nan)
+    trends = np.full(len(readings_by_user), 4)
+    for row, readings in enumerate(readings_by_user):
+        recent = readings[:length]
+        if recent:
+            values[row, length - len(recent):] = [reading.value for reading in reversed(recent)]
+            trends[row] = recent[0].trend
+    return values, trends
+
+def _predict_group(forecasters, values, trends, horizons):
+    """Score rows whose forecasters share a batch_key: features once, then one batched product."""
+    first = forecasters[0]
+    recent, trends = _recent_columns(values, trends, first.history)
+    features = first.features(recent, trends)
+    steps = horizon_steps(horizons)
+    if not first.fitted_weights:
+        return np.maximum(recent[:, -1:] + features @ first.weights(steps), 0)
+
+    # Weights once per distinct model, then gathered per row
+    unique, rows = {}, []
+    for forecaster in forecasters:
+        rows.append(unique.setdefault(id(forecaster), (len(unique), forecaster))[0])
+    if len(unique) == 1:
+        changes = features @ first.weights(steps)
+    else:
+        weights = np.stack([forecaster.weights(steps) for _, forecaster in unique.values()])
+        changes = np.einsum("nk,nkh->nh", features, weights[np.asarray(rows)])
+    return np.maximum(recent[:, -1:] + changes, 0)
+
+def _predict_chunk(forecasters, values, trends, horizons):
+    return predict_many(forecasters, values, trends, horizons)
+
+def predict_many(forecasters, values, trends=None, horizons=HORIZONS, processes=None):
+    """
+    (N, horizons) predictions for N users, each row scored with its own fitted
+    forecaster (or one forecaster shared by every row). Rows are grouped by
+    model shape, so a fleet of ARForecasters is one einsum, not N predict calls.
+
+    processes: split the rows across this many worker processes; only worth it
+    for heavy models such as "rnn" with many thousands of users.
+    """
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    count = values.shape[0]
+    if isinstance(forecasters, Forecaster):
+        forecasters = [forecasters] * count
+    if len(forecasters) != count:
+        raise ValueError("Need one forecaster per row of values")
+    if trends is not None:
+        trends = np.asarray(trends)
+    predictions = np.full((count, len(horizons)), np.nan)
+    if count == 0:
+        return predictions
+
+    if processes and processes > 1 and count > processes:
+        from concurrent.futures import ProcessPoolExecutor
+
+        chunks = np.array_split(np.arange(count), processes)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [(rows, pool.submit(_predict_chunk, [forecasters[row] for row in rows], values[rows],
+                                           None if trends is None else trends[rows], horizons)) for rows in chunks]
+            for rows, future in futures:
+                predictions[rows] = future.result()
+        return predictions
+
+    groups = {}
+    for row, forecaster in enumerate(forecasters):
+        groups.setdefault(forecaster.batch_key, []).append(row)
+    for rows in groups.values():
+        rows = np.asarray(rows)
+        group_values = values[rows]
+        group_trends = None if trends is None else trends[rows]
+        complete = ~np.isnan(group_values[:, -forecasters[rows[0]].history:]).any(axis=1)
+        if complete.any():
+            predictions[rows[complete]] = _predict_group(
+                [forecasters[row] for row in rows[complete]], group_values[complete],
+                None if group_trends is None else group_trends[complete], horizons)
+    return predictions
+
+def _fit_one(name, options, readings):
+    try:
+        return make_forecaster(name, **options).fit_readings(readings)
+    except ValueError:
+        return None # Not enough history yet
+
+def fit_many(histories, model="ar", processes=None, **options):
+    """Fit one forecaster per history (lists of readings, newest first); None where there isn't enough data."""
+    if processes and processes > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            return list(pool.map(_fit_one, [model] * len(histories), [options] * len(histories), histories))
+    return [_fit_one(model, options, readings) for readings in histories]
+
+def predicted_below(user_ids, predictions, horizons=HORIZONS, minutes=30, threshold=70):
+    """The user_ids whose prediction `minutes` ahead is below `threshold` mg/dL, lowest first."""
+    column = predictions[:, list(horizons).index(minutes)]
+    order = np.argsort(column)
+    return [user_ids[row] for row in order if column[row] < threshold]
+
+class ForecastModels:
+    """
+    Fitted forecasters per user, fitted on the user's stored history and
+    saved under `model_dir`, so each process loads them instead of refitting.
+    Models are refitted once they are older than `refit_seconds`. A user
+    without enough history to fit is remembered for as long, so get()
+    raises ValueError again without re-reading the history every call.
+    """
+
+    def __init__(self, model_dir="forecast_models", model="ar", history_days=14, refit_seconds=24 * 60 * 60, **options):
+        self.model_dir = model_dir
+        self.model = model
+        self.history_days = history_days
+        self.refit_seconds = refit_seconds
+        self.options = options
+        self._fitted = {} # user_id -> (forecaster, or the ValueError fitting raised, fitted_at)
+
+    def path(self, user_id):
+        safe_user_id = re.sub(r"[^\w.-]", "_", str(user_id))
+        return os.path.join(self.model_dir, f"{safe_user_id}-{self.model}.json")
+
+    def get(self, user_id, store, now=None):
+        """
+        The user's fitted forecaster, loading or fitting it from `store` (a
+        ReadingStore) if needed. Raises ValueError if there isn't enough history.
+        """
+        now = time.time() if now is None else now
+        if user_id in self._fitted:
+            forecaster, fitted_at = self._fitted[user_id]
+            if now - fitted_at < self.refit_seconds:
+                if isinstance(forecaster, ValueError):
+                    raise ValueError(str(forecaster))
+                return forecaster
+
+        path = self.path(user_id)
+        if os.path.exists(path) and now - os.path.getmtime(path) < self.refit_seconds:
+            forecaster, fitted_at = load_forecaster(path), os.path.getmtime(path)
+        else:
+            readings = store.get_readings(start=now - self.history_days * 24 * 60 * 60)
+            try:
+                forecaster = make_forecaster(self.model, **self.options).fit_readings(readings)
+            except ValueError as e:
+                self._fitted[user_id] = (e, now)
+                raise
+            os.makedirs(self.model_dir, exist_ok=True)
+            forecaster.save(path)
+            fitted_at = now
+        self._fitted[user_id] = (forecaster, fitted_at)
+        return forecaster
+
+    def forecast(self, user_id, store, horizons=HORIZONS):
+        """{horizon minutes: predicted mg/dL} from the user's latest stored readings."""
+        forecaster = self.get(user_id, store)
+        readings = store.get_readings(max_count=forecaster.history)
+        if len(readings) < forecaster.history:
+            return {}
+        return forecaster.predict_readings(readings, horizons)
+
+    def forecast_many(self, stores, horizons=HORIZONS, processes=None):
+        """
+        Forecast every user in `stores` ({user_id: ReadingStore}) at once.
+        Returns (user_ids, predictions) with one row per user, NaN where a
+        user has too few recent readings.
+        """
+        user_ids = list(stores)
+        forecasters = []
+        for user_id in user_ids:
+            try:
+                forecasters.append(self.get(user_id, stores[user_id]))
+            except ValueError:
+                # Not enough history to fit yet; a line through the last readings needs no fitting
+                forecasters.append(LinearForecaster())
+        length = max((forecaster.history for forecaster in forecasters), default=1)
+        values, trends = recent_matrix([stores[user_id].get_readings(max_count=length) for user_id in user_ids], length)
+        return user_ids, predict_many(forecasters, values, trends, horizons, processes)
@@ -46,14 +46,13 @@ if in_range_glucose:
     plt.axhline(y=70, color='green', linestyle='--', linewidth=1, alpha=0.5, xmin=min(in_range_glucose)/len(glucose_values), xmax=max(in_range_glucose)/len(glucose_values)) # In-range glucose
     plt.axhline(y=150, color='green', linestyle='--', linewidth=1, alpha=0.5, xmin=min(in_range_glucose)/len(glucose_values), xmax=max(in_range_glucose)/len(glucose_values)) # In-range glucose
 
-# Plot trend arrows
-for i, arrow in enumerate(trend_arrows):
-    if arrow == "↑":
-        plt.scatter(timestamps[i], glucose_values[i], color='green', marker='^', s=50)
-    elif arrow == "↓":
-        plt.scatter(timestamps[i], glucose_values[i], color='red', marker='v', s=50)
-    else:
-        plt.scatter(timestamps[i], glucose_values[i], color='orange', marker='o', s=50)
+# Plot trend arrows, one scatter per trend class
+rising = [i for i, arrow in enumerate(trend_arrows) if arrow == "↑"]
+falling = [i for i, arrow in enumerate(trend_arrows) if arrow == "↓"]
+steady = [i for i, arrow in enumerate(trend_arrows) if arrow not in ("↑", "↓")]
+for indexes, color, marker in ((rising, 'green', '^'), (falling, 'red', 'v'), (steady, 'orange', 'o')):
+    if indexes:
+        plt.scatter([timestamps[i] for i in indexes], [glucose_values[i] for i in indexes], color=color, marker=marker, s=50)
 
 # Plot settings
 plt.title('Dexcom Glucose Readings Over the Past Day')
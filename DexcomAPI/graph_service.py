@@ -0,0 +1,141 @@
+# graph_service.py
+'''
+    Glucose graph rendering with a cache of finished images.
+
+    Graphs are drawn on the non-interactive Agg canvas (no pyplot global
+    state, so it's safe from web threads) with one scatter call per trend
+    class, and the encoded PNG/SVG is cached per (user, units, window, latest
+    reading). A graph is only rendered again once a new reading arrives.
+'''
+
+import io
+import threading
+from collections import OrderedDict
+import numpy as np
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+matplotlib.set_loglevel("warning")
+
+MGDL_PER_MMOL = 18.01559
+MIMETYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+# (trend arrows, color, marker) for each scatter series
+TREND_STYLES = (
+    (("↑",), "orange", "^"),
+    (("↓",), "red", "v"),
+)
+STEADY_STYLE = ("green", "o")
+
+def render_glucose_graph(readings, units="mgdl", fmt="png", low_mgdl=70, high_mgdl=180):
+    """Render readings (newest first, as pydexcom returns them) to PNG or SVG bytes."""
+    readings = list(reversed(readings))
+    timestamps = np.array([reading.datetime for reading in readings], dtype=object)
+    values = np.array([reading.value for reading in readings], dtype=float)
+    arrows = np.array([reading.trend_arrow for reading in readings], dtype=object)
+    low, high = low_mgdl, high_mgdl
+    if units == "mmol":
+        values = np.round(values / MGDL_PER_MMOL, 1)
+        low, high = round(low / MGDL_PER_MMOL, 1), round(high / MGDL_PER_MMOL, 1)
+
+    figure = Figure(figsize=(10, 5))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.plot(timestamps, values, color='black', linewidth=1)
+
+    if values.size:
+        if (values < low).any():
+            axes.axhline(y=values.min(), color='red', linestyle='--', linewidth=1, alpha=0.5)
+        if (values > high).any():
+            axes.axhline(y=values.max(), color='red', linestyle='--', linewidth=1, alpha=0.5)
+        axes.axhline(y=low, color='green', linestyle='--', linewidth=1, alpha=0.5)
+        axes.axhline(y=high, color='green', linestyle='--', linewidth=1, alpha=0.5)
+
+    steady = np.ones(values.shape, dtype=bool)
+    for trend_arrows, color, marker in TREND_STYLES:
+        mask = np.isin(arrows, trend_arrows)
+        steady &= ~mask
+        if mask.any():
+            axes.scatter(timestamps[mask], values[mask], color=color, marker=marker, s=25)
+    if steady.any():
+        color, marker = STEADY_STYLE
+        axes.scatter(timestamps[steady], values[steady], color=color, marker=marker, s=25)
+
+    axes.set_title('Dexcom Glucose Readings Over the Past Day')
+    axes.set_xlabel('Time (Day / Hour)')
+    axes.set_ylabel('Glucose Level (mmol/L)' if units == "mmol" else 'Glucose Level (mg/dL)')
+    axes.tick_params(axis='x', labelrotation=45)
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format=fmt)
+    return buffer.getvalue()
+
+def render_agp_graph(report, units="mgdl", fmt="png", low_mgdl=70, high_mgdl=180):
+    """Render an agp.agp_report profile (5-95% and 25-75% bands around the median) to PNG or SVG bytes."""
+    hours = np.array(report["minutes_of_day"], dtype=float) / 60
+    bands = {key: np.array([np.nan if value is None else value for value in report[key]], dtype=float)
+             for key in ("p5", "p25", "p50", "p75", "p95")}
+    low, high = low_mgdl, high_mgdl
+    if units == "mmol":
+        bands = {key: values / MGDL_PER_MMOL for key, values in bands.items()}
+        low, high = round(low / MGDL_PER_MMOL, 1), round(high / MGDL_PER_MMOL, 1)
+
+    figure = Figure(figsize=(10, 5))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    axes.fill_between(hours, bands["p5"], bands["p95"], color='steelblue', alpha=0.2, linewidth=0, label='5-95%')
+    axes.fill_between(hours, bands["p25"], bands["p75"], color='steelblue', alpha=0.45, linewidth=0, label='25-75%')
+    axes.plot(hours, bands["p50"], color='navy', linewidth=2, label='Median')
+    axes.axhline(y=low, color='green', linestyle='--', linewidth=1, alpha=0.5)
+    axes.axhline(y=high, color='green', linestyle='--', linewidth=1, alpha=0.5)
+
+    axes.set_title(f'Ambulatory Glucose Profile ({report["days"]:g} days)')
+    axes.set_xlabel('Time of Day (Hour)')
+    axes.set_ylabel('Glucose Level (mmol/L)' if units == "mmol" else 'Glucose Level (mg/dL)')
+    axes.set_xlim(0, 24)
+    axes.set_xticks(range(0, 25, 3))
+    axes.legend(loc='upper right')
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format=fmt)
+    return buffer.getvalue()
+
+class GraphCache:
+    """Bounded, thread-safe LRU of rendered graph bytes (or anything else costly to build per key)."""
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key, render):
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return self._images[key]
+            self.misses += 1
+        image = render()
+        with self._lock:
+            self._images[key] = image
+            while len(self._images) > self.max_entries:
+                self._images.popitem(last=False)
+        return image
+
+graph_cache = GraphCache()
+
+def get_glucose_graph(source, user_id, units="mgdl", fmt="png", minutes=1440, low_mgdl=70, high_mgdl=180, cache=graph_cache):
+    """
+    Return (image bytes, latest reading timestamp) for `source`'s last `minutes`,
+    rendering only if this (user, units, window, latest reading) isn't cached.
+    """
+    readings = source.get_glucose_readings(minutes=minutes, max_count=min(288, minutes // 5 + 1))
+    latest = int(readings[0].datetime.timestamp()) if readings else None
+    key = (user_id, units, fmt, minutes, low_mgdl, high_mgdl, latest)
+    image = cache.get_or_render(key, lambda: render_glucose_graph(readings, units, fmt, low_mgdl, high_mgdl))
+    return image, latest
@@ -0,0 +1,314 @@
+# instrumentation.py
+'''
+    Call accounting for everything that leaves the process.
+
+    Wrap the Dexcom client, DB connections and notification transports, and
+    every call through them is counted with its latency and bytes, twice:
+    in process-wide Prometheus-style counters and histograms (served by
+    init_app() at /metrics), and in the current request or job, so a page
+    that fetches from Dexcom 25 times shows up as one request with 25
+    upstream calls. span() times a block of code inside a request; a
+    request's spans and upstream time are returned in a Server-Timing
+    header that browser dev tools show, and each request or job can be
+    logged as one JSON line (instrumentation_log=1).
+'''
+
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100)
+
+DEXCOM_METHODS = ("get_glucose_readings", "get_current_glucose_reading", "get_latest_glucose_reading")
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in labels) + "}"
+
+class Registry:
+    """Thread-safe counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(float) # (name, labels) -> value
+        self._histograms = {} # (name, labels) -> [bucket counts..., sum, count]
+        self._buckets = {}
+
+    def inc(self, name, amount=1, help_text="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("counter", help_text))
+            self._counters[key] += amount
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, help_text="", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help_text))
+            self._buckets.setdefault(name, buckets)
+            series = self._histograms.setdefault(key, [0] * (len(buckets) + 2))
+            for index, bound in enumerate(self._buckets[name]):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def value(self, name, **labels):
+        """A counter's value, or a histogram's observation count."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key in self._histograms:
+                return self._histograms[key][-1]
+            return self._counters.get(key, 0)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(series) for key, series in self._histograms.items()}
+            kinds = dict(self._help)
+        lines = []
+        for name, (kind, help_text) in sorted(kinds.items()):
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_label_text(labels)} {value:g}")
+                continue
+            for (metric, labels), series in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self._buckets[name], series):
+                    lines.append(f"{name}_bucket{_label_text(labels + (('le', f'{bound:g}'),))} {count}")
+                lines.append(f"{name}_bucket{_label_text(labels + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{name}_sum{_label_text(labels)} {series[-2]:g}")
+                lines.append(f"{name}_count{_label_text(labels)} {series[-1]}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+class Context:
+    """Upstream calls and spans of one request or job."""
+
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.started = time.perf_counter()
+        self.calls = defaultdict(lambda: [0, 0.0, 0]) # service -> [calls, seconds, bytes]
+        self.spans = [] # (name, start offset seconds, duration seconds)
+
+    def record(self, service, seconds, size):
+        totals = self.calls[service]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += size
+
+    def summary(self):
+        return {
+            self.kind: self.name,
+            "seconds": round(time.perf_counter() - self.started, 6),
+            "upstream": {service: {"calls": calls, "seconds": round(seconds, 6), "bytes": size}
+                         for service, (calls, seconds, size) in self.calls.items()},
+            "spans": [{"name": name, "start": round(start, 6), "seconds": round(duration, 6)}
+                      for name, start, duration in self.spans],
+        }
+
+    def server_timing(self):
+        """A Server-Timing header value: each span and each upstream service's total time, in ms."""
+        entries = [f"{name.replace(' ', '_')};dur={duration * 1000:.2f}" for name, _, duration in self.spans]
+        entries += [f"{service};desc=\"{calls} call{'s' if calls != 1 else ''}\";dur={seconds * 1000:.2f}"
+                    for service, (calls, seconds, _) in self.calls.items()]
+        return ", ".join(entries)
+
+_current = contextvars.ContextVar("instrumentation_context", default=None)
+
+def current():
+    """The active request/job Context, or None outside one."""
+    return _current.get()
+
+def log_enabled():
+    return os.getenv("instrumentation_log", "").lower() in ("1", "true", "yes")
+
+@contextmanager
+def job(name, kind="job", registry=registry):
+    """Account every instrumented call inside the block to one job (e.g. one poll of one user)."""
+    context = Context(kind, name)
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+        finish(context, registry)
+
+def finish(context, registry=registry):
+    for service, (calls, _, _) in context.calls.items():
+        registry.observe(f"dexval_upstream_calls_per_{context.kind}", calls, COUNT_BUCKETS,
+                         f"Upstream calls made by one {context.kind}", service=service)
+    if log_enabled():
+        logging.info(json.dumps(context.summary()))
+
+@contextmanager
+def span(name):
+    """Time a block as a named span of the current request or job (a no-op outside one)."""
+    context = current()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if context is not None:
+            context.spans.append((name, start - context.started, time.perf_counter() - start))
+
+def record_call(service, method, seconds, size=0, error=None, registry=registry):
+    """Account one upstream call, in the registry and the current request or job."""
+    status = "error" if error else "ok"
+    registry.inc("dexval_upstream_calls_total", 1, "Calls to Dexcom, databases and notifiers",
+                 service=service, method=method, status=status)
+    registry.observe("dexval_upstream_seconds", seconds, LATENCY_BUCKETS, "Upstream call latency",
+                     service=service, method=method)
+    if size:
+        registry.inc("dexval_upstream_bytes_total", size, "Bytes sent to or received from upstream",
+                     service=service, method=method)
+    context = current()
+    if context is not None:
+        context.record(service, seconds, size)
+
+def _timed(service, method, func, size=None, registry=registry):
+    """Wrap `func` so each call is recorded; size(result, args, kwargs) estimates the bytes moved."""
+    @wraps(func)
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            record_call(service, method, time.perf_counter() - start, error=e, registry=registry)
+            raise
+        record_call(service, method, time.perf_counter() - start,
+                    size(result, args, kwargs) if size else 0, registry=registry)
+        return result
+    return call
+
+def _readings_size(result, args, kwargs):
+    # About what Share sends per reading, for clients that don't expose the response size
+    if result is None:
+        return 0
+    count = len(result) if isinstance(result, list) else 1
+    return count * 110
+
+class InstrumentedDexcom:
+    """
+    A Dexcom client (pydexcom, CachedDexcom, SyntheticDexcom, ...) whose
+    reading calls are counted. Everything else passes through.
+    """
+
+    def __init__(self, dexcom, service="dexcom", registry=registry):
+        self.dexcom = dexcom
+        for method in DEXCOM_METHODS:
+            if hasattr(dexcom, method):
+                setattr(self, method, _timed(service, method, getattr(dexcom, method), _readings_size, registry))
+
+    def __getattr__(self, name):
+        return getattr(self.dexcom, name)
+
+class InstrumentedCursor:
+    def __init__(self, cursor, service, registry=registry):
+        self._cursor = cursor
+        self.execute = _timed(service, "execute", cursor.execute, registry=registry)
+        self.executemany = _timed(service, "executemany", cursor.executemany, registry=registry)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+class InstrumentedConnection:
+    """A DB-API connection whose statements and commits are counted."""
+
+    def __init__(self, connection, service, registry=registry):
+        self._connection = connection
+        self._service = service
+        self._registry = registry
+        self.commit = _timed(service, "commit", connection.commit, registry=registry)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs), self._service, self._registry)
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+def instrument_connect(connect, service, registry=registry):
+    """Wrap a zero-argument connection factory (e.g. a pool's get_connection) so its connections are counted."""
+    timed_connect = _timed(service, "connect", connect, registry=registry)
+
+    @wraps(connect)
+    def instrumented():
+        return InstrumentedConnection(timed_connect(), service, registry)
+    return instrumented
+
+def instrument_store(store, service=None, registry=registry):
+    """Count a ReadingStore's (or BulkReadingWriter's) database calls, as `service` (default: its dialect). Returns the store."""
+    store._connect = instrument_connect(store._connect, service or getattr(store, "dialect", "db"), registry)
+    return store
+
+class InstrumentedTransport:
+    """A notification transport (SMTPTransport, TwilioTransport, ...) whose sends are counted."""
+
+    def __init__(self, transport, service, registry=registry):
+        self.transport = transport
+        self.send = _timed(service, "send", transport.send,
+                           lambda result, args, kwargs: len(str(args[1] if len(args) > 1 else kwargs.get("body", ""))),
+                           registry)
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+def instrument_transports(transports, registry=registry):
+    """Wrap NotificationDispatcher transport factories so every transport they make is counted."""
+    services = {"email": "smtp", "sms": "twilio"}
+    return {channel: (lambda factory=factory, service=services.get(channel, channel):
+                      InstrumentedTransport(factory(), service, registry))
+            for channel, factory in transports.items()}
+
+def init_app(app, registry=registry, endpoint="/metrics"):
+    """
+    Account each Flask request's upstream calls, add a Server-Timing header,
+    and serve the registry at `endpoint` for Prometheus to scrape.
+    """
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request():
+        g.instrumentation = Context("request", request.endpoint or request.path)
+        g.instrumentation_token = _current.set(g.instrumentation)
+
+    @app.after_request
+    def finish_request(response):
+        context = g.pop("instrumentation", None)
+        if context is None:
+            return response
+        _current.reset(g.pop("instrumentation_token"))
+        seconds = time.perf_counter() - context.started
+        registry.inc("dexval_http_requests_total", 1, "HTTP requests served",
+                     endpoint=context.name, status=response.status_code)
+        registry.observe("dexval_http_request_seconds", seconds, LATENCY_BUCKETS, "HTTP request latency",
+                         endpoint=context.name)
+        timing = context.server_timing()
+        response.headers["Server-Timing"] = f"total;dur={seconds * 1000:.2f}" + (f", {timing}" if timing else "")
+        finish(context, registry)
+        return response
+
+    @app.route(endpoint)
+    def prometheus_metrics():
+        return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+    return registry
@@ -0,0 +1,92 @@
+# live.py
+'''
+    Fan-out of new glucose readings to server-sent event clients.
+
+    One background poller per process watches the reading source and, when a
+    new reading lands, pushes it (with refreshed metrics) to every connected
+    viewer. Viewers never cause upstream requests of their own.
+'''
+
+import json
+import logging
+import queue
+import threading
+import time
+
+class LiveFeed:
+    def __init__(self, get_source, latest_timestamp, build_payload, poll_seconds=30, heartbeat_seconds=15):
+        """
+        get_source: returns the ReadingStore or Dexcom-like client to watch
+        latest_timestamp: latest_timestamp(source) -> epoch seconds of the newest reading, or None
+        build_payload: build_payload(source, latest) -> JSON-serializable event data
+        """
+        self.get_source = get_source
+        self.latest_timestamp = latest_timestamp
+        self.build_payload = build_payload
+        self.poll_seconds = poll_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.last_event = None
+        self._latest = None
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def _ensure_poller(self):
+        # Started lazily so each forked web worker gets its own thread
+        with self._lock:
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll_forever, daemon=True)
+                self._poller.start()
+
+    def _poll_forever(self):
+        while True:
+            try:
+                self.poll_once()
+            except Exception as e:
+                logging.error(f"Live feed poll failed: {e}")
+            time.sleep(self.poll_seconds)
+
+    def poll_once(self):
+        """Check the source once and publish if there is a new reading. Returns True if published."""
+        source = self.get_source()
+        latest = self.latest_timestamp(source)
+        if latest is None or latest == self._latest:
+            return False
+        self._latest = latest
+        self.publish(latest, self.build_payload(source, latest))
+        return True
+
+    def publish(self, event_id, data):
+        event = f"id: {event_id}\ndata: {json.dumps(data)}\n\n"
+        with self._lock:
+            self.last_event = event
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            # A slow client only ever needs the newest event, so replace anything unsent
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def events(self):
+        """Generator of SSE-formatted strings for one client, starting with the current state."""
+        self._ensure_poller()
+        subscriber = queue.Queue(maxsize=1)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            last_event = self.last_event
+        try:
+            if last_event:
+                yield last_event
+            while True:
+                try:
+                    yield subscriber.get(timeout=self.heartbeat_seconds)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
@@ -3,7 +3,7 @@
 import os
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from defs import get_dexcom_connection, get_sender_email_credentials, get_receiver_email, get_dexcom_connection_access
+from defs import get_dexcom_connection, get_sender_email_credentials, get_receiver_email
 from stat_functions import verbose_message_mgdl, verbose_message_mmol, concise_message_mdgl, concise_message_mmol, generate_bit_board, generate_glucose_graph_mdgl, generate_glucose_graph_mmol
 from database import insert_glucose_readings
 # import pydexcom
@@ -0,0 +1,138 @@
+#metrics.py
+'''
+    Vectorized glycemic metrics over NumPy arrays.
+
+    Readings are held as two parallel arrays: mg/dL values and reading
+    times as int64 epoch seconds. Every metric is a handful of array ops,
+    so multi-month histories cost about the same as a single day.
+'''
+
+import math
+
+import numpy as np
+
+MGDL_PER_MMOL = 18.01559
+
+MGDL_METRICS = ("average", "median", "stdev", "min", "max", "range")
+
+def to_arrays(readings):
+    """Convert pydexcom readings to (values, timestamps) arrays."""
+    count = len(readings)
+    values = np.fromiter((reading.value for reading in readings), dtype=np.int16, count=count)
+    timestamps = np.fromiter((int(reading.datetime.timestamp()) for reading in readings), dtype=np.int64, count=count)
+    return values, timestamps
+
+def select_period(values, timestamps, start=None, end=None):
+    """Return the values and timestamps with start <= timestamp <= end (epoch seconds)."""
+    mask = np.ones(timestamps.shape, dtype=bool)
+    if start is not None:
+        mask &= timestamps >= start
+    if end is not None:
+        mask &= timestamps <= end
+    return values[mask], timestamps[mask]
+
+def empty_metrics():
+    """Metrics for a period with no readings: every value is None."""
+    metrics = {"count": 0, "mgdl_above_high": 0, "mgdl_below_low": 0}
+    for name in MGDL_METRICS:
+        metrics[f"{name}_mgdl"] = None
+        metrics[f"{name}_mmol"] = None
+    metrics.update({
+        "time_in_range_percentage": None,
+        "time_below_range_percentage": None,
+        "time_above_range_percentage": None,
+        "coef_variation_percentage": None,
+        "glycemic_variability_index": None,
+        "estimated_a1c": None,
+    })
+    return metrics
+
+def metrics_from_totals(count, total, total_squares, minimum, maximum, below_count, above_count,
+                        below_area, above_area, median=None):
+    """
+    The compute_metrics dict from running totals (count, sum and sum of
+    squares of the values, the range counts and areas), as kept by
+    rolling_stats and the rollup tables. median is None unless given.
+    """
+    if not count:
+        return empty_metrics()
+
+    mean = total / count
+    stdev = math.sqrt(max(count * total_squares - total * total, 0) / (count * (count - 1))) if count > 1 else 0.0
+    in_range_count = count - above_count - below_count
+    metrics = {
+        "count": int(count),
+        "average_mgdl": round(mean, 4),
+        "median_mgdl": round(float(median), 4) if median is not None else None,
+        "stdev_mgdl": round(stdev, 4),
+        "min_mgdl": minimum,
+        "max_mgdl": maximum,
+        "range_mgdl": int((maximum - minimum) * 100) / 100,
+        "mgdl_above_high": float(above_area),
+        "mgdl_below_low": float(below_area),
+        "time_in_range_percentage": round(in_range_count / count * 100, 4),
+        "time_below_range_percentage": round(below_count / count * 100, 4),
+        "time_above_range_percentage": round(above_count / count * 100, 4),
+    }
+    metrics["estimated_a1c"] = round((metrics["average_mgdl"] + 46.7) / 28.7, 4)
+    if mean > 0:
+        metrics["coef_variation_percentage"] = round(metrics["stdev_mgdl"] / metrics["average_mgdl"] * 100, 4)
+        metrics["glycemic_variability_index"] = round(stdev / mean * 100, 4)
+    else:
+        metrics["coef_variation_percentage"] = None
+        metrics["glycemic_variability_index"] = None
+
+    for name in MGDL_METRICS:
+        value = metrics[f"{name}_mgdl"]
+        metrics[f"{name}_mmol"] = round(value / MGDL_PER_MMOL, 4) if value is not None else None
+    return metrics
+
+def compute_metrics(values, low=70, high=180):
+    """
+    Compute every summary metric for an array of mg/dL values.
+
+    Rounding matches the stat_functions getters: 4 decimal places, with
+    min/max reported as the raw integer readings.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    count = values.size
+    if count == 0:
+        return empty_metrics()
+
+    mean = values.mean()
+    stdev = values.std(ddof=1) if count > 1 else 0.0
+    minimum = int(values.min())
+    maximum = int(values.max())
+
+    above = np.clip(values - high, 0, None)
+    below = np.clip(low - values, 0, None)
+    above_count = int(np.count_nonzero(above))
+    below_count = int(np.count_nonzero(below))
+    in_range_count = count - above_count - below_count
+
+    metrics = {
+        "count": int(count),
+        "average_mgdl": round(float(mean), 4),
+        "median_mgdl": round(float(np.median(values)), 4),
+        "stdev_mgdl": round(float(stdev), 4),
+        "min_mgdl": minimum,
+        "max_mgdl": maximum,
+        "range_mgdl": int((maximum - minimum) * 100) / 100,
+        "mgdl_above_high": float(above.sum()),
+        "mgdl_below_low": float(below.sum()),
+        "time_in_range_percentage": round(in_range_count / count * 100, 4),
+        "time_below_range_percentage": round(below_count / count * 100, 4),
+        "time_above_range_percentage": round(above_count / count * 100, 4),
+    }
+    metrics["estimated_a1c"] = round((metrics["average_mgdl"] + 46.7) / 28.7, 4)
+    if mean > 0:
+        metrics["coef_variation_percentage"] = round(metrics["stdev_mgdl"] / metrics["average_mgdl"] * 100, 4)
+        metrics["glycemic_variability_index"] = round(float(stdev / mean) * 100, 4)
+    else:
+        metrics["coef_variation_percentage"] = None
+        metrics["glycemic_variability_index"] = None
+
+    for name in MGDL_METRICS:
+        metrics[f"{name}_mmol"] = round(metrics[f"{name}_mgdl"] / MGDL_PER_MMOL, 4)
+
+    return metrics
@@ -0,0 +1,280 @@
+# notifications.py
+'''
+    Background delivery of alert notifications over SMTP and Twilio.
+
+    Alerts are queued and sent by a small pool of worker threads, so a slow
+    mail server never holds up polling. Each worker keeps its own logged-in
+    SMTP connection and Twilio client open between messages instead of doing
+    a TLS handshake and login per send, messages queued for the same
+    recipient are combined into one, and failed sends are retried with
+    exponential backoff. StubTransport stands in for the real services when
+    running locally.
+'''
+
+import logging
+import queue
+import smtplib
+import threading
+import time
+from dataclasses import dataclass
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+try:
+    from DexcomAPI.instrumentation import instrument_transports
+except ImportError:
+    from instrumentation import instrument_transports
+
+@dataclass
+class Notification:
+    recipient: str
+    body: str
+    channel: str = "email" # "email" or "sms"
+    subject: str = None
+    attempts: int = 0
+    on_failed: object = None # Called with no arguments if the dispatcher gives up on the notification
+
+def _call_all(callbacks):
+    def call():
+        for callback in callbacks:
+            callback()
+    return call
+
+class SMTPTransport:
+    """One SMTP connection, logged in once and reused until the server drops it."""
+
+    def __init__(self, username, password, host=None, port=587):
+        self.username = username
+        self.password = password
+        self.host = host or f"smtp.{username.split('@')[-1]}" # Support all email domains
+        self.port = port
+        self._server = None
+
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        server.starttls()
+        server.login(self.username, self.password)
+        return server
+
+    def send(self, recipient, body, subject=None):
+        message = MIMEMultipart()
+        message["To"] = recipient
+        if subject:
+            message["Subject"] = subject
+        message.attach(MIMEText(body, 'plain'))
+
+        if self._server is None:
+            self._server = self._connect()
+        try:
+            self._server.sendmail(self.username, recipient, message.as_string())
+        except smtplib.SMTPServerDisconnected:
+            # Idle connections get closed by the server; reconnect once and resend
+            self._server = self._connect()
+            self._server.sendmail(self.username, recipient, message.as_string())
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+class TwilioTransport:
+    """SMS through one reused Twilio client."""
+
+    def __init__(self, account_sid, auth_token, from_number):
+        from twilio.rest import Client
+
+        self.client = Client(account_sid, auth_token)
+        self.from_number = from_number
+
+    def send(self, recipient, body, subject=None):
+        self.client.messages.create(to=recipient, from_=self.from_number, body=body)
+
+    def close(self):
+        pass
+
+class StubTransport:
+    """Records messages instead of sending them; fails the first `fail_times` sends."""
+
+    def __init__(self, fail_times=0, delay_seconds=0):
+        self.sent = []
+        self.fail_times = fail_times
+        self.delay_seconds = delay_seconds
+        self._lock = threading.Lock()
+
+    def send(self, recipient, body, subject=None):
+        time.sleep(self.delay_seconds)
+        with self._lock:
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise ConnectionError("Stub transport failure")
+            self.sent.append((recipient, subject, body))
+
+    def close(self):
+        pass
+
+class NotificationDispatcher:
+    def __init__(self, transports, workers=2, max_queue=1000, batch_seconds=0.2, max_attempts=4,
+                 retry_seconds=5, max_retry_seconds=300):
+        """
+        transports: {channel: zero-argument factory returning a transport};
+            every worker calls each factory once and keeps the transport open.
+            A factory that returns the same object shares it between workers.
+        batch_seconds: how long a worker waits for more messages to the same
+            recipient before sending, so a burst of alerts becomes one message
+        max_attempts: sends of one notification before it is dropped (and
+            its on_failed is called)
+        """
+        self.transports = transports
+        self.workers = workers
+        self.batch_seconds = batch_seconds
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.stats = {"queued": 0, "sent": 0, "batched": 0, "retried": 0, "failed": 0, "dropped": 0}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stats_lock = threading.Lock()
+        self._retries = set()
+        self._retries_lock = threading.Lock() # So a retry is either requeued or abandoned by stop(), not both
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"notifier-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, notification):
+        """Queue a notification without blocking. Returns False if the queue is full (on_failed isn't called)."""
+        if notification.channel not in self.transports:
+            raise ValueError(f"No transport for channel: {notification.channel}")
+        try:
+            self._queue.put_nowait(notification)
+        except queue.Full:
+            logging.error(f"Notification queue full, dropping message to {notification.recipient}")
+            self._count("dropped")
+            return False
+        self._count("queued")
+        return True
+
+    def send(self, recipient, body, channel="email", subject=None, on_failed=None):
+        return self.submit(Notification(recipient, body, channel, subject, on_failed=on_failed))
+
+    def _collect(self, first):
+        """
+        Gather queued notifications for up to batch_seconds, grouped by
+        (channel, recipient, subject). Returns (batches, stop) where stop is
+        True if the shutdown sentinel was reached.
+        """
+        batches = {(first.channel, first.recipient, first.subject): [first]}
+        deadline = time.monotonic() + self.batch_seconds
+        while True:
+            try:
+                timeout = deadline - time.monotonic()
+                notification = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                return batches, False
+            if notification is None:
+                return batches, True
+            batches.setdefault((notification.channel, notification.recipient, notification.subject), []).append(notification)
+
+    def _work(self):
+        transports = {}
+        try:
+            stop = False
+            while not stop:
+                notification = self._queue.get()
+                if notification is None:
+                    return
+                batches, stop = self._collect(notification)
+                for (channel, recipient, subject), notifications in batches.items():
+                    self._deliver(transports, channel, recipient, subject, notifications)
+        finally:
+            for transport in transports.values():
+                transport.close()
+
+    def _deliver(self, transports, channel, recipient, subject, notifications):
+        body = "\n".join(notification.body for notification in notifications)
+        try:
+            if channel not in transports:
+                transports[channel] = self.transports[channel]()
+            transports[channel].send(recipient, body, subject)
+        except Exception as e:
+            logging.error(f"Sending {channel} to {recipient} failed: {e}")
+            transport = transports.pop(channel, None)
+            if transport is not None:
+                transport.close() # Start from a fresh connection next time
+            callbacks = [notification.on_failed for notification in notifications if notification.on_failed]
+            self._retry(Notification(recipient, body, channel, subject,
+                                     max(notification.attempts for notification in notifications) + 1,
+                                     _call_all(callbacks) if callbacks else None))
+            return
+        self._count("sent")
+        self._count("batched", len(notifications) - 1)
+
+    def _retry(self, notification):
+        if notification.attempts >= self.max_attempts or self._stopping.is_set():
+            logging.error(f"Giving up on {notification.channel} to {notification.recipient} after {notification.attempts} attempts")
+            self._give_up(notification, "failed")
+            return
+        delay = min(self.retry_seconds * 2 ** (notification.attempts - 1), self.max_retry_seconds)
+        timer = threading.Timer(delay, self._requeue, [notification])
+        timer.daemon = True
+        with self._retries_lock:
+            self._retries.add(timer)
+        self._count("retried")
+        timer.start()
+
+    def _requeue(self, notification):
+        with self._retries_lock:
+            if threading.current_thread() not in self._retries:
+                return # Abandoned by stop()
+            self._retries.discard(threading.current_thread())
+        try:
+            self._queue.put_nowait(notification)
+        except queue.Full:
+            logging.error(f"Notification queue full, dropping retry to {notification.recipient}")
+            self._give_up(notification, "dropped")
+
+    def _give_up(self, notification, outcome):
+        self._count(outcome)
+        if notification.on_failed is not None:
+            try:
+                notification.on_failed()
+            except Exception as e:
+                logging.error(f"on_failed callback for {notification.recipient} raised: {e}")
+
+    def stop(self, timeout=10):
+        """Send what is queued, then stop the workers. Pending retries are abandoned, as failures."""
+        self._stopping.set()
+        with self._retries_lock:
+            abandoned, self._retries = self._retries, set()
+        for timer in abandoned:
+            timer.cancel()
+            self._give_up(timer.args[0], "failed")
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+def dispatcher_from_config(config, **options):
+    """A dispatcher with whichever of the email/SMS channels are configured in `config`."""
+    transports = {}
+    if config.email_username and config.email_password:
+        transports["email"] = lambda: SMTPTransport(config.email_username, config.email_password)
+    if config.twilio_account_sid and config.twilio_auth_token and config.twilio_from:
+        transports["sms"] = lambda: TwilioTransport(config.twilio_account_sid, config.twilio_auth_token, config.twilio_from)
+    # Count every send, with its latency, in the instrumentation metrics
+    return NotificationDispatcher(instrument_transports(transports), **options)
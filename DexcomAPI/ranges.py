@@ -0,0 +1,101 @@
+# ranges.py
+'''
+    Per-user glucose target ranges.
+
+    A GlucoseRange is immutable and carries its thresholds in both units,
+    converted once when it is made, so the metrics code can read it from
+    any thread without locks or conversions. RangeSettings keeps each
+    user's current range. Changing a range replaces the user's object and
+    never mutates it, so a request that already holds the old range
+    finishes with consistent thresholds.
+
+    Given a ReadingStore, RangeSettings saves ranges in its database, so
+    every worker process of an app (and every app sharing the database)
+    sees a change. Each process caches a user's range for `cache_seconds`,
+    so requests don't query the database; a change made in another process
+    shows up here within that time. Without a store, ranges live in this
+    process's memory only.
+'''
+
+import time
+from dataclasses import astuple, dataclass
+
+MGDL_PER_MMOL = 18.01559
+
+def _number(value):
+    # Thresholds usually arrive as JSON or env strings; keep whole numbers as ints so they print as "70"
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+@dataclass(frozen=True)
+class GlucoseRange:
+    low_mgdl: float
+    high_mgdl: float
+    low_mmol: float
+    high_mmol: float
+
+    def __post_init__(self):
+        if not 0 < self.low_mgdl < self.high_mgdl:
+            raise ValueError(f"Invalid glucose range: {self.low_mgdl}-{self.high_mgdl} mg/dL")
+
+    @classmethod
+    def from_mgdl(cls, low, high):
+        return cls(low, high, round(low / MGDL_PER_MMOL, 1), round(high / MGDL_PER_MMOL, 1))
+
+    @classmethod
+    def from_mmol(cls, low, high):
+        return cls(round(low * MGDL_PER_MMOL, 1), round(high * MGDL_PER_MMOL, 1), low, high)
+
+    @classmethod
+    def from_units(cls, units, low, high):
+        """A range from thresholds in "mgdl" or "mmol"."""
+        if units == "mgdl":
+            return cls.from_mgdl(_number(low), _number(high))
+        if units == "mmol":
+            return cls.from_mmol(_number(low), _number(high))
+        raise ValueError(f"Unknown glucose units: {units}")
+
+    def state_mgdl(self, value):
+        return "Low" if value < self.low_mgdl else "High" if value > self.high_mgdl else "In Range"
+
+    def state_mmol(self, value):
+        return "Low" if value < self.low_mmol else "High" if value > self.high_mmol else "In Range"
+
+DEFAULT_RANGE = GlucoseRange.from_mgdl(70, 180)
+
+class RangeSettings:
+    """Each user's GlucoseRange, falling back to `default` for users who haven't set one."""
+
+    def __init__(self, default=DEFAULT_RANGE, store=None, cache_seconds=30):
+        """
+        store: a ReadingStore to keep the ranges in; None keeps them in memory
+        cache_seconds: how long a range read from the store is reused
+        """
+        self.default = default
+        self.store = store
+        self.cache_seconds = cache_seconds
+        self._ranges = {} # user_id -> range, or (range, monotonic time read) with a store
+
+    def get(self, user_id):
+        if self.store is None:
+            return self._ranges.get(user_id, self.default)
+        cached = self._ranges.get(user_id)
+        if cached is not None and time.monotonic() - cached[1] < self.cache_seconds:
+            return cached[0]
+        row = self.store.get_glucose_range(user_id)
+        glucose_range = GlucoseRange(*map(_number, row)) if row else self.default
+        self._ranges[user_id] = (glucose_range, time.monotonic())
+        return glucose_range
+
+    def set(self, user_id, glucose_range):
+        if self.store is None:
+            # A single dict assignment: readers see either the old range or the new one
+            self._ranges[user_id] = glucose_range
+        else:
+            self.store.set_glucose_range(user_id, *astuple(glucose_range))
+            self._ranges[user_id] = (glucose_range, time.monotonic())
+        return glucose_range
+
+    def update(self, user_id, units, low, high):
+        """Set a user's range from thresholds in "mgdl" or "mmol". Raises ValueError if they're invalid."""
+        return self.set(user_id, GlucoseRange.from_units(units, low, high))
@@ -0,0 +1,130 @@
+# reading_cache.py
+'''
+    Reading-aware cache in front of a Dexcom client.
+
+    Dexcom only has something new every five minutes, so a user's window of
+    readings stays fresh until their next reading is due: the last reading
+    time plus five minutes plus a grace period. Every route and script that
+    shares the cache shares one fetch per reading interval, and once the
+    window goes stale only the readings since the last one are fetched.
+'''
+
+import math
+import threading
+import time
+from pydexcom import GlucoseReading
+
+READING_INTERVAL_SECONDS = 300
+WINDOW_MINUTES = 1440 # Dexcom Share serves at most the past 24 hours
+WINDOW_MAX_COUNT = 288
+
+def make_cache(backend="simple", **options):
+    """
+    Create a cachelib backend: "simple" (in-process), "filesystem" or "redis".
+
+    A Flask-Caching `Cache` object works as well, since it has the same get/set.
+    """
+    from cachelib import FileSystemCache, RedisCache, SimpleCache
+
+    if backend == "simple":
+        return SimpleCache(**options)
+    if backend == "filesystem":
+        return FileSystemCache(options.pop("cache_dir", ".reading_cache"), **options)
+    if backend == "redis":
+        return RedisCache(**options)
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+def _timestamp(json_reading):
+    return int(GlucoseReading(json_reading).datetime.timestamp())
+
+class ReadingCache:
+    """
+    Wraps a Dexcom client and answers `get_glucose_readings`,
+    `get_current_glucose_reading` and `get_latest_glucose_reading` from the
+    cached window while it is fresh.
+    """
+
+    def __init__(self, dexcom, cache, user_id, grace_seconds=30, retry_seconds=30):
+        """
+        cache: any object with get(key) and set(key, value, timeout=...)
+        grace_seconds: extra time after a reading is due before the window goes stale
+        retry_seconds: how long to keep serving the window when the next reading is late
+        """
+        self.dexcom = dexcom
+        self.cache = cache
+        self.key = f"readings:{user_id}"
+        self.grace_seconds = grace_seconds
+        self.retry_seconds = retry_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _refresh(self, entry, now):
+        """Fetch what is missing from `entry` (or a whole window) and store the merged result."""
+        window_start = now - WINDOW_MINUTES * 60
+        if entry and entry["readings"]:
+            # Only the readings since the newest cached one
+            minutes = min(WINDOW_MINUTES, max(1, math.ceil((now - entry["latest"]) / 60)))
+            max_count = min(WINDOW_MAX_COUNT, minutes * 60 // READING_INTERVAL_SECONDS + 1)
+            known = entry["readings"]
+            covers_from = entry["covers_from"]
+        else:
+            minutes, max_count = WINDOW_MINUTES, WINDOW_MAX_COUNT
+            known = []
+            covers_from = window_start
+
+        fetched = [reading.json for reading in self.dexcom.get_glucose_readings(minutes=minutes, max_count=max_count)]
+
+        merged = {_timestamp(reading): reading for reading in known}
+        merged.update((_timestamp(reading), reading) for reading in fetched)
+        timestamps = sorted((t for t in merged if t >= window_start), reverse=True)
+        latest = timestamps[0] if timestamps else None
+
+        expires_at = latest + READING_INTERVAL_SECONDS + self.grace_seconds if latest else 0
+        if expires_at <= now:
+            # Next reading is late; don't ask again on every request
+            expires_at = now + self.retry_seconds
+
+        entry = {
+            "readings": [merged[t] for t in timestamps],
+            "latest": latest,
+            "covers_from": max(covers_from, window_start),
+            "expires_at": expires_at,
+        }
+        self.cache.set(self.key, entry, timeout=WINDOW_MINUTES * 60)
+        return entry
+
+    def _window(self, start):
+        now = time.time()
+        entry = self.cache.get(self.key)
+        if entry and entry["covers_from"] <= start and now < entry["expires_at"]:
+            self._count(hit=True)
+            return entry
+        self._count(hit=False)
+        if entry and entry["covers_from"] > start:
+            entry = None
+        return self._refresh(entry, now)
+
+    def get_glucose_readings(self, minutes=WINDOW_MINUTES, max_count=WINDOW_MAX_COUNT):
+        start = time.time() - minutes * 60
+        entry = self._window(start)
+        readings = [GlucoseReading(reading) for reading in entry["readings"][:max_count]]
+        return [reading for reading in readings if reading.datetime.timestamp() >= start]
+
+    def get_current_glucose_reading(self):
+        readings = self.get_glucose_readings(minutes=10, max_count=1)
+        return readings[0] if readings else None
+
+    def get_latest_glucose_reading(self):
+        readings = self.get_glucose_readings(minutes=WINDOW_MINUTES, max_count=1)
+        return readings[0] if readings else None
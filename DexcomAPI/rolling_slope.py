@@ -0,0 +1,99 @@
+# rolling_slope.py
+'''
+    Least-squares slope over the last few readings, updated in O(1).
+
+    Keeps running sums of x, y, x*x and x*y (x is the reading time in seconds
+    relative to the first reading seen, y the mg/dL value) for a sliding
+    window, so each new reading updates the fit with a few integer additions
+    and a forecast is one multiply-add. Readings are integers, so the sums are
+    exact and the fit never drifts however long it runs. Pure Python: no
+    pandas, scikit-learn or even NumPy import on the alerting hot path.
+'''
+
+from collections import deque
+
+READING_INTERVAL_SECONDS = 300
+
+class RollingSlope:
+    def __init__(self, points=5, max_span_seconds=None):
+        """
+        points: readings in the fit (slope.py has always used the last 5)
+        max_span_seconds: readings older than this before the newest are
+            dropped too, so a fit never spans a sensor gap; defaults to the
+            time `points` readings normally cover plus half an interval
+        """
+        self.points = points
+        self.max_span_seconds = max_span_seconds or (points - 1) * READING_INTERVAL_SECONDS + READING_INTERVAL_SECONDS // 2
+        self.latest = None
+        self._origin = None
+        self._window = deque()
+        self._sum_x = 0
+        self._sum_y = 0
+        self._sum_xx = 0
+        self._sum_xy = 0
+
+    def __len__(self):
+        return len(self._window)
+
+    def _tally(self, x, y, sign):
+        self._sum_x += sign * x
+        self._sum_y += sign * y
+        self._sum_xx += sign * x * x
+        self._sum_xy += sign * x * y
+
+    def add(self, timestamp, value):
+        """
+        Add a reading (epoch seconds, mg/dL). Readings at or before the latest
+        one are ignored. Returns True if the reading was added.
+        """
+        timestamp = int(timestamp)
+        if self.latest is not None and timestamp <= self.latest:
+            return False
+        if self._origin is None:
+            self._origin = timestamp
+        x, y = timestamp - self._origin, int(value)
+        self.latest = timestamp
+        self._window.append((x, y))
+        self._tally(x, y, 1)
+        while len(self._window) > self.points or x - self._window[0][0] > self.max_span_seconds:
+            self._tally(*self._window.popleft(), -1)
+        return True
+
+    def add_readings(self, readings):
+        """Add pydexcom-style readings in any order; returns how many were new."""
+        rows = sorted((int(reading.datetime.timestamp()), reading.value) for reading in readings)
+        return sum(self.add(timestamp, value) for timestamp, value in rows)
+
+    def fit(self):
+        """(slope in mg/dL per second, intercept at x = 0), or None with fewer than two readings."""
+        count = len(self._window)
+        if count < 2:
+            return None
+        denominator = count * self._sum_xx - self._sum_x * self._sum_x
+        slope = (count * self._sum_xy - self._sum_x * self._sum_y) / denominator
+        intercept = (self._sum_y - slope * self._sum_x) / count
+        return slope, intercept
+
+    @property
+    def rate(self):
+        """Rate of change in mg/dL per minute, or None."""
+        fit = self.fit()
+        return fit[0] * 60 if fit else None
+
+    def predict(self, minutes_ahead):
+        """Predicted mg/dL `minutes_ahead` after the latest reading (never below 0), or None."""
+        fit = self.fit()
+        if fit is None:
+            return None
+        slope, intercept = fit
+        x = self.latest - self._origin + minutes_ahead * 60
+        return max(slope * x + intercept, 0.0)
+
+    def predict_many(self, horizons=(15, 30, 45)):
+        """{minutes ahead: predicted mg/dL}, empty with fewer than two readings."""
+        fit = self.fit()
+        if fit is None:
+            return {}
+        slope, intercept = fit
+        x = self.latest - self._origin
+        return {minutes: max(slope * (x + minutes * 60) + intercept, 0.0) for minutes in horizons}
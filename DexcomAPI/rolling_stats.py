@@ -0,0 +1,198 @@
+# rolling_stats.py
+'''
+    Incremental glycemic statistics over rolling time windows.
+
+    A long-running poller sees one new reading per user every five minutes,
+    so instead of recomputing every metric over the whole window it adds the
+    new reading and evicts the ones that fell out of the window:
+
+    - mean/stdev from a running count, sum and sum of squares (mg/dL values
+      are integers, so the sums are exact and never drift)
+    - min/max from monotonic deques
+    - median from a Fenwick tree of value counts over the sensor's range
+    - time in/below/above range and the above/below-range areas as counters
+
+    Adding a reading is O(log 400) for the median and amortized O(1) for
+    everything else, and metrics() returns the same dict as
+    metrics.compute_metrics.
+'''
+
+import math
+from collections import deque
+
+try:
+    from DexcomAPI.metrics import empty_metrics, metrics_from_totals
+except ImportError:
+    from metrics import empty_metrics, metrics_from_totals
+
+DAY_SECONDS = 24 * 60 * 60
+WINDOWS = {"24h": DAY_SECONDS, "7d": 7 * DAY_SECONDS, "14d": 14 * DAY_SECONDS}
+
+# Dexcom reports 40-400 mg/dL ("LOW"/"HIGH" outside that); anything else is clamped for the median
+MAX_MGDL = 511
+
+class ValueCounts:
+    """Fenwick tree of how many readings have each mg/dL value, for order statistics."""
+
+    def __init__(self, size=MAX_MGDL + 1):
+        self.size = size
+        self._tree = [0] * (size + 1)
+        self._top_bit = 1 << (size.bit_length() - 1)
+
+    def add(self, value, count=1):
+        index = min(max(int(value), 0), self.size - 1) + 1
+        while index <= self.size:
+            self._tree[index] += count
+            index += index & -index
+
+    def kth(self, k):
+        """The k-th smallest value (1-based)."""
+        position = 0
+        step = self._top_bit
+        while step:
+            next_position = position + step
+            if next_position <= self.size and self._tree[next_position] < k:
+                position = next_position
+                k -= self._tree[next_position]
+            step >>= 1
+        return position # Zero-based value, since tree index = value + 1
+
+class RollingStats:
+    """Summary statistics over the readings in the last `window_seconds`."""
+
+    def __init__(self, window_seconds=DAY_SECONDS, low=70, high=180):
+        self.window_seconds = window_seconds
+        self.low = low
+        self.high = high
+        self.latest = None
+        self._readings = deque() # (timestamp, value), oldest first
+        self._min = deque() # Increasing values: the window minimum is at the left
+        self._max = deque() # Decreasing values: the window maximum is at the left
+        self._counts = ValueCounts()
+        self.count = 0
+        self._sum = 0
+        self._sum_squares = 0
+        self._below_count = 0
+        self._above_count = 0
+        self._below_area = 0
+        self._above_area = 0
+
+    def __len__(self):
+        return self.count
+
+    def _tally(self, value, sign):
+        self.count += sign
+        self._sum += sign * value
+        self._sum_squares += sign * value * value
+        self._counts.add(value, sign)
+        if value < self.low:
+            self._below_count += sign
+            self._below_area += sign * (self.low - value)
+        elif value > self.high:
+            self._above_count += sign
+            self._above_area += sign * (value - self.high)
+
+    def add(self, timestamp, value):
+        """
+        Add one reading (epoch seconds, mg/dL). Readings must arrive in time
+        order; one at or before the latest reading is ignored as a duplicate.
+        Returns True if the reading was added.
+        """
+        if self.latest is not None and timestamp <= self.latest:
+            return False
+        value = int(value)
+        self.latest = timestamp
+        self._readings.append((timestamp, value))
+        self._tally(value, 1)
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((timestamp, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((timestamp, value))
+        self._evict(timestamp - self.window_seconds)
+        return True
+
+    def add_readings(self, readings):
+        """Add pydexcom-style readings in any order; returns how many were new."""
+        rows = sorted((int(reading.datetime.timestamp()), reading.value) for reading in readings)
+        return sum(self.add(timestamp, value) for timestamp, value in rows)
+
+    def _evict(self, cutoff):
+        # Keep readings strictly newer than the cutoff, like a 288-reading day
+        while self._readings and self._readings[0][0] <= cutoff:
+            timestamp, value = self._readings.popleft()
+            self._tally(value, -1)
+        while self._min and self._min[0][0] <= cutoff:
+            self._min.popleft()
+        while self._max and self._max[0][0] <= cutoff:
+            self._max.popleft()
+
+    def advance(self, now):
+        """Evict readings older than the window as of `now`, even if no new reading came in."""
+        self._evict(now - self.window_seconds)
+
+    @property
+    def mean(self):
+        return self._sum / self.count if self.count else None
+
+    @property
+    def stdev(self):
+        if self.count < 2:
+            return 0.0 if self.count else None
+        variance = (self.count * self._sum_squares - self._sum * self._sum) / (self.count * (self.count - 1))
+        return math.sqrt(variance)
+
+    @property
+    def median(self):
+        if not self.count:
+            return None
+        middle = self._counts.kth((self.count + 1) // 2)
+        if self.count % 2:
+            return middle
+        return (middle + self._counts.kth(self.count // 2 + 1)) / 2
+
+    @property
+    def minimum(self):
+        return self._min[0][1] if self._min else None
+
+    @property
+    def maximum(self):
+        return self._max[0][1] if self._max else None
+
+    def metrics(self):
+        """The same dict metrics.compute_metrics returns for the readings in the window."""
+        if not self.count:
+            return empty_metrics()
+        return metrics_from_totals(self.count, self._sum, self._sum_squares, self.minimum, self.maximum,
+                                   self._below_count, self._above_count, self._below_area, self._above_area,
+                                   median=self.median)
+
+class MultiWindowStats:
+    """RollingStats for several windows at once (24h, 7d and 14d by default), fed together."""
+
+    def __init__(self, windows=None, low=70, high=180):
+        self.windows = {name: RollingStats(seconds, low, high) for name, seconds in (windows or WINDOWS).items()}
+
+    @property
+    def latest(self):
+        return max((stats.latest for stats in self.windows.values() if stats.latest is not None), default=None)
+
+    def add(self, timestamp, value):
+        added = [stats.add(timestamp, value) for stats in self.windows.values()]
+        return any(added)
+
+    def add_readings(self, readings):
+        rows = sorted((int(reading.datetime.timestamp()), reading.value) for reading in readings)
+        return sum(self.add(timestamp, value) for timestamp, value in rows)
+
+    def advance(self, now):
+        for stats in self.windows.values():
+            stats.advance(now)
+
+    def __getitem__(self, name):
+        return self.windows[name]
+
+    def metrics(self):
+        """{window name: metrics dict}"""
+        return {name: stats.metrics() for name, stats in self.windows.items()}
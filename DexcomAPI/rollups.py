@@ -0,0 +1,189 @@
+# rollups.py
+'''
+    Hourly and daily per-user summaries of the `readings` table.
+
+    Each row of `rollups_hourly` / `rollups_daily` (see schema.py) holds the
+    count, sum, sum of squares, min and max of one user's readings in one UTC
+    hour or day, plus how many were below/above the standard 70-180 mg/dL
+    range and by how much in total. Those all add up across rows, so the
+    metrics for any period can be composed from whole days, the whole hours
+    at its edges, and the few raw readings left over: a 90-day report reads
+    ~90 daily rows and a couple of dozen hourly ones instead of ~26,000
+    readings.
+
+    Rollups are refreshed from the readings of the hours a write touched, in
+    the same transaction, so they are idempotent and stay right when
+    readings are re-sent, upserted or arrive out of order.
+'''
+
+from collections import namedtuple
+
+HOUR_SECONDS = 60 * 60
+DAY_SECONDS = 24 * HOUR_SECONDS
+ROLLUP_LOW_MGDL = 70 # The range counts and areas are stored for this range only
+ROLLUP_HIGH_MGDL = 180
+MAX_USERS_PER_REFRESH = 500
+
+ROLLUP_COLUMNS = ("reading_count", "mgdl_sum", "mgdl_sum_squares", "mgdl_min", "mgdl_max",
+                  "low_count", "high_count", "below_area", "above_area")
+
+def _raw_aggregates(placeholder, low, high):
+    """
+    (SELECT expressions computing the ROLLUP_COLUMNS over readings, their
+    params) for a low/high range. The bounds are bound as they are, since a
+    range set in mmol/L is fractional in mg/dL (3.9 mmol/L is 70.3).
+    """
+    sql = ("COUNT(*), SUM(mgdl_reading), SUM(mgdl_reading * mgdl_reading), MIN(mgdl_reading), MAX(mgdl_reading), "
+           f"SUM(CASE WHEN mgdl_reading < {placeholder} THEN 1 ELSE 0 END), "
+           f"SUM(CASE WHEN mgdl_reading > {placeholder} THEN 1 ELSE 0 END), "
+           f"SUM(CASE WHEN mgdl_reading < {placeholder} THEN {placeholder} - mgdl_reading ELSE 0 END), "
+           f"SUM(CASE WHEN mgdl_reading > {placeholder} THEN mgdl_reading - {placeholder} ELSE 0 END)")
+    return sql, [low, high, low, low, high, high]
+
+def _number(value):
+    # MySQL returns SUMs as Decimal; areas below/above a fractional bound aren't whole numbers
+    return int(value) if value == int(value) else float(value)
+
+ROLLUP_AGGREGATES = ("SUM(reading_count), SUM(mgdl_sum), SUM(mgdl_sum_squares), MIN(mgdl_min), MAX(mgdl_max), "
+                     "SUM(low_count), SUM(high_count), SUM(below_area), SUM(above_area)")
+
+class Totals(namedtuple("Totals", ROLLUP_COLUMNS)):
+    """Additive summary of a set of readings; combine with +."""
+
+    __slots__ = ()
+
+    @classmethod
+    def empty(cls):
+        return cls(0, 0, 0, None, None, 0, 0, 0, 0)
+
+    @classmethod
+    def from_row(cls, row):
+        # MySQL returns every aggregate as NULL over no rows
+        if not row or not row[0]:
+            return cls.empty()
+        return cls(*(_number(value) for value in row))
+
+    def __add__(self, other):
+        if not other.reading_count:
+            return self
+        if not self.reading_count:
+            return other
+        return Totals(
+            self.reading_count + other.reading_count,
+            self.mgdl_sum + other.mgdl_sum,
+            self.mgdl_sum_squares + other.mgdl_sum_squares,
+            min(self.mgdl_min, other.mgdl_min),
+            max(self.mgdl_max, other.mgdl_max),
+            self.low_count + other.low_count,
+            self.high_count + other.high_count,
+            self.below_area + other.below_area,
+            self.above_area + other.above_area,
+        )
+
+def _bucket_bounds(start, end, size):
+    """First bucket starting at or after `start`, and the last bucket boundary at or before `end`."""
+    return -(-start // size) * size, end // size * size
+
+def _in_list(placeholder, count):
+    return ", ".join([placeholder] * count)
+
+def refresh(cursor, placeholder, user_ids, start, end):
+    """
+    Recompute the hourly and daily rollups of `user_ids` for the hours
+    holding timestamps start..end (epoch seconds, inclusive). Run it on the
+    cursor that wrote the readings, before committing.
+    """
+    user_ids = list(user_ids)
+    hour_start, hour_end = int(start) // HOUR_SECONDS * HOUR_SECONDS, (int(end) // HOUR_SECONDS + 1) * HOUR_SECONDS
+    day_start, day_end = int(start) // DAY_SECONDS * DAY_SECONDS, (int(end) // DAY_SECONDS + 1) * DAY_SECONDS
+    for offset in range(0, len(user_ids), MAX_USERS_PER_REFRESH):
+        chunk = user_ids[offset:offset + MAX_USERS_PER_REFRESH]
+        users = _in_list(placeholder, len(chunk))
+        aggregates, params = _raw_aggregates(placeholder, ROLLUP_LOW_MGDL, ROLLUP_HIGH_MGDL)
+        cursor.execute(
+            f"REPLACE INTO rollups_hourly (user_id, bucket, {', '.join(ROLLUP_COLUMNS)}) "
+            f"SELECT user_id, timestamp - timestamp % {HOUR_SECONDS}, {aggregates} "
+            f"FROM readings WHERE user_id IN ({users}) AND timestamp >= {placeholder} AND timestamp < {placeholder} "
+            f"GROUP BY user_id, timestamp - timestamp % {HOUR_SECONDS}",
+            params + chunk + [hour_start, hour_end])
+        cursor.execute(
+            f"REPLACE INTO rollups_daily (user_id, bucket, {', '.join(ROLLUP_COLUMNS)}) "
+            f"SELECT user_id, bucket - bucket % {DAY_SECONDS}, {ROLLUP_AGGREGATES} "
+            f"FROM rollups_hourly WHERE user_id IN ({users}) AND bucket >= {placeholder} AND bucket < {placeholder} "
+            f"GROUP BY user_id, bucket - bucket % {DAY_SECONDS}",
+            chunk + [day_start, day_end])
+
+def rebuild(cursor, placeholder="?"):
+    """Recompute every rollup from scratch, e.g. when the tables are first created."""
+    cursor.execute("DELETE FROM rollups_hourly")
+    cursor.execute("DELETE FROM rollups_daily")
+    aggregates, params = _raw_aggregates(placeholder, ROLLUP_LOW_MGDL, ROLLUP_HIGH_MGDL)
+    cursor.execute(
+        f"INSERT INTO rollups_hourly (user_id, bucket, {', '.join(ROLLUP_COLUMNS)}) "
+        f"SELECT user_id, timestamp - timestamp % {HOUR_SECONDS}, {aggregates} "
+        f"FROM readings GROUP BY user_id, timestamp - timestamp % {HOUR_SECONDS}", params)
+    cursor.execute(
+        f"INSERT INTO rollups_daily (user_id, bucket, {', '.join(ROLLUP_COLUMNS)}) "
+        f"SELECT user_id, bucket - bucket % {DAY_SECONDS}, {ROLLUP_AGGREGATES} "
+        f"FROM rollups_hourly GROUP BY user_id, bucket - bucket % {DAY_SECONDS}")
+
+def period_totals(cursor, placeholder, user_id, start, end, low=ROLLUP_LOW_MGDL, high=ROLLUP_HIGH_MGDL):
+    """
+    Totals of `user_id`'s readings with start <= timestamp < end, from the
+    daily rollups for whole days, hourly ones for the whole hours around
+    them, and raw readings for the rest. At most three queries, each
+    returning one row. With a range other than the rolled-up one the range
+    counts can't be composed, so everything is aggregated from the readings.
+    """
+    start, end = int(start), int(end)
+    if start >= end:
+        return Totals.empty()
+    if (low, high) != (ROLLUP_LOW_MGDL, ROLLUP_HIGH_MGDL):
+        return _raw_totals(cursor, placeholder, user_id, [(start, end)], low, high)
+
+    day_start, day_end = _bucket_bounds(start, end, DAY_SECONDS)
+    hour_start, hour_end = _bucket_bounds(start, end, HOUR_SECONDS)
+    if hour_start >= hour_end:
+        return _raw_totals(cursor, placeholder, user_id, [(start, end)], low, high)
+
+    totals = Totals.empty()
+    if day_start < day_end:
+        totals += _rollup_totals(cursor, placeholder, "rollups_daily", user_id, [(day_start, day_end)])
+        hours = [(hour_start, day_start), (day_end, hour_end)]
+    else:
+        hours = [(hour_start, hour_end)]
+    totals += _rollup_totals(cursor, placeholder, "rollups_hourly", user_id, hours)
+    totals += _raw_totals(cursor, placeholder, user_id, [(start, hour_start), (hour_end, end)], low, high)
+    return totals
+
+def _ranges_sql(column, placeholder, ranges):
+    """(SQL condition, params) matching any of the non-empty [start, end) ranges, or None."""
+    ranges = [(start, end) for start, end in ranges if start < end]
+    if not ranges:
+        return None, []
+    condition = " OR ".join(f"({column} >= {placeholder} AND {column} < {placeholder})" for _ in ranges)
+    return f"({condition})", [bound for pair in ranges for bound in pair]
+
+def _rollup_totals(cursor, placeholder, table, user_id, ranges):
+    condition, params = _ranges_sql("bucket", placeholder, ranges)
+    if condition is None:
+        return Totals.empty()
+    cursor.execute(f"SELECT {ROLLUP_AGGREGATES} FROM {table} WHERE user_id = {placeholder} AND {condition}",
+                   [user_id] + params)
+    return Totals.from_row(cursor.fetchone())
+
+def _raw_totals(cursor, placeholder, user_id, ranges, low, high):
+    condition, params = _ranges_sql("timestamp", placeholder, ranges)
+    if condition is None:
+        return Totals.empty()
+    aggregates, aggregate_params = _raw_aggregates(placeholder, low, high)
+    cursor.execute(f"SELECT {aggregates} FROM readings WHERE user_id = {placeholder} AND {condition}",
+                   aggregate_params + [user_id] + params)
+    return Totals.from_row(cursor.fetchone())
+
+def bucket_rows(cursor, placeholder, user_id, start, end, table="rollups_daily"):
+    """[(bucket start, Totals)] of `user_id`'s rollups with start <= bucket < end, oldest first."""
+    cursor.execute(f"SELECT bucket, {', '.join(ROLLUP_COLUMNS)} FROM {table} "
+                   f"WHERE user_id = {placeholder} AND bucket >= {placeholder} AND bucket < {placeholder} ORDER BY bucket",
+                   (user_id, int(start), int(end)))
+    return [(int(row[0]), Totals.from_row(row[1:])) for row in cursor.fetchall()]
@@ -0,0 +1,210 @@
+# scheduler.py
+'''
+    Long-running replacement for running auto.py from cron.
+
+    Polls many users' Dexcom Share accounts from one process. Each user is
+    polled shortly after their next reading is due (their last reading time
+    plus five minutes), not on the wall clock, and each user gets a fixed
+    offset so polls for many users don't all land in the same second.
+'''
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from defs import config, get_dexcom_connection
+from instrumentation import InstrumentedDexcom, instrument_store, job
+from database import READING_INTERVAL_SECONDS, ReadingStore, sync_readings
+from rolling_slope import RollingSlope
+from rolling_stats import WINDOWS, MultiWindowStats
+
+@dataclass
+class FollowedUser:
+    user_id: str
+    username: str
+    password: str
+    receiver_email: str = None
+    receiver_phone: str = None # SMS through Twilio, if configured
+    dexcom: object = field(default=None, repr=False) # Reused Dexcom session
+    store: object = field(default=None, repr=False)
+    stats: object = field(default=None, repr=False) # MultiWindowStats over the 24h/7d/14d windows
+    slope: object = field(default=None, repr=False) # RollingSlope over the last few readings
+    failures: int = 0
+
+def load_users(path, config):
+    """Read users from a JSON list in `path`, or fall back to the single user in the .env file."""
+    if path and os.path.exists(path):
+        with open(path) as users_file:
+            return [FollowedUser(**entry) for entry in json.load(users_file)]
+    return [FollowedUser(
+        user_id=config.dexcom_username,
+        username=config.dexcom_username,
+        password=config.dexcom_password,
+        receiver_email=config.receiver_email,
+    )]
+
+def connect_dexcom(user):
+    # Reuses the user's cached Share session instead of logging in on every start
+    return InstrumentedDexcom(get_dexcom_connection(user.username, user.password))
+
+class PollScheduler:
+    def __init__(self, users, store_path, on_reading=None, max_workers=8, grace_seconds=30,
+                 spread_seconds=30, retry_seconds=60, max_retry_seconds=900, dexcom_factory=connect_dexcom):
+        """
+        users: FollowedUser objects to poll
+        store_path: ReadingStore database shared by all users
+        on_reading: called as on_reading(user, reading) whenever a new reading arrives;
+            user.stats and user.slope already include it
+        grace_seconds: how long after a reading is due to poll, to give Share time to publish it
+        spread_seconds: per-user offsets are spread evenly-ish over this many seconds
+        retry_seconds: poll interval while a reading is late, doubled after each failure
+        """
+        self.users = list(users)
+        self.on_reading = on_reading
+        self.max_workers = max_workers
+        self.grace_seconds = grace_seconds
+        self.spread_seconds = spread_seconds
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self.dexcom_factory = dexcom_factory
+        self._finished = queue.Queue()
+        self._sequence = itertools.count()
+        for user in self.users:
+            if user.store is None:
+                user.store = instrument_store(ReadingStore(store_path, user_id=user.user_id))
+
+    def offset(self, user):
+        """A stable per-user offset in [0, spread_seconds) so polls don't all fire together."""
+        return (zlib.crc32(user.user_id.encode()) % 1000) / 1000 * self.spread_seconds
+
+    def next_poll_time(self, user, now):
+        if user.failures:
+            backoff = min(self.retry_seconds * 2 ** (user.failures - 1), self.max_retry_seconds)
+            return now + backoff + self.offset(user)
+
+        latest = user.store.get_latest_timestamp()
+        if latest is None:
+            return now + self.offset(user)
+
+        due = latest + READING_INTERVAL_SECONDS + self.grace_seconds + self.offset(user)
+        if due <= now:
+            # The reading is late (sensor warm-up, phone out of range); check again shortly
+            return now + self.retry_seconds
+        return due
+
+    def poll(self, user):
+        """Sync one user's new readings and pass the newest one to on_reading."""
+        try:
+            if user.dexcom is None:
+                user.dexcom = self.dexcom_factory(user)
+            fetched = sync_readings(user.dexcom, user.store)
+            user.failures = 0
+            self.update_stats(user)
+        except Exception as e:
+            logging.error(f"Polling {user.user_id} failed: {e}")
+            user.dexcom = None # Log in again on the next attempt
+            user.failures += 1
+            return
+
+        if fetched and self.on_reading:
+            reading = user.store.get_latest_glucose_reading()
+            try:
+                self.on_reading(user, reading)
+            except Exception as e:
+                logging.error(f"Handling reading for {user.user_id} failed: {e}")
+
+    def update_stats(self, user, now=None):
+        """Feed readings the user's rolling stats and slope haven't seen yet, loading the full history the first time."""
+        now = time.time() if now is None else now
+        if user.stats is None:
+            user.stats = MultiWindowStats()
+            user.slope = RollingSlope()
+            start = now - max(WINDOWS.values())
+        else:
+            start = (user.stats.latest or now - max(WINDOWS.values())) + 1
+        readings = user.store.get_readings(start=start)
+        user.stats.add_readings(readings)
+        user.slope.add_readings(readings[:user.slope.points])
+        user.stats.advance(now)
+
+    def _poll_and_requeue(self, user):
+        try:
+            # Each poll's Dexcom, database and notifier calls are accounted as one job
+            with job(f"poll {user.user_id}", kind="poll"):
+                self.poll(user)
+        finally:
+            self._finished.put(user)
+
+    def _schedule(self, heap, user, when):
+        heapq.heappush(heap, (when, next(self._sequence), user))
+
+    def run(self, stop_event=None):
+        """Poll until `stop_event` is set (or forever)."""
+        stop_event = stop_event or threading.Event()
+        heap = []
+        now = time.time()
+        for user in self.users:
+            self._schedule(heap, user, self.next_poll_time(user, now))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while not stop_event.is_set():
+                now = time.time()
+                while heap and heap[0][0] <= now:
+                    _, _, user = heapq.heappop(heap)
+                    pool.submit(self._poll_and_requeue, user)
+
+                timeout = min(heap[0][0] - now, 1) if heap else 1
+                try:
+                    user = self._finished.get(timeout=max(timeout, 0))
+                except queue.Empty:
+                    continue
+                while True:
+                    self._schedule(heap, user, self.next_poll_time(user, time.time()))
+                    try:
+                        user = self._finished.get_nowait()
+                    except queue.Empty:
+                        break
+
+def main():
+    from alerts import AlertEngine, notification_body
+    from notifications import dispatcher_from_config
+
+    logging.basicConfig(level=logging.INFO)
+    engine = AlertEngine(state_path=config.alert_state_path)
+    # Sends happen on the dispatcher's workers, over connections kept open between alerts
+    dispatcher = dispatcher_from_config(config).start()
+
+    def alert(user, reading):
+        alerts = engine.evaluate(user.user_id, reading, rate=user.slope.rate, predictions=user.slope.predict_many())
+        if alerts:
+            def failed():
+                # Dropped or given up on after retries: unrecord the alerts so the next reading re-sends them
+                engine.mark_failed(alerts)
+                engine.save()
+
+            body = notification_body(alerts)
+            queued = True
+            if user.receiver_email and "email" in dispatcher.transports:
+                queued &= dispatcher.send(user.receiver_email, body, on_failed=failed)
+            if user.receiver_phone and "sms" in dispatcher.transports:
+                queued &= dispatcher.send(user.receiver_phone, body, channel="sms", on_failed=failed)
+            if not queued:
+                engine.mark_failed(alerts)
+        engine.save()
+
+    users = load_users(config.users_file, config)
+    logging.info(f"Polling {len(users)} user(s)")
+    try:
+        PollScheduler(users, config.reading_store_path, on_reading=alert).run()
+    finally:
+        dispatcher.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# schema.py
+'''
+    Schema and migrations for the multi-user `readings` table.
+
+    One row per (user_id, timestamp), with the value in mg/dL, the trend, and
+    the mmol/L value as a stored generated column. The primary key is
+    clustered (InnoDB, and SQLite WITHOUT ROWID), so "latest N readings for a
+    user" and "a user's readings between t0 and t1" are range scans of one
+    user's rows that never touch the rest of the table, and they read every
+    column straight from the index. `readings_by_time` covers fleet-wide
+    scans by time (e.g. rollups of everything since the last run) without
+    touching the table rows.
+
+    On MySQL the table is partitioned by month on the timestamp, so old
+    months can be dropped or archived cheaply; ensure_partitions() adds
+    upcoming months and should be run at least monthly (the migration runs it).
+
+    Hourly and daily per-user summaries live in `rollups_hourly` and
+    `rollups_daily`, keyed by (user_id, bucket start); rollups.py keeps them
+    up to date and composes period metrics from them. `glucose_ranges` holds
+    each user's target range (ranges.RangeSettings), so every app process
+    sharing the database sees the same one.
+
+    Run `python schema.py` to migrate the configured MySQL database, or
+    `python schema.py path/to/glucose_readings.db` for a local SQLite store.
+'''
+
+import calendar
+import datetime
+import sys
+
+try:
+    from DexcomAPI import rollups
+except ImportError:
+    import rollups
+
+SCHEMA_VERSION = 4 # 1: (user_id, timestamp, mgdl_reading, trend); 2: + mmol column, clustered key, time index, partitions;
+                   # 3: + hourly/daily rollup tables; 4: + glucose_ranges
+MGDL_PER_MMOL = 18.01559
+PARTITION_HISTORY_MONTHS = 24 # Monthly partitions before this land in p_old
+PARTITION_MONTHS_AHEAD = 3
+
+SQLITE_READINGS = (
+    "CREATE TABLE IF NOT EXISTS readings ("
+    "user_id TEXT NOT NULL, "
+    "timestamp INTEGER NOT NULL, "
+    "mgdl_reading INTEGER NOT NULL, "
+    "trend TEXT, "
+    f"mmol_reading REAL GENERATED ALWAYS AS (ROUND(mgdl_reading / {MGDL_PER_MMOL}, 1)) STORED, "
+    "PRIMARY KEY (user_id, timestamp)) WITHOUT ROWID"
+)
+
+MYSQL_READINGS = (
+    "CREATE TABLE IF NOT EXISTS readings ("
+    "user_id VARCHAR(64) NOT NULL, "
+    "timestamp BIGINT NOT NULL, "
+    "mgdl_reading SMALLINT NOT NULL, "
+    "trend VARCHAR(32), "
+    f"mmol_reading DECIMAL(4,1) AS (ROUND(mgdl_reading / {MGDL_PER_MMOL}, 1)) STORED, "
+    "PRIMARY KEY (user_id, timestamp), "
+    "KEY readings_by_time (timestamp, user_id, mgdl_reading)"
+    ") ENGINE=InnoDB "
+)
+
+READINGS_BY_TIME_INDEX = "CREATE INDEX IF NOT EXISTS readings_by_time ON readings (timestamp, user_id, mgdl_reading)"
+
+ROLLUP_TABLES = ("rollups_hourly", "rollups_daily")
+
+# Thresholds in both units, as ranges.GlucoseRange holds them, so a range set in mmol/L reads back exactly
+SQLITE_RANGES = (
+    "CREATE TABLE IF NOT EXISTS glucose_ranges ("
+    "user_id TEXT PRIMARY KEY, low_mgdl REAL NOT NULL, high_mgdl REAL NOT NULL, "
+    "low_mmol REAL NOT NULL, high_mmol REAL NOT NULL) WITHOUT ROWID"
+)
+
+MYSQL_RANGES = (
+    "CREATE TABLE IF NOT EXISTS glucose_ranges ("
+    "user_id VARCHAR(255) NOT NULL PRIMARY KEY, low_mgdl DOUBLE NOT NULL, high_mgdl DOUBLE NOT NULL, "
+    "low_mmol DOUBLE NOT NULL, high_mmol DOUBLE NOT NULL) ENGINE=InnoDB"
+)
+
+def rollup_table_sql(name, dialect="sqlite"):
+    if dialect == "sqlite":
+        columns = ", ".join(f"{column} INTEGER NOT NULL" for column in rollups.ROLLUP_COLUMNS)
+        return (f"CREATE TABLE IF NOT EXISTS {name} (user_id TEXT NOT NULL, bucket INTEGER NOT NULL, {columns}, "
+                "PRIMARY KEY (user_id, bucket)) WITHOUT ROWID")
+    columns = ", ".join(f"{column} BIGINT NOT NULL" for column in rollups.ROLLUP_COLUMNS)
+    return (f"CREATE TABLE IF NOT EXISTS {name} (user_id VARCHAR(64) NOT NULL, bucket BIGINT NOT NULL, {columns}, "
+            "PRIMARY KEY (user_id, bucket)) ENGINE=InnoDB")
+
+def month_start(year, month):
+    """Epoch seconds of the first instant of a UTC month, normalizing month overflow."""
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return calendar.timegm((year, month, 1, 0, 0, 0))
+
+def partition_bounds(now=None, history_months=PARTITION_HISTORY_MONTHS, months_ahead=PARTITION_MONTHS_AHEAD):
+    """[(partition name, month start, next month start)] from history_months ago to months_ahead from now."""
+    today = datetime.datetime.fromtimestamp(now if now is not None else datetime.datetime.now().timestamp(),
+                                            datetime.timezone.utc)
+    bounds = []
+    for offset in range(-history_months, months_ahead + 1):
+        start = month_start(today.year, today.month + offset)
+        bounds.append((f"p{datetime.datetime.fromtimestamp(start, datetime.timezone.utc):%Y%m}",
+                       start, month_start(today.year, today.month + offset + 1)))
+    return bounds
+
+def partition_clause(now=None):
+    bounds = partition_bounds(now)
+    partitions = [f"PARTITION p_old VALUES LESS THAN ({bounds[0][1]})"]
+    partitions += [f"PARTITION {name} VALUES LESS THAN ({end})" for name, _, end in bounds]
+    partitions.append("PARTITION p_max VALUES LESS THAN MAXVALUE")
+    return "PARTITION BY RANGE (timestamp) (" + ", ".join(partitions) + ")"
+
+def _sqlite_table_exists(cursor, name):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+def migrate_sqlite(db):
+    """Create or upgrade the readings, rollup and range tables in a SQLite connection. Idempotent."""
+    cursor = db.cursor()
+    try:
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+        # sqlite3 commits DDL as it goes unless a transaction is open, so open one: the
+        # rebuild below either happens completely, with the new version, or not at all
+        if not db.in_transaction:
+            cursor.execute("BEGIN")
+        if version < 2:
+            # A readings_v1 already here was left by an interrupted rebuild (before it ran in a
+            # transaction), and `readings` may already be the new table; finish that rebuild instead
+            if not _sqlite_table_exists(cursor, "readings_v1") and _sqlite_table_exists(cursor, "readings"):
+                # Rebuild: SQLite can't add a stored column or drop the rowid in place
+                cursor.execute("ALTER TABLE readings RENAME TO readings_v1")
+            cursor.execute(SQLITE_READINGS)
+            if _sqlite_table_exists(cursor, "readings_v1"):
+                cursor.execute("INSERT OR IGNORE INTO readings (user_id, timestamp, mgdl_reading, trend) "
+                               "SELECT user_id, timestamp, mgdl_reading, trend FROM readings_v1")
+                cursor.execute("DROP TABLE readings_v1")
+            cursor.execute(READINGS_BY_TIME_INDEX)
+        if version < 3:
+            for name in ROLLUP_TABLES:
+                cursor.execute(rollup_table_sql(name, "sqlite"))
+            rollups.rebuild(cursor)
+        if version < 4:
+            cursor.execute(SQLITE_RANGES)
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def _mysql_version(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INT NOT NULL)")
+    cursor.execute("SELECT MAX(version) FROM schema_version")
+    row = cursor.fetchone()
+    return row[0] if row and row[0] is not None else 0
+
+def _mysql_table_exists(cursor, name):
+    cursor.execute("SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (name,))
+    return cursor.fetchone()[0] > 0
+
+def ensure_partitions(cursor, now=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """Split p_max so monthly partitions exist through `months_ahead` months from now. Returns the names added."""
+    cursor.execute("SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'readings' AND PARTITION_NAME IS NOT NULL")
+    existing = {row[0] for row in cursor.fetchall()}
+    if "p_max" not in existing:
+        return []
+    missing = [(name, end) for name, _, end in partition_bounds(now, history_months=0, months_ahead=months_ahead)
+               if name not in existing]
+    if not missing:
+        return []
+    partitions = ", ".join(f"PARTITION {name} VALUES LESS THAN ({bound})" for name, bound in missing)
+    cursor.execute(f"ALTER TABLE readings REORGANIZE PARTITION p_max INTO ({partitions}, "
+                   "PARTITION p_max VALUES LESS THAN MAXVALUE)")
+    return [name for name, _ in missing]
+
+def migrate_mysql(db, now=None):
+    """Create or upgrade the readings, rollup and range tables in a MySQL connection, and add upcoming partitions. Idempotent."""
+    cursor = db.cursor()
+    try:
+        version = _mysql_version(cursor)
+        if version < 2:
+            if _mysql_table_exists(cursor, "readings"):
+                cursor.execute(f"ALTER TABLE readings ADD COLUMN mmol_reading DECIMAL(4,1) "
+                               f"AS (ROUND(mgdl_reading / {MGDL_PER_MMOL}, 1)) STORED, "
+                               "ADD KEY readings_by_time (timestamp, user_id, mgdl_reading)")
+                cursor.execute(f"ALTER TABLE readings {partition_clause(now)}")
+            else:
+                cursor.execute(MYSQL_READINGS + partition_clause(now))
+        if version < 3:
+            for name in ROLLUP_TABLES:
+                cursor.execute(rollup_table_sql(name, "mysql"))
+            rollups.rebuild(cursor, "%s")
+        if version < 4:
+            cursor.execute(MYSQL_RANGES)
+        if version < SCHEMA_VERSION:
+            cursor.execute("DELETE FROM schema_version")
+            cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (SCHEMA_VERSION,))
+        ensure_partitions(cursor, now)
+        db.commit()
+    finally:
+        cursor.close()
+
+def migrate(db, dialect="sqlite"):
+    if dialect == "sqlite":
+        migrate_sqlite(db)
+    elif dialect == "mysql":
+        migrate_mysql(db)
+    else:
+        raise ValueError(f"Unknown dialect: {dialect}")
+
+def migrate_legacy_table(db, table_name, user_id):
+    """
+    Copy a per-person MySQL table of (timestamp DATETIME, mgdl_reading), as
+    written by database.insert_glucose_readings, into `readings` for `user_id`.
+    Those tables have no trend, so rows get 'NotComputable' (what Dexcom sends
+    when it has none). Returns the number of rows inserted.
+    """
+    if not table_name.replace("_", "").isalnum():
+        raise ValueError(f"Invalid table name: {table_name}")
+    cursor = db.cursor()
+    try:
+        cursor.execute("INSERT IGNORE INTO readings (user_id, timestamp, mgdl_reading, trend) "
+                       f"SELECT %s, UNIX_TIMESTAMP(timestamp), mgdl_reading, 'NotComputable' FROM {table_name}",
+                       (user_id,))
+        inserted = cursor.rowcount
+        db.commit()
+        return inserted
+    finally:
+        cursor.close()
+
+def main():
+    if len(sys.argv) > 1:
+        import sqlite3
+        from contextlib import closing
+
+        with closing(sqlite3.connect(sys.argv[1])) as db:
+            migrate_sqlite(db)
+        print(f"Migrated {sys.argv[1]} to schema version {SCHEMA_VERSION}")
+        return
+
+    from defs import config, get_sql_database_connection
+
+    db = get_sql_database_connection()
+    try:
+        migrate_mysql(db)
+        print(f"Migrated MySQL database {config.sql_database} to schema version {SCHEMA_VERSION}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -4,59 +4,36 @@ Meant as a predictor of IOB or Glucose Rising trends as they are linear.
 '''
 
 import os
-import pandas as pd
-import numpy as np
 import datetime
-import matplotlib.pyplot as plt
-from sklearn.linear_model import LinearRegression
 from pydexcom import Dexcom
+from database import ReadingStore, sync_readings
+from rolling_slope import RollingSlope
 
 # Initialize Dexcom client
 dexcom_username = os.getenv("DEXCOM_USERNAME")
 dexcom_password = os.getenv("DEXCOM_PASSWORD")
 dexcom = Dexcom(dexcom_username, dexcom_password)
 
-# Get glucose readings and put into DataFrame
-glucose_reading = dexcom.get_glucose_readings(minutes=1440, max_count=288)
-glucose_values = [reading.value for reading in glucose_reading]
-timestamps = [reading.datetime for reading in glucose_reading]
+# Sync new readings into the local store and read the window from there
+store = ReadingStore(os.getenv("reading_store_path", "glucose_readings.db"), user_id=dexcom_username)
+sync_readings(dexcom, store)
 
-glucose_data = pd.DataFrame({
-    "timestamps": timestamps,
-    "glucose_values": glucose_values
-})
+# Fit a line through the 5 most recent points
+glucose_reading = store.get_glucose_readings(minutes=1440, max_count=5)
+slope = RollingSlope(points=5)
+slope.add_readings(glucose_reading)
 
 current_time = datetime.datetime.now().strftime("%I:%M%p")
-current_glucose = glucose_data.iloc[0]["glucose_values"]
+current_glucose = glucose_reading[0].value
 print(f"Current Glucose Value at {current_time} (CDT): {current_glucose:.2f}")
 
-# Select the 5 most recent points
-glucose_data = glucose_data.sort_values(by="timestamps", ascending=False).head(5)
-
-# Prepare data
-X = glucose_data[["timestamps"]].astype(int) // 10**9
-y = glucose_data["glucose_values"]
-
-# Train the model
-model = LinearRegression()
-model.fit(X, y)
-
-# Predict the next 3 values
-last_timestamp = max(timestamps) if timestamps else datetime.datetime.now()
-next_timestamps = [last_timestamp + datetime.timedelta(minutes=5) * (i+1) for i in range(4)]
-
-next_predictions = pd.DataFrame({
-    "timestamps": next_timestamps
-})
-
-next_predictions["timestamps"] = next_predictions["timestamps"].astype(int) // 10**9
-
-# Predict the glucose values for the next timestamps
-next_glucose_values = model.predict(next_predictions)
-next_glucose_values = np.maximum(next_glucose_values, 0)
+# Predict the next 4 values, 5 minutes apart from the last reading
+next_glucose_values = list(slope.predict_many(horizons=(5, 10, 15, 20)).values())
+if not next_glucose_values:
+    next_glucose_values = [float(current_glucose)] * 4
 
 print(f"Current time: {datetime.datetime.now().strftime('%I:%M%p')} (CDT) - Trend: {next_glucose_values[0]:.2f}\n")
 print("Predicting future glucose levels...")
-for i in range(1, len(next_timestamps)):
+for i in range(1, len(next_glucose_values)):
     time_string = (datetime.datetime.now() + datetime.timedelta(minutes=5*i)).strftime('%I:%M%p')
     print(f"{time_string} (CDT) - Trend: {next_glucose_values[i]:.2f}")
@@ -1,13 +1,16 @@
 #stat_functions.py
-import statistics
 import logging
-import matplotlib.pyplot as plt
-import matplotlib
-from typing import List
-from datetime import datetime
+import time
+from datetime import datetime, timedelta, timezone
+
+try:
+    from DexcomAPI import metrics
+    from DexcomAPI.ranges import DEFAULT_RANGE
+except ImportError:
+    import metrics
+    from ranges import DEFAULT_RANGE
 
 logging.basicConfig(level=logging.DEBUG)
-matplotlib.set_loglevel("warning")
 
 current_glucose_mgdl = None
 current_glucose_mmol = None
@@ -21,10 +24,6 @@ median_glucose_mgdl = None
 median_glucose_mmol = None
 stdev_glucose_mgdl = None
 stdev_glucose_mmol = None
-high_mgdl = 180 # Default high glucose level
-low_mgdl = 70 # Default low glucose level
-high_mmol = 8.3 # Default high glucose level
-low_mmol = 3.9 # Default low glucose level
 min_glucose_mgdl = None
 min_glucose_mmol = None
 max_glucose_mgdl = None
@@ -34,24 +33,91 @@ glucose_range_mmol = None
 coef_variation_percentage = None
 glycemic_variability_index = None
 
-def update_value(variable_name, new_value):
-    globals()[variable_name] = new_value
-
-def set_high_mgdl(dexcom, value):
-    global high_mgdl
-    high_mgdl = value
-
-def set_low_mgdl(dexcom, value):
-    global low_mgdl
-    low_mgdl = value
-
-def set_high_mmol(dexcom, value):
-    global high_mmol
-    high_mmol = value
-
-def set_low_mmol(dexcom, value):
-    global low_mmol
-    low_mmol = value
+MGDL_PER_MMOL = metrics.MGDL_PER_MMOL
+
+class GlucoseWindow:
+    """
+    A single fetch of the past day's readings with every metric computed up front.
+
+    Pass a GlucoseWindow anywhere a `dexcom` object is expected: it answers
+    `get_current_glucose_reading` and `get_glucose_readings` from the readings it
+    already holds, so a page can be rendered from one Dexcom Share round-trip.
+    Metrics are for `glucose_range` (a ranges.GlucoseRange, default 70-180 mg/dL).
+    """
+
+    def __init__(self, readings, glucose_range=None):
+        # pydexcom returns readings newest first; keep that order
+        self.readings = list(readings or [])
+        self.values, self.timestamps = metrics.to_arrays(self.readings)
+        self.range = glucose_range or DEFAULT_RANGE
+        self.low_mgdl = self.range.low_mgdl
+        self.high_mgdl = self.range.high_mgdl
+        self.fetched_at = time.time()
+        self._compute()
+
+    @classmethod
+    def fetch(cls, dexcom, minutes=1440, max_count=288, glucose_range=None):
+        """Fetch `minutes` of readings from Dexcom and build a window from them."""
+        readings = dexcom.get_glucose_readings(minutes=minutes, max_count=max_count)
+        return cls(readings, glucose_range)
+
+    def _compute(self):
+        """Compute all mg/dL and mmol/L metrics with the vectorized metrics module."""
+        for name, value in metrics.compute_metrics(self.values, self.low_mgdl, self.high_mgdl).items():
+            setattr(self, name, value)
+
+    @property
+    def current_reading(self):
+        """The most recent reading in the window, or None if the window is empty."""
+        return self.readings[0] if self.readings else None
+
+    def get_current_glucose_reading(self):
+        """Mirror Dexcom.get_current_glucose_reading: the latest reading if under 10 minutes old."""
+        reading = self.current_reading
+        if reading is None:
+            return None
+        now = datetime.now(reading.datetime.tzinfo)
+        if now - reading.datetime > timedelta(minutes=10):
+            return None
+        return reading
+
+    def get_latest_glucose_reading(self):
+        return self.current_reading
+
+    def get_glucose_readings(self, minutes=1440, max_count=288):
+        """Mirror Dexcom.get_glucose_readings using the readings already held."""
+        if not self.readings:
+            return []
+        cutoff = datetime.now(self.readings[0].datetime.tzinfo) - timedelta(minutes=minutes)
+        return [reading for reading in self.readings if reading.datetime >= cutoff][:max_count]
+
+    def as_dict(self):
+        """All metrics in the shape the index.html template expects."""
+        current = self.current_reading
+        current_mgdl = current.value if current else None
+        current_mmol = round(current_mgdl / MGDL_PER_MMOL, 4) if current else None
+        return {
+            "current_glucose_mgdl": current_mgdl,
+            "current_glucose_mmol": current_mmol,
+            "glucose_state_mdgl": get_glucose_state_mdgl(self),
+            "glucose_state_mmol": get_glucose_state_mmol(self),
+            "average_glucose_mgdl": self.average_mgdl,
+            "average_glucose_mmol": self.average_mmol,
+            "median_glucose_mgdl": self.median_mgdl,
+            "median_glucose_mmol": self.median_mmol,
+            "stdev_glucose_mgdl": self.stdev_mgdl,
+            "stdev_glucose_mmol": self.stdev_mmol,
+            "min_glucose_mgdl": self.min_mgdl,
+            "min_glucose_mmol": self.min_mmol,
+            "max_glucose_mgdl": self.max_mgdl,
+            "max_glucose_mmol": self.max_mmol,
+            "glucose_range_mgdl": self.range_mgdl,
+            "glucose_range_mmol": self.range_mmol,
+            "time_in_range_percentage": self.time_in_range_percentage,
+            "coef_variation_percentage": self.coef_variation_percentage,
+            "glycemic_variability_index": self.glycemic_variability_index,
+            "estimated_a1c": self.estimated_a1c,
+        }
 
 def get_current_trend_arrow(dexcom):
     glucose_reading = dexcom.get_current_glucose_reading()
@@ -91,209 +157,144 @@ def get_current_value_mmol(dexcom):
         logging.error(f"An error occurred while getting current glucose value (mmol/L): {e}")
         return None
 
+def get_glucose_window(dexcom, glucose_range=None):
+    """Return `dexcom` if it is already a GlucoseWindow (for `glucose_range`, if given), otherwise fetch one."""
+    if isinstance(dexcom, GlucoseWindow):
+        if glucose_range is None or glucose_range == dexcom.range:
+            return dexcom
+        return GlucoseWindow(dexcom.readings, glucose_range)
+    return GlucoseWindow.fetch(dexcom, glucose_range=glucose_range)
+
+def get_glucose_range(dexcom, glucose_range=None):
+    """`glucose_range` if given, else the range a GlucoseWindow was built for, else the default."""
+    if glucose_range is not None:
+        return glucose_range
+    return dexcom.range if isinstance(dexcom, GlucoseWindow) else DEFAULT_RANGE
+
 def get_glucose_graph(dexcom):
-    glucose_graph = dexcom.get_glucose_readings(minutes=1440, max_count=288)
-    return glucose_graph
+    return get_glucose_window(dexcom).readings
 
 def get_glucose_values(dexcom):
-    glucose_graph = get_glucose_graph(dexcom)
-    glucose_values = [reading.value for reading in glucose_graph]
-    return glucose_values
+    return get_glucose_window(dexcom).values.tolist()
 
-def get_glucose_state_mdgl(dexcom):
+def get_glucose_state_mdgl(dexcom, glucose_range=None):
     try:
         glucose_value = get_current_value_mdgl(dexcom)
         if glucose_value is None:
             return "Unknown"
         
-        if glucose_value < low_mgdl:
-            return "Low"
-        elif glucose_value > high_mgdl:
-            return "High"
-        else:
-            return "In Range"
+        return get_glucose_range(dexcom, glucose_range).state_mgdl(glucose_value)
     except Exception as e:
         logging.error(f"An error occurred while determining glucose state (mg/dL): {e}")
         return "Unknown"
 
-def get_glucose_state_mmol(dexcom):
+def get_glucose_state_mmol(dexcom, glucose_range=None):
     try:
         glucose_value = get_current_value_mmol(dexcom)
         if glucose_value is None:
             return "Unknown"
         
-        if glucose_value < low_mmol:
-            return "Low"
-        elif glucose_value > high_mmol:
-            return "High"
-        else:
-            return "In Range"
+        return get_glucose_range(dexcom, glucose_range).state_mmol(glucose_value)
     except Exception as e:
         logging.error(f"An error occurred while determining glucose state (mmol/L): {e}")
         return "Unknown"
 
 def get_average_glucose_mgdl(dexcom):
-    glucose_values = get_glucose_values(dexcom)
-    return round(statistics.mean(glucose_values), 4)
+    return get_glucose_window(dexcom).average_mgdl
 
 def get_average_glucose_mmol(dexcom):
-    average_glucose_mgdl = get_average_glucose_mgdl(dexcom)
-    return round(average_glucose_mgdl / 18.01559, 4)
+    return get_glucose_window(dexcom).average_mmol
 
 def get_median_glucose_mgdl(dexcom):
-    glucose_values = get_glucose_values(dexcom)
-    return round(statistics.median(glucose_values), 4)
+    return get_glucose_window(dexcom).median_mgdl
 
 def get_median_glucose_mmol(dexcom):
-    median_glucose_mgdl = get_median_glucose_mgdl(dexcom)
-    return round(median_glucose_mgdl / 18.01559, 4)
+    return get_glucose_window(dexcom).median_mmol
 
 def get_stdev_glucose_mgdl(dexcom):
-    glucose_values = get_glucose_values(dexcom)
-    return round(statistics.stdev(glucose_values), 4)
+    return get_glucose_window(dexcom).stdev_mgdl
 
 def get_stdev_glucose_mmol(dexcom):
-    stdev_glucose_mgdl = get_stdev_glucose_mgdl(dexcom)
-    return round(stdev_glucose_mgdl / 18.01559, 4)
+    return get_glucose_window(dexcom).stdev_mmol
 
 def get_min_glucose_mgdl(dexcom):
-    glucose_values = get_glucose_values(dexcom)
-    return min(glucose_values)
+    return get_glucose_window(dexcom).min_mgdl
 
 def get_min_glucose_mmol(dexcom):
-    min_glucose_mgdl = get_min_glucose_mgdl(dexcom)
-    return round(min_glucose_mgdl / 18.01559, 4)
+    return get_glucose_window(dexcom).min_mmol
 
 def get_max_glucose_mgdl(dexcom):
-    glucose_values = get_glucose_values(dexcom)
-    return max(glucose_values)
+    return get_glucose_window(dexcom).max_mgdl
 
 def get_max_glucose_mmol(dexcom):
-    max_glucose_mgdl = get_max_glucose_mgdl(dexcom)
-    return round(max_glucose_mgdl / 18.01559, 4)
+    return get_glucose_window(dexcom).max_mmol
 
 def get_glucose_range_mgdl(dexcom):
-    min_glucose_mgdl = get_min_glucose_mgdl(dexcom)
-    max_glucose_mgdl = get_max_glucose_mgdl(dexcom)
-    return int((max_glucose_mgdl - min_glucose_mgdl) * 100) / 100
+    return get_glucose_window(dexcom).range_mgdl
 
 def get_glucose_range_mmol(dexcom):
-    glucose_range_mgdl = get_glucose_range_mgdl(dexcom)
-    return round(glucose_range_mgdl / 18.01559, 4)
+    return get_glucose_window(dexcom).range_mmol
 
 def get_coef_variation_percentage(dexcom):
-    stdev_glucose_mgdl = get_stdev_glucose_mgdl(dexcom) # it does not matter if you use mmol/L or md/gL here
-    average_glucose_mgdl = get_average_glucose_mgdl(dexcom)
-    return round((stdev_glucose_mgdl / average_glucose_mgdl) * 100, 4)
+    return get_glucose_window(dexcom).coef_variation_percentage
 
 def get_glycemic_variability_index(dexcom):
-    glucose_values = get_glucose_values(dexcom)
-    average_glucose_mgdl = statistics.mean(glucose_values) # it does not matter if you use mmol/L or md/gL here
-    stdev_glucose_mgdl = statistics.stdev(glucose_values)
-
-    glycemic_variability_index = (stdev_glucose_mgdl / average_glucose_mgdl) * 100
-
-    return round(glycemic_variability_index, 4)
+    return get_glucose_window(dexcom).glycemic_variability_index
 
 def get_estimated_a1c(dexcom):
-    average_glucose_mdgl = get_average_glucose_mgdl(dexcom)
-    estimated_a1c = (average_glucose_mdgl + 46.7) / 28.7
-    return round(estimated_a1c, 4) 
+    return get_glucose_window(dexcom).estimated_a1c
 
 def get_time_in_range_percentage(dexcom):
-    glucose_values = get_glucose_values(dexcom)
-    in_range_glucose = [g for g in glucose_values if low_mgdl <= g <= high_mgdl]
-    time_in_range_percentage = round((len(in_range_glucose) / len(glucose_values)) * 100, 4)
-    return time_in_range_percentage
-
-def verbose_message_mgdl(dexcom):
-    glucose_reading = dexcom.get_current_glucose_reading() # get_current_value_mgdl
-    glucose_value = glucose_reading.value
-    trend_arrow = glucose_reading.trend_arrow # get_current_trend
-    glucose_graph = dexcom.get_glucose_readings(minutes=1440, max_count=288) # glucose graph
-    glucose_values = [reading.value for reading in glucose_graph] # get_glucose_values
-
-    glucose_state = "Low" if glucose_value < low_mgdl else "High" if glucose_value > high_mgdl else "In Range" # get_glucose_state_mdgl
-
-    average_glucose_mgdl = round(statistics.mean(glucose_values), 4)
-    median_glucose_mgdl = round(statistics.median(glucose_values), 4)
-    stdev_glucose_mgdl = round(statistics.stdev(glucose_values), 4)
-    min_glucose_mgdl = min(glucose_values)
-    max_glucose_mgdl = max(glucose_values)
-    glucose_range_mgdl = int((max_glucose_mgdl - min_glucose_mgdl) * 100) / 100
-
-    in_range_glucose = [g for g in glucose_values if low_mgdl <= g <= high_mgdl]
-    time_in_range_percentage = round((len(in_range_glucose) / len(glucose_values)) * 100, 4)
-
-    mgdl_above_high = sum(reading - high_mgdl for reading in glucose_values if reading > high_mgdl)
-    mgdl_below_low = sum(low_mgdl - reading for reading in glucose_values if reading < low_mgdl)
-    total_area = (max_glucose_mgdl - high_mgdl) * time_in_range_percentage / 100 + mgdl_above_high + mgdl_below_low
-    glycemic_variability_index = ((mgdl_above_high + mgdl_below_low) / total_area) * 100
-
-    average_glucose_mmol = round(average_glucose_mgdl / 18.01559, 4)
-    estimated_a1c = round((28.7 * average_glucose_mmol + 46.7) / 28.7, 4)
-
-    message_body = f"Your current glucose level is {glucose_value} mg/dL ({glucose_reading.trend_description} {trend_arrow})\n" \
-                   f"Time of reading: {glucose_reading.datetime}\n" \
-                   f"Glucose state: {glucose_state}\n" \
-                   f"Average glucose level: {average_glucose_mgdl} mg/dL\n" \
-                   f"Estimated A1C: {estimated_a1c}\n" \
-                   f"Time in Range ({low_mgdl}-{high_mgdl} mg/dL): {time_in_range_percentage:.2f}%\n" \
-                   f"Median Glucose: {median_glucose_mgdl} mg/dL\n" \
-                   f"Standard Deviation: {stdev_glucose_mgdl} mg/dL\n" \
-                   f"Minimum Glucose: {min_glucose_mgdl} mg/dL\n" \
-                   f"Maximum Glucose: {max_glucose_mgdl} mg/dL\n" \
-                   f"Glucose Range: {glucose_range_mgdl} mg/dL\n" \
-                   f"Coef. of Variation: {round((stdev_glucose_mgdl / average_glucose_mgdl) * 100, 4)}%\n" \
-                   f"Glycemic Variability Index: {glycemic_variability_index}%" \
-                   f"Time in Range ({low_mgdl}-{high_mgdl} mg/dL): {time_in_range_percentage:.2f}%\n"
+    return get_glucose_window(dexcom).time_in_range_percentage
 
-    return message_body
+def verbose_message_mgdl(dexcom, glucose_range=None):
+    # One fetch: the current reading and every metric come from the same window
+    window = get_glucose_window(dexcom, glucose_range)
+    low_mgdl, high_mgdl = window.low_mgdl, window.high_mgdl
+    glucose_reading = window.get_current_glucose_reading()
+    if glucose_reading is None:
+        return "No glucose reading in the last 10 minutes."
 
-def verbose_message_mmol(dexcom):
-    glucose_reading = dexcom.get_current_glucose_reading()
-    glucose_value = glucose_reading.value
-    trend_arrow = glucose_reading.trend_arrow
-    glucose_graph = dexcom.get_glucose_readings(minutes=1440, max_count=288)
-    glucose_values = [reading.value for reading in glucose_graph]
-
-    glucose_values_mmol = [round(value / 18.01559, 1) for value in glucose_values]
-    glucose_value_mmol = round(glucose_value / 18.01559, 1)
-
-    glucose_state = "Low" if glucose_value_mmol < low_mmol else "High" if glucose_value_mmol > high_mmol else "In Range"
-
-    average_glucose_mmol = round(statistics.mean(glucose_values_mmol), 1)
-    median_glucose_mmol = round(statistics.median(glucose_values_mmol), 1)
-    stdev_glucose_mmol = round(statistics.stdev(glucose_values_mmol), 1)
-    min_glucose_mmol = min(glucose_values_mmol)
-    max_glucose_mmol = max(glucose_values_mmol)
-    glucose_range_mmol = int((max_glucose_mmol - min_glucose_mmol) * 100) / 100
-
-    in_range_glucose = [g for g in glucose_values_mmol if 3.9 <= g <= 8.3]
-    time_in_range_percentage = round((len(in_range_glucose) / len(glucose_values_mmol)) * 100, 1)
+    message_body = f"Your current glucose level is {glucose_reading.value} mg/dL ({glucose_reading.trend_description} {glucose_reading.trend_arrow})\n" \
+                   f"Time of reading: {glucose_reading.datetime}\n" \
+                   f"Glucose state: {window.range.state_mgdl(glucose_reading.value)}\n" \
+                   f"Average glucose level: {window.average_mgdl} mg/dL\n" \
+                   f"Estimated A1C: {window.estimated_a1c}\n" \
+                   f"Time in Range ({low_mgdl}-{high_mgdl} mg/dL): {window.time_in_range_percentage:.2f}%\n" \
+                   f"Median Glucose: {window.median_mgdl} mg/dL\n" \
+                   f"Standard Deviation: {window.stdev_mgdl} mg/dL\n" \
+                   f"Minimum Glucose: {window.min_mgdl} mg/dL\n" \
+                   f"Maximum Glucose: {window.max_mgdl} mg/dL\n" \
+                   f"Glucose Range: {window.range_mgdl} mg/dL\n" \
+                   f"Coef. of Variation: {window.coef_variation_percentage}%\n" \
+                   f"Glycemic Variability Index: {window.glycemic_variability_index}%\n" \
+                   f"Time in Range ({low_mgdl}-{high_mgdl} mg/dL): {window.time_in_range_percentage:.2f}%\n"
 
-    mmol_above_high = sum(reading - high_mmol / 18.01559 for reading in glucose_values_mmol if reading > high_mmol)
-    mmol_below_low = sum(low_mmol - reading for reading in glucose_values_mmol if reading < low_mmol)
-    total_area = (max_glucose_mmol - high_mmol) * time_in_range_percentage / 100 + mmol_above_high + mmol_below_low
-    glycemic_variability_index = ((mmol_above_high + mmol_below_low) / total_area) * 100
+    return message_body
 
-    # Use ADAG formula to estimate A1C
-    estimated_a1c = round((28.7 * average_glucose_mmol + 46.7) / 28.7, 1)
+def verbose_message_mmol(dexcom, glucose_range=None):
+    window = get_glucose_window(dexcom, glucose_range)
+    low_mmol, high_mmol = window.range.low_mmol, window.range.high_mmol
+    glucose_reading = window.get_current_glucose_reading()
+    if glucose_reading is None:
+        return "No glucose reading in the last 10 minutes."
+    glucose_value_mmol = round(glucose_reading.value / MGDL_PER_MMOL, 1)
 
-    message_body = f"Your current glucose level is {glucose_value_mmol} mmol/L ({glucose_reading.trend_description} {trend_arrow})\n" \
+    # Metrics are computed once in mg/dL against the range's mg/dL thresholds; only the display is mmol/L
+    message_body = f"Your current glucose level is {glucose_value_mmol} mmol/L ({glucose_reading.trend_description} {glucose_reading.trend_arrow})\n" \
                    f"Time of reading: {glucose_reading.datetime}\n" \
-                   f"Glucose state: {glucose_state}\n" \
-                   f"Average glucose level: {average_glucose_mmol} mmol/L\n" \
-                   f"Estimated A1C: {estimated_a1c}\n" \
-                   f"Time in Range ({low_mmol}-{high_mmol} mmol/L): {time_in_range_percentage:.1f}%\n" \
-                   f"Median Glucose: {median_glucose_mmol} mmol/L\n" \
-                   f"Standard Deviation: {stdev_glucose_mmol} mmol/L\n" \
-                   f"Minimum Glucose: {min_glucose_mmol} mmol/L\n" \
-                   f"Maximum Glucose: {max_glucose_mmol} mmol/L\n" \
-                   f"Glucose Range: {glucose_range_mmol} mmol/L\n" \
-                   f"Coef. of Variation: {round((stdev_glucose_mmol / average_glucose_mmol) * 100, 1)}%\n" \
-                   f"Glycemic Variability Index: {glycemic_variability_index}%" \
-                   f"Time in Range ({low_mmol}-{high_mmol} mmol/L): {time_in_range_percentage:.1f}%\n"
+                   f"Glucose state: {window.range.state_mmol(glucose_value_mmol)}\n" \
+                   f"Average glucose level: {round(window.average_mmol, 1)} mmol/L\n" \
+                   f"Estimated A1C: {round(window.estimated_a1c, 1)}\n" \
+                   f"Time in Range ({low_mmol}-{high_mmol} mmol/L): {window.time_in_range_percentage:.1f}%\n" \
+                   f"Median Glucose: {round(window.median_mmol, 1)} mmol/L\n" \
+                   f"Standard Deviation: {round(window.stdev_mmol, 1)} mmol/L\n" \
+                   f"Minimum Glucose: {round(window.min_mmol, 1)} mmol/L\n" \
+                   f"Maximum Glucose: {round(window.max_mmol, 1)} mmol/L\n" \
+                   f"Glucose Range: {round(window.range_mmol, 1)} mmol/L\n" \
+                   f"Coef. of Variation: {round(window.coef_variation_percentage, 1)}%\n" \
+                   f"Glycemic Variability Index: {round(window.glycemic_variability_index, 1)}%\n" \
+                   f"Time in Range ({low_mmol}-{high_mmol} mmol/L): {window.time_in_range_percentage:.1f}%\n"
 
     return message_body
 
@@ -331,128 +332,80 @@ def generate_bit_board(dexcom, height=5, width=20):
     for row in board:
         print(''.join(row))
 
-def generate_glucose_graph_mdgl(dexcom, output_path='static/dexcom_glucose_graph_mdgl.png'):
-    glucose_graph: List = dexcom.get_glucose_readings(minutes=1440, max_count=288)
-    glucose_values = [reading.value for reading in glucose_graph]
-    timestamps = [reading.datetime for reading in glucose_graph]
-    trend_arrows = [reading.trend_arrow for reading in glucose_graph]
-
-    plt.figure(figsize=(10, 5))
-    plt.plot(timestamps, glucose_values, color='black', linewidth=1)
-
-    low_glucose = [idx for idx, reading in enumerate(glucose_values) if reading < low_mgdl]
-    in_range_glucose = [idx for idx, reading in enumerate(glucose_values) if low_mgdl <= reading <= high_mgdl]
-    high_glucose = [idx for idx, reading in enumerate(glucose_values) if reading > high_mgdl]
-
-    if low_glucose:
-        plt.axhline(y=min(glucose_values), color='red', linestyle='--', linewidth=1, alpha=0.5, xmin=min(low_glucose)/len(glucose_values), xmax=max(low_glucose)/len(glucose_values))
-    if high_glucose:
-        plt.axhline(y=max(glucose_values), color='red', linestyle='--', linewidth=1, alpha=0.5, xmin=min(high_glucose)/len(glucose_values), xmax=max(high_glucose)/len(glucose_values))
-    if in_range_glucose:
-        plt.axhline(y=70, color='green', linestyle='--', linewidth=1, alpha=0.5, xmin=min(in_range_glucose)/len(glucose_values), xmax=max(in_range_glucose)/len(glucose_values))
-        plt.axhline(y=150, color='green', linestyle='--', linewidth=1, alpha=0.5, xmin=min(in_range_glucose)/len(glucose_values), xmax=max(in_range_glucose)/len(glucose_values))
-
-    for i, arrow in enumerate(trend_arrows):
-        if arrow == "↑":
-            plt.scatter(timestamps[i], glucose_values[i], color='orange', marker='^', s=25)
-        elif arrow == "↓":
-            plt.scatter(timestamps[i], glucose_values[i], color='red', marker='v', s=25)
-        else:
-            plt.scatter(timestamps[i], glucose_values[i], color='green', marker='o', s=25)
-
-    plt.title('Dexcom Glucose Readings Over the Past Day')
-    plt.xlabel('Time (Day / Hour)')
-    plt.ylabel('Glucose Level (mg/dL)')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-
-    plt.savefig(output_path)
-    plt.close()
-
-def generate_glucose_graph_mmol(dexcom, output_path='static/dexcom_glucose_graph_mmol.png'):
-    glucose_graph: List = dexcom.get_glucose_readings(minutes=1440, max_count=288)
-    glucose_values = [reading.value for reading in glucose_graph]
-    timestamps = [reading.datetime for reading in glucose_graph]
-    trend_arrows = [reading.trend_arrow for reading in glucose_graph]
-
-    glucose_values_mmol = [round(value / 18.01559, 1) for value in glucose_values]
-
-    plt.figure(figsize=(10, 5))
-    plt.plot(timestamps, glucose_values_mmol, color='black', linewidth=1)
-
-    low_glucose = [idx for idx, reading in enumerate(glucose_values_mmol) if reading < low_mmol]
-    in_range_glucose = [idx for idx, reading in enumerate(glucose_values_mmol) if low_mmol <= reading <= high_mmol]
-    high_glucose = [idx for idx, reading in enumerate(glucose_values_mmol) if reading > high_mmol]
-
-    if low_glucose:
-        plt.axhline(y=min(glucose_values_mmol), color='red', linestyle='--', linewidth=1, alpha=0.5, xmin=min(low_glucose)/len(glucose_values_mmol), xmax=max(low_glucose)/len(glucose_values_mmol))
-    if high_glucose:
-        plt.axhline(y=max(glucose_values_mmol), color='red', linestyle='--', linewidth=1, alpha=0.5, xmin=min(high_glucose)/len(glucose_values_mmol), xmax=max(high_glucose)/len(glucose_values_mmol))
-    if in_range_glucose:
-        plt.axhline(y=3.9, color='green', linestyle='--', linewidth=1, alpha=0.5, xmin=min(in_range_glucose)/len(glucose_values_mmol), xmax=max(in_range_glucose)/len(glucose_values_mmol))
-        plt.axhline(y=8.3, color='green', linestyle='--', linewidth=1, alpha=0.5, xmin=min(in_range_glucose)/len(glucose_values_mmol), xmax=max(in_range_glucose)/len(glucose_values_mmol))
-
-    for i, arrow in enumerate(trend_arrows):
-        if arrow == "↑":
-            plt.scatter(timestamps[i], glucose_values_mmol[i], color='orange', marker='^', s=25)
-        elif arrow == "↓":
-            plt.scatter(timestamps[i], glucose_values_mmol[i], color='red', marker='v', s=25)
-        else:
-            plt.scatter(timestamps[i], glucose_values_mmol[i], color='green', marker='o', s=25)
-        
-    plt.title('Dexcom Glucose Readings Over the Past Day')
-    plt.xlabel('Time (Day / Hour)')
-    plt.ylabel('Glucose Level (mmol/L)')
-    plt.xticks(rotation=45)
-    plt.tight_layout()
+def _graph_service():
+    # matplotlib takes most of a second to import, so only load it to draw a graph
+    try:
+        from DexcomAPI import graph_service
+    except ImportError:
+        import graph_service
+    return graph_service
+
+def generate_glucose_graph_mdgl(dexcom, output_path='static/dexcom_glucose_graph_mdgl.png', glucose_range=None):
+    graph_service = _graph_service()
+    glucose_range = get_glucose_range(dexcom, glucose_range)
+    glucose_graph = dexcom.get_glucose_readings(minutes=1440, max_count=288)
+    with open(output_path, 'wb') as graph_file:
+        graph_file.write(graph_service.render_glucose_graph(glucose_graph, "mgdl", "png",
+                                                            glucose_range.low_mgdl, glucose_range.high_mgdl))
 
-def get_glucose_data(dexcom):
+def generate_glucose_graph_mmol(dexcom, output_path='static/dexcom_glucose_graph_mmol.png', glucose_range=None):
+    graph_service = _graph_service()
+    glucose_range = get_glucose_range(dexcom, glucose_range)
+    glucose_graph = dexcom.get_glucose_readings(minutes=1440, max_count=288)
+    with open(output_path, 'wb') as graph_file:
+        graph_file.write(graph_service.render_glucose_graph(glucose_graph, "mmol", "png",
+                                                            glucose_range.low_mgdl, glucose_range.high_mgdl))
+
+def get_glucose_data(dexcom, glucose_range=None):
     """Fetch glucose readings once and calculate metrics."""
     try:
-        # Fetch glucose readings (bulk fetch)
-        glucose_readings = dexcom.get_glucose_readings(minutes=1440, max_count=288)
-        glucose_values = [reading.value for reading in glucose_readings]
+        window = get_glucose_window(dexcom, glucose_range)
+        if not window.count:
+            logging.error("No glucose readings returned.")
+            return None
 
         # Return data and precomputed metrics
         return {
-            "readings": glucose_readings,
-            "values": glucose_values,
-            "average_mgdl": round(statistics.mean(glucose_values), 4),
-            "median_mgdl": round(statistics.median(glucose_values), 4),
-            "stdev_mgdl": round(statistics.stdev(glucose_values), 4) if len(glucose_values) > 1 else 0,
-            "min_mgdl": min(glucose_values),
-            "max_mgdl": max(glucose_values),
-            "in_range_percentage": round(
-                len([g for g in glucose_values if low_mgdl <= g <= high_mgdl]) / len(glucose_values) * 100, 4
-            ),
+            "readings": window.readings,
+            "values": window.values.tolist(),
+            "average_mgdl": window.average_mgdl,
+            "median_mgdl": window.median_mgdl,
+            "stdev_mgdl": window.stdev_mgdl,
+            "min_mgdl": window.min_mgdl,
+            "max_mgdl": window.max_mgdl,
+            "in_range_percentage": window.time_in_range_percentage,
+            "window": window,
         }
     except Exception as e:
         logging.error(f"Error fetching glucose data: {e}")
         return None
 
-def get_glucose_metrics(dexcom):
+def get_glucose_metrics(dexcom, glucose_range=None):
     """Retrieve all glucose metrics using pre-fetched data."""
-    data = get_glucose_data(dexcom)
+    data = get_glucose_data(dexcom, glucose_range)
     if not data:
         return None
 
-    return {
-        "current_glucose_mgdl": data["readings"][-1].value if data["readings"] else None,
-        "current_glucose_mmol": round(data["readings"][-1].value / 18.01559, 4) if data["readings"] else None,
-        "average_glucose_mgdl": data["average_mgdl"],
-        "average_glucose_mmol": round(data["average_mgdl"] / 18.01559, 4),
-        "median_glucose_mgdl": data["median_mgdl"],
-        "median_glucose_mmol": round(data["median_mgdl"] / 18.01559, 4),
-        "stdev_glucose_mgdl": data["stdev_mgdl"],
-        "stdev_glucose_mmol": round(data["stdev_mgdl"] / 18.01559, 4),
-        "min_glucose_mgdl": data["min_mgdl"],
-        "min_glucose_mmol": round(data["min_mgdl"] / 18.01559, 4),
-        "max_glucose_mgdl": data["max_mgdl"],
-        "max_glucose_mmol": round(data["max_mgdl"] / 18.01559, 4),
-        "glucose_range_mgdl": round(data["max_mgdl"] - data["min_mgdl"], 4),
-        "glucose_range_mmol": round((data["max_mgdl"] - data["min_mgdl"]) / 18.01559, 4),
-        "time_in_range_percentage": data["in_range_percentage"],
-        "coef_variation_percentage": round((data["stdev_mgdl"] / data["average_mgdl"]) * 100, 4)
-        if data["average_mgdl"] > 0
-        else None,
-    }
+    return data["window"].as_dict()
+
+def get_period_metrics(store, start, end, glucose_range=None):
+    """
+    Metrics for a ReadingStore user's readings with start <= timestamp < end
+    (epoch seconds), composed from the store's hourly and daily rollups
+    instead of the raw readings. A median can't be composed, so it is None.
+    """
+    glucose_range = glucose_range or DEFAULT_RANGE
+    return metrics.metrics_from_totals(*store.get_period_totals(start, end, glucose_range.low_mgdl, glucose_range.high_mgdl))
+
+def get_report_metrics(store, days=90, now=None, glucose_range=None):
+    """Metrics for the past `days` days of stored readings, e.g. a 90-day report from ~90 rollup rows."""
+    now = time.time() if now is None else now
+    return get_period_metrics(store, now - days * 24 * 60 * 60, now + 1, glucose_range)
+
+def get_daily_metrics(store, start, end):
+    """
+    [(UTC date, metrics)] for each day in [start, end) with readings, straight
+    from the daily rollups, so time in range is for the rolled-up 70-180 mg/dL.
+    """
+    return [(datetime.fromtimestamp(day, timezone.utc).date(), metrics.metrics_from_totals(*totals))
+            for day, totals in store.get_rollups(start, end, "daily")]
@@ -1,26 +1,49 @@
 from flask import Flask, redirect, render_template, request, jsonify, session, url_for
 from flask_caching import Cache
-from DexcomAPI import defs, stat_functions as stats
+from DexcomAPI import database, defs, instrumentation, stat_functions as stats
+from DexcomAPI.credentials import get_oauth_token, request_token
+from DexcomAPI.reading_cache import ReadingCache
+from DexcomAPI.api import create_api_blueprint
+from DexcomAPI.ranges import RangeSettings
 import requests
 from authlib.integrations.flask_client import OAuth
 import requests
 import os
+import secrets
 
 app = Flask(__name__, 
             template_folder="DexcomAPI/templates", 
             static_folder="DexcomAPI/static")
-app.config["CACHE_TYPE"] = "SimpleCache"  # Use SimpleCache for in-memory caching
-app.config["CACHE_DEFAULT_TIMEOUT"] = 300  # Cache data for 5 minutes
+app.config["CACHE_TYPE"] = os.getenv("CACHE_TYPE", "SimpleCache")  # or RedisCache / FileSystemCache
 cache = Cache(app)
 
-@cache.memoize()
-def get_cached_glucose_metrics(dexcom):
-    return stats.get_glucose_metrics(dexcom)
-
 app.secret_key = defs.get_secret_key()
 
-# Initialize Dexcom object with appropriate credentials
-dexcom = defs.get_dexcom_connection()
+# Initialize Dexcom object with appropriate credentials; readings are cached until the next one is due.
+# dexcom_replay (benchmarks, demos) swaps in synthetic or recorded readings instead
+user_id = defs.config.dexcom_username
+dexcom_client = defs.get_dexcom_source() if defs.config.dexcom_replay else defs.get_dexcom_connection()
+dexcom = ReadingCache(instrumentation.InstrumentedDexcom(dexcom_client), cache, user_id=user_id)
+
+# Local reading store; routes read from here after syncing only the new readings
+store = instrumentation.instrument_store(database.ReadingStore(defs.config.reading_store_path, user_id=user_id))
+
+# Per-request upstream call counts and timings: /metrics and the Server-Timing header
+instrumentation.init_app(app)
+
+def synced_store():
+    """Bring the local store up to date (a no-op until the next reading is due) and return it."""
+    with instrumentation.span("sync"):
+        database.sync_readings(dexcom, store)
+    return store
+
+# Target ranges, kept in the reading store's database so every worker process sees a change.
+# Keyed by user_id, the account whose readings the pages show
+ranges = RangeSettings(defs.get_default_range(), store=store)
+
+app.register_blueprint(create_api_blueprint(synced_store, user_id=user_id, ranges=ranges))
+
+DEXCOM_TOKEN_URL = "https://sandbox-api.dexcom.com/v2/oauth2/token"
 
 def safe_get_value(func, *args):
     """Helper function to safely get values or return 'N/A' if None."""
@@ -31,19 +54,22 @@ def index():
     # Redirect to /show-dexcom-data to handle all glucose data logic
     return redirect('/show-dexcom-data')
 
+def update_range(units):
+    """Replace the user's target range with the low/high thresholds posted in `units`."""
+    data = request.get_json(silent=True) or {}
+    try:
+        ranges.update(user_id, units, data[f'low_{units}'], data[f'high_{units}'])
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid {units} range: {e}"}), 400
+    return jsonify({"message": f"{units} value(s) updated successfully"}), 200
+
 @app.route('/update_global_mdgl_range', methods=['POST'])
 def update_mdgl():
-    data = request.json
-    stats.high_mgdl = data['high_mgdl']
-    stats.low_mgdl = data['low_mgdl']
-    return jsonify({"message": "mdgl value(s) updated successfully"}), 200
+    return update_range("mgdl")
 
 @app.route('/update_global_mmol_range', methods=['POST'])
 def update_mmol():
-    data = request.json
-    stats.high_mmol = data['high_mmol']
-    stats.low_mmol = data['low_mmol']
-    return jsonify({"message": "mmol value(s) updated successfully"}), 200
+    return update_range("mmol")
 
 # Dexcom sign-in route
 @app.route('/dexcom-signin')
@@ -60,7 +86,7 @@ def dexcom_callback():
     dexcom_client_secret = os.getenv('DEXCOM_CLIENT_SECRET')
     auth_code = request.args.get('code')
     
-    dexcom_token_url = "https://sandbox-api.dexcom.com/v2/oauth2/token"
+    dexcom_token_url = DEXCOM_TOKEN_URL
     payload = {
         "grant_type": "authorization_code",
         "code": auth_code,
@@ -68,20 +94,23 @@ def dexcom_callback():
         "client_id": dexcom_client_id,
         "client_secret": dexcom_client_secret,
     }
-    headers = {"Content-Type": "application/x-www-form-urlencoded"}
-
-    response = requests.post(dexcom_token_url, data=payload, headers=headers)
-    if response.status_code == 200:
-        session['dexcom_token'] = response.json()['access_token']
-        # return redirect('/')
-        return redirect('/show-dexcom-data')
-    else:
-        return f"Error: {response.status_code} - {response.text}"
+    # Keep the tokens in the shared encrypted cache; the session only holds the cache key
+    token_id = session.get('dexcom_token_id') or secrets.token_urlsafe(16)
+    try:
+        request_token(defs.get_credential_cache(), f"oauth:{token_id}", dexcom_token_url, payload)
+    except requests.exceptions.RequestException as e:
+        return f"Error: {e}"
+    session['dexcom_token_id'] = token_id
+    # return redirect('/')
+    return redirect('/show-dexcom-data')
     
 @app.route('/show-dexcom-data')
 def show_dexcom_data():
-    # Check if the user is authenticated
-    access_token = session.get('dexcom_token')
+    # Check if the user is authenticated, refreshing the access token if it is about to expire
+    token_id = session.get('dexcom_token_id')
+    access_token = token_id and get_oauth_token(
+        defs.get_credential_cache(), f"oauth:{token_id}", DEXCOM_TOKEN_URL,
+        os.getenv('DEXCOM_CLIENT_ID'), os.getenv('DEXCOM_CLIENT_SECRET'))
     if not access_token:
         return redirect('/dexcom-signin')  # Redirect to sign-in if no token
 
@@ -99,8 +128,9 @@ def show_dexcom_data():
     # Make the API request
     response = requests.get(dexcom_api_url, headers=headers, params=params)
     if response.status_code == 200:
-        # Fetch and process glucose data in one place
-        glucose_data = stats.get_glucose_metrics(dexcom)
+        # Sync new readings into the store, then compute metrics from it
+        database.sync_readings(dexcom, store)
+        glucose_data = stats.get_glucose_metrics(store, ranges.get(user_id))
         if not glucose_data:
             return "Failed to retrieve glucose metrics."
 
@@ -1,5 +1,8 @@
 from flask import Flask, redirect, render_template, request, jsonify, session, url_for
-from DexcomAPI import defs, stat_functions as stats
+from DexcomAPI import database, defs, instrumentation, stat_functions as stats
+from DexcomAPI.api import create_api_blueprint
+from DexcomAPI.ranges import RangeSettings
+from DexcomAPI.reading_cache import ReadingCache, make_cache
 import requests
 from authlib.integrations.flask_client import OAuth
 import requests
@@ -35,8 +38,20 @@ auth0 = oauth.register(
     },
 )
 
-# Initialize Dexcom object with appropriate credentials
-dexcom = defs.get_dexcom_connection()
+# Live Dexcom, or synthetic or recorded readings when dexcom_replay is set
+dexcom = instrumentation.InstrumentedDexcom(defs.get_dexcom_source())
+user_id = defs.config.dexcom_username or "offline"
+
+# The JSON API reads through an in-process cache so polls share one fetch per reading
+cached_dexcom = ReadingCache(dexcom, make_cache("simple"), user_id=user_id)
+# Target ranges, kept in the reading store's database so every worker process sees a change.
+# Keyed by user_id, the account whose readings the pages show
+ranges = RangeSettings(defs.get_default_range(),
+                       store=database.ReadingStore(defs.config.reading_store_path, user_id=user_id))
+app.register_blueprint(create_api_blueprint(lambda: cached_dexcom, user_id=user_id, ranges=ranges))
+
+# Per-request upstream call counts and timings: /metrics and the Server-Timing header
+instrumentation.init_app(app)
 
 def safe_get_value(func, *args):
     """Helper function to safely get values or return 'N/A' if None."""
@@ -44,28 +59,31 @@ def safe_get_value(func, *args):
 
 @app.route('/')
 def index():
+    # Fetch the past day once; every metric below is read from this window
+    window = stats.GlucoseWindow.fetch(dexcom, glucose_range=ranges.get(user_id))
+
     # Dictionary to store glucose data
     glucose_data = {
-        'current_glucose_mgdl': safe_get_value(stats.get_current_value_mdgl, dexcom),
-        'current_glucose_mmol': safe_get_value(stats.get_current_value_mmol, dexcom),
-        'glucose_state_mdgl': safe_get_value(stats.get_glucose_state_mdgl, dexcom),
-        'glucose_state_mmol': safe_get_value(stats.get_glucose_state_mmol, dexcom),
-        'average_glucose_mgdl': safe_get_value(stats.get_average_glucose_mgdl, dexcom),
-        'average_glucose_mmol': safe_get_value(stats.get_average_glucose_mmol, dexcom),
-        'median_glucose_mgdl': safe_get_value(stats.get_median_glucose_mgdl, dexcom),
-        'median_glucose_mmol': safe_get_value(stats.get_median_glucose_mmol, dexcom),
-        'stdev_glucose_mgdl': safe_get_value(stats.get_stdev_glucose_mgdl, dexcom),
-        'stdev_glucose_mmol': safe_get_value(stats.get_stdev_glucose_mmol, dexcom),
-        'min_glucose_mgdl': safe_get_value(stats.get_min_glucose_mgdl, dexcom),
-        'min_glucose_mmol': safe_get_value(stats.get_min_glucose_mmol, dexcom),
-        'max_glucose_mgdl': safe_get_value(stats.get_max_glucose_mgdl, dexcom),
-        'max_glucose_mmol': safe_get_value(stats.get_max_glucose_mmol, dexcom),
-        'glucose_range_mgdl': safe_get_value(stats.get_glucose_range_mgdl, dexcom),
-        'glucose_range_mmol': safe_get_value(stats.get_glucose_range_mmol, dexcom),
-        'coef_variation_percentage': safe_get_value(stats.get_coef_variation_percentage, dexcom),
-        'glycemic_variability_index': safe_get_value(stats.get_glycemic_variability_index, dexcom),
-        'estimated_a1c': safe_get_value(stats.get_estimated_a1c, dexcom),
-        'time_in_range_percentage': safe_get_value(lambda: stats.time_in_range_percentage)  # Assuming this is a direct variable
+        'current_glucose_mgdl': safe_get_value(stats.get_current_value_mdgl, window),
+        'current_glucose_mmol': safe_get_value(stats.get_current_value_mmol, window),
+        'glucose_state_mdgl': safe_get_value(stats.get_glucose_state_mdgl, window),
+        'glucose_state_mmol': safe_get_value(stats.get_glucose_state_mmol, window),
+        'average_glucose_mgdl': safe_get_value(stats.get_average_glucose_mgdl, window),
+        'average_glucose_mmol': safe_get_value(stats.get_average_glucose_mmol, window),
+        'median_glucose_mgdl': safe_get_value(stats.get_median_glucose_mgdl, window),
+        'median_glucose_mmol': safe_get_value(stats.get_median_glucose_mmol, window),
+        'stdev_glucose_mgdl': safe_get_value(stats.get_stdev_glucose_mgdl, window),
+        'stdev_glucose_mmol': safe_get_value(stats.get_stdev_glucose_mmol, window),
+        'min_glucose_mgdl': safe_get_value(stats.get_min_glucose_mgdl, window),
+        'min_glucose_mmol': safe_get_value(stats.get_min_glucose_mmol, window),
+        'max_glucose_mgdl': safe_get_value(stats.get_max_glucose_mgdl, window),
+        'max_glucose_mmol': safe_get_value(stats.get_max_glucose_mmol, window),
+        'glucose_range_mgdl': safe_get_value(stats.get_glucose_range_mgdl, window),
+        'glucose_range_mmol': safe_get_value(stats.get_glucose_range_mmol, window),
+        'coef_variation_percentage': safe_get_value(stats.get_coef_variation_percentage, window),
+        'glycemic_variability_index': safe_get_value(stats.get_glycemic_variability_index, window),
+        'estimated_a1c': safe_get_value(stats.get_estimated_a1c, window),
+        'time_in_range_percentage': safe_get_value(stats.get_time_in_range_percentage, window)
     }
 
     # Render template with glucose data
@@ -122,19 +140,22 @@ def login():
     return auth0.authorize_redirect(redirect_uri=url_for('auth_callback', _external=True))
 
 
+def update_range(units):
+    """Replace the user's target range with the low/high thresholds posted in `units`."""
+    data = request.get_json(silent=True) or {}
+    try:
+        ranges.update(user_id, units, data[f'low_{units}'], data[f'high_{units}'])
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid {units} range: {e}"}), 400
+    return jsonify({"message": f"{units} value(s) updated successfully"}), 200
+
 @app.route('/update_global_mdgl_range', methods=['POST'])
 def update_mdgl():
-    data = request.json
-    stats.high_mgdl = data['high_mgdl']
-    stats.low_mgdl = data['low_mgdl']
-    return jsonify({"message": "mdgl value(s) updated successfully"}), 200
+    return update_range("mgdl")
 
 @app.route('/update_global_mmol_range', methods=['POST'])
 def update_mmol():
-    data = request.json
-    stats.high_mmol = data['high_mmol']
-    stats.low_mmol = data['low_mmol']
-    return jsonify({"message": "mmol value(s) updated successfully"}), 200
+    return update_range("mmol")
 
 @app.route('/callback')
 def auth_callback():
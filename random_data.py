@@ -1,2 +1,6 @@
-data = []
-# There is data here to 
\ No newline at end of file
+# random_data.py
+# A day of synthetic readings (newest first, like Dexcom returns them); see DexcomAPI/synthetic.py for more
+
+from DexcomAPI.synthetic import generate_readings
+
+data = generate_readings(days=1)